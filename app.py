@@ -1,196 +1,313 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import sqlite3
+from uuid import uuid4
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, current_app
 from flask_wtf.csrf import CSRFProtect
-import difflib
+from werkzeug.middleware.proxy_fix import ProxyFix
 # Import database functions
-from JENGAMART.db import get_db, close_db
+from JENGAMART.db import get_db, get_read_db, write_transaction, init_app as init_db_app
+from JENGAMART.search import search_products, suggest
+from JENGAMART.cache import get_featured_products, get_categories, get_product, get_related_products, get_facet_counts
+from JENGAMART.facets import parse_bucket, bucket_range, search_facet_counts
+from JENGAMART.cart import add_item, set_quantity, remove_item, cart_count, get_cart
+from JENGAMART.checkout import (place_order, get_order, recent_orders, CheckoutError, OutOfStock,
+                                PAYMENT_METHODS, SHIPPING_METHODS)
+from JENGAMART.assets import init_app as init_assets
+from JENGAMART.compression import init_app as init_compression
+from JENGAMART.instrumentation import init_app as init_instrumentation
+from JENGAMART.jobs import init_app as init_jobs
+from JENGAMART.warmup import warm_up
+from JENGAMART.images import product_image
+from JENGAMART.fragments import product_card, category_sidebar
+from JENGAMART.conditional import conditional, catalog_validators, static_page_validators, product_validators
+from JENGAMART.pagination import products_page, group_by_category, encode_cursor, decode_cursor
+from JENGAMART.snapshot import parse_sort, price_sorted_page
+from JENGAMART.streaming import stream_page
 # Import blueprints
 from JENGAMART.blueprints.auth import auth_bp, login_required
 from JENGAMART.blueprints.admin import admin_bp, admin_required
 
-app = Flask(__name__)
-csrf = CSRFProtect(app)
-app.secret_key = os.environ.get('SECRET_KEY', 'a-default-secret-key-for-development')
-app.config['DATABASE'] = 'jengamart.db' # Set the database path in app config
+csrf = CSRFProtect()
+
+def create_app(config=None):
+    """Builds the storefront app. Values in config override the defaults before any extension reads them.
+
+    With gunicorn --preload the app is built once in the master, warmed up,
+    and shared copy-on-write by the forked workers.
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', 'a-default-secret-key-for-development')
+    app.config['DATABASE'] = 'jengamart.db' # Set the database path in app config
+    app.config['INVENTORY_PAGE_SIZE'] = 24
+    app.config.update(config or {})
+    csrf.init_app(app)
+
+    # Behind a reverse proxy (Render, nginx) remote_addr is the proxy's address unless the
+    # X-Forwarded-* headers it sets are trusted. TRUSTED_PROXIES is the number of proxy hops;
+    # leave it at 0 when clients connect directly, or they could spoof their address.
+    trusted_proxies = int(app.config.get('TRUSTED_PROXIES', os.environ.get('JENGAMART_TRUSTED_PROXIES', 0)))
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
+    # Templates pick resized image variants through product_image()
+    app.jinja_env.globals['product_image'] = product_image
+    # Product cards and the category sidebar are rendered once per catalog version and shared
+    app.jinja_env.globals.update(product_card=product_card, category_sidebar=category_sidebar)
+
+    # gzip or brotli for dynamic text responses; registered first so its after_request hook runs last
+    init_compression(app)
+
+    # Serve static files under content-hashed URLs with far-future caching
+    init_assets(app)
+
+    # Register blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(admin_bp)
+    for rule, view, methods in ROUTES:
+        app.add_url_rule(rule, view.__name__, view, methods=methods)
+    app.context_processor(inject_cart_count)
+
+    # Opt-in latency, SQL and template metrics at /metrics (INSTRUMENTATION or JENGAMART_INSTRUMENTATION=1).
+    # Installed before the database so pooled connections use the instrumented factory.
+    init_instrumentation(app)
+
+    # Register teardown function and CLI commands for the database, and apply pending migrations
+    init_db_app(app)
+
+    # Background jobs for bulk updates and image processing (`flask jobs worker` runs a dedicated worker)
+    init_jobs(app)
+
+    # Compile templates and load the catalog now rather than on each worker's first requests
+    if app.config.get('WARM_ON_STARTUP', True):
+        warm_up(app)
+    return app
+
+def __getattr__(name):
+    # The default app is built on first use of JENGAMART.app:app, so importing
+    # this module for create_app() does not build (and migrate) a second app
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(admin_bp)
-
-# Register teardown function for database
-app.teardown_appcontext(close_db)
-
-@app.context_processor
 def inject_cart_count():
-    cart = session.get('cart', {})
-    return dict(cart_count=len(cart))
+    if 'user_id' not in session:
+        return dict(cart_count=0)
+    if 'cart_count' not in g:
+        g.cart_count = cart_count(get_read_db(), session['user_id'])
+    return dict(cart_count=g.cart_count)
 
-@app.route('/')
+@conditional(catalog_validators)
 def home():
-    conn = get_db()
-    featured_products = conn.execute('SELECT * FROM products WHERE featured = 1').fetchall()
+    featured_products = get_featured_products()
     return render_template('index.html', featured_products=featured_products)
 
-import difflib
+def inventory_page(conn, search_query, category_id, cursor=None, bucket=None, sort=None):
+    """Returns (products, next_cursor) for one page of the inventory grid."""
+    page_size = current_app.config['INVENTORY_PAGE_SIZE']
+    if sort and not search_query:
+        return price_sorted_page(conn, sort, cursor, page_size, category_id, bucket_range(bucket))
+    if not search_query:
+        # Categories with nothing in the selected price bucket are skipped without a query
+        counts = get_facet_counts(bucket=bucket)['categories']
+        categories = [category for category in get_categories() if counts.get(category['id'])]
+        return products_page(conn, categories, cursor, page_size, category_id, bucket_range(bucket))
+
+    # Search results are ordered by relevance, so their cursor is (rank, id)
+    products = search_products(conn, search_query, category_id, after=decode_cursor(cursor, (float, int)),
+                               limit=page_size + 1, price_range=bucket_range(bucket))
+    if len(products) > page_size:
+        products = products[:page_size]
+        return products, encode_cursor([products[-1]['rank'], products[-1]['id']])
+    return products, None
 
-@app.route('/inventory')
 @login_required
 def inventory():
     search_query = request.args.get('search', '')
     category_id = request.args.get('category_id') # Get category_id from URL
+    cursor = request.args.get('cursor')
+    bucket = parse_bucket(request.args.get('price'))
+    sort = parse_sort(request.args.get('sort')) if not search_query else None # Search results sort by relevance
     
-    conn = get_db()
-    categories = conn.execute('SELECT * FROM categories ORDER BY name').fetchall()
-
-    query = "SELECT p.id, p.name, p.price, p.image_file, c.name as category_name, c.id as category_id FROM products p JOIN categories c ON p.category_id = c.id WHERE 1=1"
-    params = []
-
+    conn = get_read_db()
+    categories = get_categories()
+    products, next_cursor = inventory_page(conn, search_query, category_id, cursor, bucket, sort)
+    # Sidebar counts come from the facet tables, or from the match set when searching
     if search_query:
-        query += " AND p.name LIKE ?"
-        params.append(f'%{search_query}%')
-    
-    if category_id:
-        query += " AND p.category_id = ?"
-        params.append(category_id)
-
-    products = conn.execute(query, params).fetchall()
-
-    if search_query and not products: # Only suggest if a search query was made and no products found directly
-        # Get all product names for suggestion, potentially within the selected category
-        suggestion_query = "SELECT name FROM products p JOIN categories c ON p.category_id = c.id WHERE 1=1"
-        suggestion_params = []
-        if category_id:
-            suggestion_query += " AND p.category_id = ?"
-            suggestion_params.append(category_id)
-        
-        all_product_names = [p['name'] for p in conn.execute(suggestion_query, suggestion_params).fetchall()]
-        
-        # Find close matches
-        matches = difflib.get_close_matches(search_query, all_product_names, n=1, cutoff=0.6)
-        if matches:
-            suggestion = matches[0]
+        facets = search_facet_counts(conn, search_query, category_id, bucket)
+    else:
+        facets = get_facet_counts(category_id, bucket)
+
+    if search_query and not products and not cursor: # Only suggest if a search query was made and no products found directly
+        # Suggestions come from the trigram index, potentially within the selected category
+        suggestion = suggest(conn, search_query, category_id)
+        if suggestion:
             # Preserve category_id in suggestion link
-            flash_message = f"Did you mean: <a href='{url_for('inventory', search=suggestion, category_id=category_id if category_id else '')}'>{suggestion}</a>?"
+            flash_message = f"Did you mean: <a href='{url_for('inventory', search=suggestion, category_id=category_id if category_id else '', price=bucket)}'>{suggestion}</a>?"
             flash(flash_message, 'info')
 
-    ()
-
-    products_by_category = {}
-    for category in categories:
-        products_by_category[category['name']] = []
-    
-    for product in products:
-        # If searching/filtering, we might not have all categories, so check first.
-        if product['category_name'] in products_by_category:
-            products_by_category[product['category_name']].append(product)
-        else: # if a product from a search doesn't fit in the categories, create a new one
-            products_by_category[product['category_name']] = [product]
+    # Only this page's products are grouped, never the whole catalog; price-sorted pages keep their order
+    products_by_category = {None: products} if sort else group_by_category(products)
 
+    # Streamed, so the header and sidebar are sent before the grid is rendered
+    return stream_page('inventory.html', categories=categories, products_by_category=products_by_category, 
+                       search_query=search_query, selected_category_id=int(category_id) if category_id else None,
+                       facets=facets, selected_bucket=bucket, selected_sort=sort,
+                       next_page_url=_next_page_url('inventory', next_cursor, search_query, category_id, bucket, sort),
+                       next_page_json_url=_next_page_url('inventory_next_page', next_cursor, search_query,
+                                                         category_id, bucket, sort))
 
-    return render_template('inventory.html', categories=categories, products_by_category=products_by_category, 
-                           search_query=search_query, selected_category_id=int(category_id) if category_id else None)
+@login_required
+def inventory_next_page():
+    """Returns the next page of the inventory grid as JSON, for infinite scrolling."""
+    search_query = request.args.get('search', '')
+    category_id = request.args.get('category_id')
+    bucket = parse_bucket(request.args.get('price'))
+    sort = parse_sort(request.args.get('sort')) if not search_query else None
+    products, next_cursor = inventory_page(get_read_db(), search_query, category_id, request.args.get('cursor'), bucket,
+                                           sort)
+    products_by_category = {None: products} if sort else group_by_category(products)
+    html = render_template('_product_cards.html', products_by_category=products_by_category)
+    return jsonify(html=html, next_url=_next_page_url('inventory_next_page', next_cursor, search_query, category_id,
+                                                      bucket, sort))
+
+def _next_page_url(endpoint, cursor, search_query, category_id, bucket=None, sort=None):
+    if not cursor:
+        return None
+    return url_for(endpoint, cursor=cursor, search=search_query or None, category_id=category_id or None, price=bucket,
+                   sort=sort)
 
-@app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_cart(product_id):
-    cart = session.get('cart', {})
-    # For simplicity, we add one item at a time. A real implementation would handle quantity.
-    cart[str(product_id)] = 1
-    session['cart'] = cart
-    flash('Product added to cart!', 'success')
+    try:
+        quantity = max(1, int(request.form.get('quantity', 1)))
+    except ValueError:
+        flash('Quantity must be a whole number.', 'danger')
+        return redirect(url_for('inventory'))
+
+    if write_transaction(get_db(), lambda conn: add_item(conn, session['user_id'], product_id, quantity)):
+        flash('Product added to cart!', 'success')
+    else:
+        flash('Product not found.', 'danger')
     return redirect(url_for('inventory'))
 
-@app.route('/remove_from_cart/<int:product_id>')
+@login_required
+def update_cart(product_id):
+    try:
+        quantity = int(request.form.get('quantity', 1))
+    except ValueError:
+        flash('Quantity must be a whole number.', 'danger')
+        return redirect(url_for('cart'))
+
+    write_transaction(get_db(), lambda conn: set_quantity(conn, session['user_id'], product_id, quantity))
+    flash('Cart updated.', 'info')
+    return redirect(url_for('cart'))
+
 @login_required
 def remove_from_cart(product_id):
-    cart = session.get('cart', {})
-    if str(product_id) in cart:
-        cart.pop(str(product_id))
-        session['cart'] = cart
+    if write_transaction(get_db(), lambda conn: remove_item(conn, session['user_id'], product_id)):
         flash('Product removed from cart.', 'info')
     return redirect(url_for('cart'))
 
-@app.route('/cart')
 @login_required
 def cart():
-    cart = session.get('cart', {})
-    if not cart:
-        return render_template('cart.html', cart_items=[], total_price=0)
-
-    conn = get_db()
-    # Create a string of placeholders for the query
-    placeholders = ','.join('?' for _ in cart.keys())
-    product_ids = list(cart.keys())
-    
-    cart_products = conn.execute(f'SELECT * FROM products WHERE id IN ({placeholders})', product_ids).fetchall()
-    ()
-
-    cart_items = []
-    total_price = 0
-    for product in cart_products:
-        # Prices are now stored as REAL, so no parsing is needed.
-        price = product['price']
-        cart_items.append({
-            'id': product['id'],
-            'name': product['name'],
-            'price': price, # Use the numeric price directly
-            'image_file': product['image_file'],
-            'numeric_price': price
-        })
-        total_price += price
-
-
+    # Current prices and the total come from one aggregate query
+    cart_items, total_price = get_cart(get_read_db(), session['user_id'])
     return render_template('cart.html', cart_items=cart_items, total_price=total_price)
 
 
 
-@app.route('/checkout')
 @login_required
 def checkout():
-    return render_template('checkout.html')
+    if request.method == 'POST':
+        details = {field: request.form.get(field, '').strip() for field in
+                   ('first_name', 'last_name', 'email', 'address', 'payment_method', 'shipping_method')}
+        token = request.form.get('checkout_token', '')
+        if not all(details[field] for field in ('first_name', 'last_name', 'address')) or not token:
+            flash('Name and address are required.', 'danger')
+            return redirect(url_for('checkout'))
+        if details['payment_method'] not in PAYMENT_METHODS or details['shipping_method'] not in SHIPPING_METHODS:
+            flash('Choose a payment and shipping method.', 'danger')
+            return redirect(url_for('checkout'))
+
+        try:
+            order_id, created = place_order(get_db(), session['user_id'], token, details)
+        except OutOfStock as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('cart'))
+        except CheckoutError as e:
+            flash(str(e), 'info')
+            return redirect(url_for('cart'))
+        except sqlite3.Error as e:
+            flash(f'Database error: {e}', 'danger')
+            return redirect(url_for('checkout'))
+        if created:
+            flash(f'Order #{order_id} placed. Thank you!', 'success')
+        return redirect(url_for('order', order_id=order_id))
+
+    cart_items, total_price = get_cart(get_read_db(), session['user_id'])
+    if not cart_items:
+        flash('Your cart is empty.', 'info')
+        return redirect(url_for('cart'))
+    # A fresh token per render; submitting the same form twice places one order
+    return render_template('checkout.html', cart_items=cart_items, total_price=total_price,
+                           checkout_token=uuid4().hex, payment_methods=PAYMENT_METHODS,
+                           shipping_methods=SHIPPING_METHODS)
 
-@app.route('/about')
+@login_required
+def order(order_id):
+    order, lines = get_order(get_read_db(), order_id, session['user_id'])
+    if order is None:
+        flash('Order not found.', 'danger')
+        return redirect(url_for('profile'))
+    return render_template('order.html', order=order, lines=lines, payment_methods=PAYMENT_METHODS,
+                           shipping_methods=SHIPPING_METHODS)
+
+@conditional(static_page_validators)
 def about():
     return render_template('about.html')
 
-@app.route('/policies')
+@conditional(static_page_validators)
 def policies():
     return render_template('policies.html')
 
-@app.route('/profile')
 @login_required
 def profile():
-    return render_template('profile.html')
+    return render_template('profile.html', orders=recent_orders(get_read_db(), session['user_id']))
 
-@app.route('/product/<int:product_id>')
+@conditional(product_validators)
 def product(product_id):
-    conn = get_db()
-    product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+    product = get_product(product_id)
     
     if product is None:
         flash('Product not found.', 'danger')
         return redirect(url_for('inventory'))
 
-    related_products = conn.execute('SELECT * FROM products WHERE category_id = ? AND id != ? LIMIT 4', 
-                                    (product['category_id'], product_id)).fetchall()
+    related_products = get_related_products(product)
     ()
     
     return render_template('product.html', product=product, related_products=related_products)
 
-
-
-
-
-
-
-
-
-
-
-
+# (rule, view, methods); endpoints are the view names
+ROUTES = (
+    ('/', home, None),
+    ('/inventory', inventory, None),
+    ('/inventory/page', inventory_next_page, None),
+    ('/add_to_cart/<int:product_id>', add_to_cart, ['POST']),
+    ('/update_cart/<int:product_id>', update_cart, ['POST']),
+    ('/remove_from_cart/<int:product_id>', remove_from_cart, None),
+    ('/cart', cart, None),
+    ('/checkout', checkout, ['GET', 'POST']),
+    ('/orders/<int:order_id>', order, None),
+    ('/about', about, None),
+    ('/policies', policies, None),
+    ('/profile', profile, None),
+    ('/product/<int:product_id>', product, None),
+)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
 
 
 
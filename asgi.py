@@ -0,0 +1,250 @@
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from werkzeug.exceptions import HTTPException
+from JENGAMART.app import create_app
+
+# ASGI entry point: uvicorn --workers 4 JENGAMART.asgi:application
+#
+# The event loop owns every connection, so an idle or slow client costs a
+# coroutine and a socket rather than a worker. Views stay synchronous Flask
+# and run on bounded thread pools behind a small ASGI-to-WSGI bridge, with
+# the same templates, blueprints and pooled SQLite connections as the WSGI
+# deployment. The read-only storefront routes get their own pool of
+# JENGAMART_ASGI_THREADS threads. Everything else (admin, auth, cart and
+# checkout) shares JENGAMART_ASGI_SYNC_THREADS threads, sized like the sync
+# workers, so a burst of logins or admin work cannot starve the storefront.
+# A request waits in the event loop for a free thread, never in an executor
+# queue, and is answered 503 after ASGI_QUEUE_TIMEOUT seconds. Response
+# chunks are handed to the event loop as they are produced, so a thread is
+# free again as soon as its page is rendered, however slowly the client
+# reads it.
+
+STOREFRONT_THREADS = int(os.environ.get('JENGAMART_ASGI_THREADS', 32))
+SYNC_THREADS = int(os.environ.get('JENGAMART_ASGI_SYNC_THREADS', 4))
+
+# Endpoints served by the storefront pool, for GET and HEAD only
+STOREFRONT_ENDPOINTS = frozenset({'home', 'inventory', 'inventory_next_page', 'product', 'about', 'policies',
+                                  'static'})
+
+BODY_SPOOL_SIZE = 1024 * 1024 # Request bodies larger than this are spooled to disk
+
+class Lane:
+    """A bounded thread pool for one class of routes, with a slot per thread."""
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        # Threads do not survive fork, e.g. when a server preloads the app
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.threads,
+                                                        thread_name_prefix=f'asgi-{self.name}')
+                    self._slots = asyncio.Semaphore(self.threads)
+                    self._pid = os.getpid()
+
+    async def acquire(self, timeout):
+        """Waits for a free thread. Returns False if none came free within timeout seconds."""
+        self._ensure()
+        if not self._slots.locked():
+            await self._slots.acquire() # A free slot never blocks, even with no timeout
+            return True
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def submit(self, function, *args):
+        """Runs function on this lane's pool and frees its slot when it returns."""
+        future = asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+
+def _path_info(scope):
+    # ASGI paths include the mount point (root_path); WSGI's PATH_INFO does not
+    root_path, path = scope.get('root_path', ''), scope['path']
+    return path[len(root_path):] if root_path and path.startswith(root_path) else path
+
+def build_environ(scope, body, length):
+    """Returns the WSGI environ for an ASGI HTTP scope."""
+    root_path = scope.get('root_path', '')
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode().decode('latin-1'),
+        'PATH_INFO': _path_info(scope).encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue # The body has been read; its real length is used
+        key = f'HTTP_{name}'
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+class StorefrontBridge:
+    """An ASGI application running a Flask app on bounded thread pools."""
+
+    def __init__(self, app, storefront_threads=STOREFRONT_THREADS, sync_threads=SYNC_THREADS):
+        self.app = app
+        self.storefront = Lane('storefront', storefront_threads)
+        self.sync = Lane('sync', sync_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close'}) # No websocket routes
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.storefront.shutdown()
+                self.sync.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def lane(self, scope):
+        """Returns the lane serving a request: storefront reads, or the sync pool for everything else."""
+        method = scope['method']
+        if method not in ('GET', 'HEAD'):
+            return self.sync
+        try:
+            endpoint, _ = self.app.url_map.bind('').match(_path_info(scope), method=method)
+        except HTTPException: # 404s, 405s and redirects
+            return self.sync
+        return self.storefront if endpoint in STOREFRONT_ENDPOINTS else self.sync
+
+    async def _http(self, scope, receive, send):
+        body, length = await _read_body(receive)
+        environ = build_environ(scope, body, length)
+        lane = self.lane(scope)
+        if not await lane.acquire(self.app.config.get('ASGI_QUEUE_TIMEOUT', 10.0)):
+            body.close()
+            await _send_busy(send)
+            return
+
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        emit = lambda *message: loop.call_soon_threadsafe(messages.put_nowait, message)
+        done = lane.submit(self._run, environ, emit)
+        started = False
+        try:
+            while True:
+                kind, value = await messages.get()
+                if kind == 'start':
+                    started = True
+                    await send({'type': 'http.response.start', 'status': value[0], 'headers': value[1]})
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+                elif kind == 'end':
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                    break
+                else: # 'error'
+                    if started:
+                        raise value # The server drops the connection mid-response
+                    await send({'type': 'http.response.start', 'status': 500,
+                                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+                    await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+                    break
+        finally:
+            await done
+            body.close()
+
+    def _run(self, environ, emit):
+        """Calls the WSGI app on a pool thread, passing the response to the event loop as it is produced."""
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = (int(status.split(' ', 1)[0]),
+                                 [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers])
+            return lambda data: send_chunk(data)
+        def send_chunk(data):
+            if not response.get('sent'):
+                emit('start', response['start'])
+                response['sent'] = True
+            if data:
+                emit('body', data)
+
+        try:
+            chunks = self.app(environ, start_response)
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        send_chunk(chunk)
+            finally:
+                close = getattr(chunks, 'close', None)
+                if close is not None:
+                    close()
+            send_chunk(b'')
+            emit('end', None)
+        except Exception as e:
+            self.app.logger.exception('Error serving %s', environ.get('PATH_INFO'))
+            emit('error', e)
+
+async def _read_body(receive):
+    """Reads the whole request body. Returns (file, length)."""
+    body = SpooledTemporaryFile(max_size=BODY_SPOOL_SIZE)
+    length = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        body.write(chunk)
+        length += len(chunk)
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body, length
+
+async def _send_busy(send):
+    await send({'type': 'http.response.start', 'status': 503,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'retry-after', b'1')]})
+    await send({'type': 'http.response.body', 'body': b'The server is busy. Please try again.'})
+
+# Every thread may hold a read connection at once
+app = create_app({'DB_READ_POOL_SIZE': STOREFRONT_THREADS + SYNC_THREADS})
+application = StorefrontBridge(app)
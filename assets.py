@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError: # Brotli is optional; gzip variants are always built
+    brotli = None
+
+# Content-hashed static URLs.
+#
+# url_for('static', filename='css/style.css') is rewritten to
+# /static/css/style.<hash>.css. Hashed URLs change whenever the file does, so
+# they are served with a one-year immutable Cache-Control. Text assets are
+# precompressed to .gz and .br next to the original, and the smallest
+# encoding the client accepts is sent.
+
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map'}
+PRECOMPRESSED = ('.br', '.gz')
+HASHED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)?$' % HASH_LENGTH)
+
+class AssetManifest:
+    """Maps static files to content-hashed names, hashing new files on first use."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._hashes = {} # filename -> content hash
+        self._lock = threading.Lock()
+
+    def _hash_file(self, filename):
+        digest = hashlib.sha256()
+        with open(os.path.join(self.static_folder, filename), 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def content_hash(self, filename):
+        """Returns the file's content hash, or None if it does not exist."""
+        content_hash = self._hashes.get(filename)
+        if content_hash is None:
+            try:
+                content_hash = self._hash_file(filename)
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                self._hashes[filename] = content_hash
+        return content_hash
+
+    def hashed_name(self, filename):
+        content_hash = self.content_hash(filename)
+        if content_hash is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f'{stem}.{content_hash}{ext}'
+
+    def resolve(self, requested):
+        """Returns (filename, immutable) for a requested static path."""
+        match = HASHED_NAME.match(requested)
+        if match:
+            filename = match.group('stem') + (match.group('ext') or '')
+            if self.content_hash(filename) == match.group('hash'):
+                return filename, True
+            if self.content_hash(filename) is not None:
+                return filename, False # An older hash: serve the current file, briefly cached
+        return requested, False
+
+    def build(self, compress=True):
+        """Hashes every static file and writes missing or stale .gz/.br variants."""
+        built = 0
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                if name.endswith(PRECOMPRESSED):
+                    continue
+                filename = os.path.relpath(os.path.join(root, name), self.static_folder).replace(os.sep, '/')
+                self.content_hash(filename)
+                if compress and os.path.splitext(name)[1] in COMPRESSIBLE:
+                    built += precompress(os.path.join(root, name))
+        return built
+
+def precompress(path):
+    """Writes path.gz and, with brotli installed, path.br if missing or stale. Returns files written."""
+    with open(path, 'rb') as f:
+        data = None
+        written = 0
+        encoders = [('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.append(('.br', lambda raw: brotli.compress(raw, quality=11)))
+        for suffix, encode in encoders:
+            target = path + suffix
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                continue
+            if data is None:
+                data = f.read()
+            with open(target, 'wb') as out:
+                out.write(encode(data))
+            written += 1
+    return written
+
+def _accepted_encodings():
+    accepted = request.accept_encodings
+    return [suffix for suffix, name in (('.br', 'br'), ('.gz', 'gzip')) if accepted[name]]
+
+def serve_static(filename):
+    """Serves static files, honouring hashed names and precompressed variants."""
+    manifest = current_app.extensions['asset_manifest']
+    filename, immutable = manifest.resolve(filename)
+    max_age = IMMUTABLE_MAX_AGE if immutable else current_app.get_send_file_max_age(filename)
+
+    served, encoding = filename, None
+    compressible = os.path.splitext(filename)[1] in COMPRESSIBLE
+    if compressible:
+        for suffix in _accepted_encodings():
+            if os.path.isfile(os.path.join(current_app.static_folder, filename + suffix)):
+                served, encoding = filename + suffix, 'br' if suffix == '.br' else 'gzip'
+                break
+
+    try:
+        response = send_from_directory(current_app.static_folder, served, max_age=max_age,
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    except NotFound:
+        if served == filename:
+            raise
+        response = send_from_directory(current_app.static_folder, filename, max_age=max_age)
+        encoding = None
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+def hashed_static_url(endpoint, values):
+    """url_defaults hook that swaps static filenames for their hashed names."""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = current_app.extensions['asset_manifest'].hashed_name(values['filename'])
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Hash static files and precompress text assets."""
+    written = current_app.extensions['asset_manifest'].build()
+    click.echo(f'Wrote {written} precompressed files.')
+
+def init_app(app):
+    """Installs hashed static URLs and the static file handler."""
+    manifest = AssetManifest(app.static_folder)
+    app.extensions['asset_manifest'] = manifest
+    app.url_defaults(hashed_static_url)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(build_assets_command)
+    if app.config.get('BUILD_ASSETS_ON_STARTUP', True):
+        manifest.build()
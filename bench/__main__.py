@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from JENGAMART.bench.datagen import generate_catalog
+from JENGAMART.bench.runner import run
+from JENGAMART.bench.scenarios import SCENARIOS
+
+# Benchmark entry point:
+#
+#   python -m JENGAMART.bench --sizes 1000,10000 --output results.json
+#   python -m JENGAMART.bench --driver http --server gunicorn --concurrency 16
+#   python -m JENGAMART.bench --compare JENGAMART/bench/baseline.json
+#
+# Each catalog size gets its own generated database. Results can be saved as
+# JSON and compared against a saved baseline; a p95 slower than the baseline
+# by more than --tolerance counts as a regression and exits with status 1.
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'rps')
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m JENGAMART.bench', description='Benchmark the storefront.')
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated product counts')
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=None, help='client threads (default 1 in-process, 16 over HTTP)')
+    parser.add_argument('--driver', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--server', choices=('gunicorn', 'waitress', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn or uvicorn workers, or waitress threads')
+    parser.add_argument('--scenarios', help=f'comma-separated subset of: {", ".join(s.name for s in SCENARIOS)}')
+    parser.add_argument('--workdir', help='where databases are generated (default: a temporary directory)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help=f'write results to {BASELINE}')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a saved results file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown before a regression')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def run_inprocess(args, sizes, scenarios):
+    # Importing the app runs startup migrations against ./jengamart.db, so do it inside the workdir
+    os.chdir(args.workdir)
+    from JENGAMART.app import app
+    from JENGAMART.bench.inprocess import use_database, session_factory
+
+    results = {}
+    for size in sizes:
+        database = os.path.join(args.workdir, f'bench-{size}.db')
+        catalog = generate_catalog(database, size, args.categories, args.users, args.seed)
+        use_database(app, database)
+        results[str(size)] = run(session_factory(app), catalog, args.requests, args.concurrency or 1,
+                                 scenarios, args.seed)
+        print_table(size, results[str(size)])
+    return results
+
+def run_http(args, sizes, scenarios):
+    from JENGAMART.bench.server import serve, session_factory
+
+    results = {}
+    for size in sizes:
+        workdir = os.path.join(args.workdir, f'http-{size}')
+        os.makedirs(workdir, exist_ok=True)
+        catalog = generate_catalog(os.path.join(workdir, 'jengamart.db'), size, args.categories, args.users, args.seed)
+        with serve(args.server, workdir, args.workers) as port:
+            results[str(size)] = run(session_factory(port), catalog, args.requests, args.concurrency or 16,
+                                     scenarios, args.seed)
+        print_table(size, results[str(size)])
+    return results
+
+def print_table(size, results):
+    print(f'\n{size} products')
+    print(f'{"scenario":<22}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}{"errors":>8}')
+    for name, summary in results.items():
+        print(f'{name:<22}{summary["p50_ms"]:>10.2f}{summary["p95_ms"]:>10.2f}{summary["p99_ms"]:>10.2f}'
+              f'{summary["rps"]:>10.1f}{summary["errors"]:>8}')
+
+def compare(results, baseline, tolerance):
+    """Prints p95 changes against a baseline and returns the regressions."""
+    regressions = []
+    print(f'\nCompared with baseline ({baseline["config"]["driver"]}, {baseline["config"]["python"]}):')
+    for size, scenarios in results['sizes'].items():
+        for name, summary in scenarios.items():
+            before = baseline['sizes'].get(size, {}).get(name)
+            if not before or not before['p95_ms']:
+                continue
+            change = summary['p95_ms'] / before['p95_ms'] - 1
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append(f'{size}/{name}')
+            print(f'  {size:>7} {name:<22} p95 {before["p95_ms"]:>9.2f} -> {summary["p95_ms"]:>9.2f} ms '
+                  f'({change:+.0%}){flag}')
+    return regressions
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    scenarios = set(args.scenarios.split(',')) if args.scenarios else None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='jengamart-bench-'))
+    os.makedirs(args.workdir, exist_ok=True)
+    output = [os.path.abspath(path) for path in (args.output, BASELINE if args.save_baseline else None) if path]
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    runner = run_inprocess if args.driver == 'inprocess' else run_http
+    results = {
+        'config': {
+            'driver': args.driver if args.driver == 'inprocess' else f'http/{args.server}',
+            'workers': args.workers,
+            'concurrency': args.concurrency or (1 if args.driver == 'inprocess' else 16),
+            'requests': args.requests,
+            'categories': args.categories,
+            'users': args.users,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'sizes': runner(args, sizes, scenarios),
+    }
+    for path in output:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'\nSaved results to {path}')
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regressions: {", ".join(regressions)}')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from JENGAMART.bench.datagen import generate_catalog
+from JENGAMART.bench.scenarios import start_session
+from JENGAMART.bench.server import HTTPSession, serve
+
+# High-concurrency benchmark for the storefront read path.
+#
+#   python -m JENGAMART.bench.concurrency --connections 512 --duration 20
+#
+# The app is served by gunicorn (sync workers) and by uvicorn through the
+# ASGI bridge in JENGAMART.asgi, with the same number of worker processes.
+# Each of --connections asyncio clients fetches storefront pages in a loop,
+# one request per connection. A --slow fraction of the clients reads its
+# responses slowly through a small receive buffer, as phones on poor
+# networks do. Requests per second, p50 and p99 latency and errors are
+# reported for each server.
+
+SERVERS = ('gunicorn', 'uvicorn')
+
+def storefront_requests(catalog, cookie):
+    """Returns a function picking (path, headers) for a random storefront page."""
+    def pick(rng):
+        kind = rng.random()
+        if kind < 0.35:
+            return f'/product/{rng.randint(1, catalog["products"])}', ''
+        if kind < 0.6:
+            return '/', ''
+        if kind < 0.8:
+            return '/inventory', f'Cookie: {cookie}\r\n'
+        return rng.choice(('/about', '/policies')), ''
+    return pick
+
+async def connect(port, slow):
+    if not slow:
+        return await asyncio.open_connection('127.0.0.1', port)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096) # Must be set before connecting
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return await asyncio.open_connection(sock=sock, limit=4096)
+
+async def fetch(port, path, headers, slow, slow_delay):
+    """Sends one GET and reads the whole response. Returns the status code."""
+    reader, writer = await connect(port, slow)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n{headers}Connection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        while True:
+            chunk = await reader.read(4096)
+            if not chunk:
+                break
+            if slow:
+                await asyncio.sleep(slow_delay)
+    finally:
+        writer.close()
+    return int(status_line.split()[1])
+
+async def client(port, pick, rng, slow, slow_delay, deadline, results):
+    while time.monotonic() < deadline:
+        path, headers = pick(rng)
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(fetch(port, path, headers, slow, slow_delay), 60)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        elapsed = (time.perf_counter() - started) * 1000
+        if status == 200:
+            results['latencies'].append(elapsed)
+        else:
+            results['errors'] += 1
+
+async def load(port, pick, connections, slow_fraction, slow_delay, duration, seed):
+    rng = random.Random(seed)
+    results = {'latencies': [], 'errors': 0}
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(
+        client(port, pick, random.Random(rng.random()), number < connections * slow_fraction, slow_delay, deadline,
+               results)
+        for number in range(connections)))
+    elapsed = time.monotonic() - started
+    latencies = sorted(results['latencies'])
+    if not latencies:
+        return {'rps': 0.0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'requests': 0, 'errors': results['errors']}
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'requests': len(latencies),
+        'errors': results['errors'],
+    }
+
+def measure(server, workdir, catalog, args):
+    with serve(server, workdir, args.workers) as port:
+        session = start_session(HTTPSession('127.0.0.1', port), 'user', 0)
+        cookie = '; '.join(f'{name}={morsel.value}' for name, morsel in session.cookies.items())
+        pick = storefront_requests(catalog, cookie)
+        asyncio.run(load(port, pick, min(32, args.connections), 0, args.slow_delay, 2, args.seed)) # Warm up
+        return asyncio.run(load(port, pick, args.connections, args.slow, args.slow_delay, args.duration, args.seed))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m JENGAMART.bench.concurrency',
+                                     description='Benchmark the storefront under many concurrent connections.')
+    parser.add_argument('--size', type=int, default=10000, help='products in the generated catalog')
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--connections', type=int, default=512, help='concurrent client connections')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load per server')
+    parser.add_argument('--slow', type=float, default=0.1, help='fraction of clients that read slowly')
+    parser.add_argument('--slow-delay', type=float, default=0.05, help='seconds a slow client waits between reads')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes for each server')
+    parser.add_argument('--servers', default=','.join(SERVERS), help='comma-separated subset of: gunicorn, uvicorn')
+    parser.add_argument('--workdir', help='where the database is generated (default: a temporary directory)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='jengamart-concurrency-'))
+    os.makedirs(workdir, exist_ok=True)
+    catalog = generate_catalog(os.path.join(workdir, 'jengamart.db'), args.size, args.categories, seed=args.seed)
+
+    results = {}
+    for server in args.servers.split(','):
+        results[server] = measure(server, workdir, catalog, args)
+    print(f'\n{args.size} products, {args.connections} connections ({args.slow:.0%} slow), {args.workers} workers, '
+          f'{args.duration:.0f}s per server')
+    print(f'{"server":<12}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"requests":>10}{"errors":>8}')
+    for server, row in results.items():
+        print(f'{server:<12}{row["rps"]:>10.1f}{row["p50_ms"]:>10.2f}{row["p99_ms"]:>10.2f}{row["requests"]:>10}'
+              f'{row["errors"]:>8}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'\nSaved results to {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import random
+import sqlite3
+from werkzeug.security import generate_password_hash
+from JENGAMART.migrations import migrate
+from JENGAMART.catalog_io import import_products
+from JENGAMART.related import rebuild_related
+
+# Synthetic catalogs for benchmarks.
+#
+# Product names are built from the same kind of brands, items and sizes as
+# the real catalog, so search hits, misses and typo suggestions behave like
+# production. Generation is seeded, so a given size always produces the same
+# database and results stay comparable between runs.
+
+CATEGORIES = ['CEMENT', 'STEEL', 'WOOD', 'PLUMBING', 'ELECTRICAL', 'AGGREGATES', 'ROOFING', 'PAINT',
+              'TILES', 'HARDWARE', 'TOOLS', 'GLASS', 'INSULATION', 'FENCING', 'DOORS', 'LIGHTING']
+BRANDS = ['Bamburi', 'Simba', 'Mombasa', 'Savannah', 'Devki', 'Kenbro', 'Crown', 'Basco',
+          'Mabati', 'Tembo', 'Nyati', 'Duracoat', 'Kudu', 'Twiga', 'Safal', 'Orbit']
+GRADES = ['Standard', 'Premium', 'Heavy Duty', 'Economy', 'Pro', 'Classic']
+ITEMS = {
+    'CEMENT': ['Cement', 'Mortar', 'Plaster', 'Tile Adhesive'],
+    'STEEL': ['Deformed Bar', 'Mesh', 'Angle Line', 'Binding Wire'],
+    'WOOD': ['Cypress Timber', 'Pine Timber', 'Plywood', 'Blockboard'],
+    'PLUMBING': ['PVC Pipe', 'HDPE Coupling', 'Gate Valve', 'Water Tank'],
+    'ELECTRICAL': ['Conduit', 'Cable', 'Socket', 'Switch'],
+    'AGGREGATES': ['Sand', 'Ballast', 'Quarry Dust', 'Hardcore'],
+    'ROOFING': ['Iron Sheet', 'Ridge Cap', 'Roofing Nails', 'Gutter'],
+    'PAINT': ['Emulsion', 'Gloss Paint', 'Primer', 'Wood Varnish'],
+}
+GENERIC_ITEMS = ['Hinge', 'Padlock', 'Hammer', 'Wheelbarrow', 'Spirit Level', 'Trowel', 'Floor Tile', 'Glass Pane']
+SIZES = ['25kg', '50kg', '12m', '6m', '4x2', '2x2', '20mm', '32mm', '110mm', '1L', '4L', '20L', 'roll', 'box']
+USES = ['foundations', 'walling', 'roofing', 'finishing', 'site work', 'repairs']
+
+PASSWORD = 'benchpassword'
+ADMIN_EMAIL = 'admin@bench.test'
+
+# Search terms: words that occur in product names, and words that do not
+SEARCH_HITS = ['cement', 'timber', 'pipe', 'bamburi', 'deformed bar', 'iron sheet', 'paint', 'premium conduit']
+SEARCH_MISSES = ['cemnt', 'tmber', 'bambri', 'plywod', 'zzyzx', 'qwertyuiop']
+
+# The flash_sale scenario's product; its stock is reset whenever a catalog is generated
+FLASH_SALE_PRODUCT = 1
+FLASH_SALE_STOCK = 100
+
+def user_email(number):
+    return f'user{number}@bench.test'
+
+def category_names(count):
+    return CATEGORIES[:count] + [f'CATEGORY {i}' for i in range(len(CATEGORIES), count)]
+
+def product_rows(rng, categories, count):
+    """Yields count product dicts with unique, searchable names."""
+    for number in range(1, count + 1):
+        category = rng.choice(categories)
+        brand, grade = rng.choice(BRANDS), rng.choice(GRADES)
+        item = rng.choice(ITEMS.get(category, GENERIC_ITEMS))
+        yield {
+            'name': f'{brand} {grade} {item} {rng.choice(SIZES)} JM{number:06d}',
+            'category': category,
+            'price': round(rng.uniform(20, 25000), 2),
+            'description': f'{grade} {item.lower()} from {brand} for {rng.choice(USES)}.',
+            'image_file': 'placeholder.jpg',
+            'featured': rng.random() < 0.02,
+        }
+
+def generate_catalog(database, products=1000, categories=12, users=50, seed=0):
+    """Creates (or extends) a benchmark database. Returns the catalog's shape."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    names = category_names(categories)
+    import_products(conn, product_rows(rng, names, products))
+    rebuild_related(conn)
+    # The rebuild above supersedes the one queued by the migration
+    conn.execute("DELETE FROM jobs WHERE kind = 'related' AND status = 'queued'")
+    conn.execute('UPDATE products SET stock = ? WHERE id = ?', (FLASH_SALE_STOCK, FLASH_SALE_PRODUCT))
+
+    # Every user shares one password, so it is hashed only once
+    password_hash = generate_password_hash(PASSWORD)
+    accounts = [(f'user{i}', user_email(i), password_hash, 0) for i in range(users)]
+    accounts.append(('admin', ADMIN_EMAIL, password_hash, 1))
+    conn.executemany('INSERT OR IGNORE INTO users (username, email, password_hash, is_admin) VALUES (?, ?, ?, ?)',
+                     accounts)
+    conn.commit()
+    conn.close()
+    return {'products': products, 'categories': categories, 'users': users}
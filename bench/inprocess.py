@@ -0,0 +1,28 @@
+from JENGAMART.db import get_db
+from JENGAMART.cache import bump_catalog_version
+
+# In-process driver: requests go straight through the WSGI app with the Flask
+# test client, so results measure the application alone, without a server
+# or the network.
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.csrf_token = None
+
+    def request(self, method, path, data=None):
+        if data is not None:
+            data = dict(data, csrf_token=self.csrf_token)
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+def use_database(app, database):
+    """Points the app at a benchmark database and drops anything cached from the previous one."""
+    app.config['DATABASE'] = database
+    app.config['AUTH_THROTTLE'] = False # Every session logs in from the same address
+    with app.app_context():
+        bump_catalog_version(get_db())
+        get_db().commit()
+
+def session_factory(app):
+    return lambda: TestClientSession(app)
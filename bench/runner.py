@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+from JENGAMART.bench.scenarios import SCENARIOS, start_session
+
+# Runs every scenario against sessions from a driver and summarizes latencies.
+# Drivers only supply make_session(), returning an object with a csrf_token
+# attribute and request(method, path, data) -> (status, body).
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def summarize(latencies, elapsed, errors):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+    }
+
+def prepare(session, scenario, rng, catalog):
+    """Sends a scenario's untimed setup requests."""
+    for method, path, data in (scenario.setup(rng, catalog) if scenario.setup else ()):
+        session.request(method, path, data)
+
+def run_scenario(make_session, scenario, catalog, requests, concurrency=1, warmup=5, seed=0):
+    sessions = [start_session(make_session(), scenario.role, number % max(catalog['users'], 1))
+                for number in range(concurrency)]
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        prepare(sessions[0], scenario, rng, catalog)
+        sessions[0].request(*scenario.build(rng, catalog))
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(session, count, worker_seed):
+        worker_rng = random.Random(worker_seed)
+        timings, failed = [], 0
+        for _ in range(count):
+            prepare(session, scenario, worker_rng, catalog)
+            method, path, data = scenario.build(worker_rng, catalog)
+            start = time.perf_counter()
+            status, _ = session.request(method, path, data)
+            timings.append(time.perf_counter() - start)
+            failed += status >= 400
+        with lock:
+            latencies.extend(timings)
+            errors[0] += failed
+
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(session, count, seed + i + 1))
+               for i, (session, count) in enumerate(zip(sessions, counts))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+def run(make_session, catalog, requests=200, concurrency=1, scenarios=None, seed=0):
+    """Returns {scenario name: summary} for every selected scenario."""
+    results = {}
+    for scenario in SCENARIOS:
+        if scenarios and scenario.name not in scenarios:
+            continue
+        results[scenario.name] = run_scenario(make_session, scenario, catalog, requests, concurrency, seed=seed)
+    return results
@@ -0,0 +1,69 @@
+import re
+from collections import namedtuple
+from urllib.parse import urlencode
+from JENGAMART.bench.datagen import (SEARCH_HITS, SEARCH_MISSES, PASSWORD, ADMIN_EMAIL, FLASH_SALE_PRODUCT,
+                                     user_email)
+
+# The request mix a benchmark run measures. Each scenario runs as one role:
+# anonymous visitors, logged-in shoppers, or the admin. build(rng, catalog)
+# returns (method, path, form data or None) for one request. An optional
+# setup(rng, catalog) returns requests sent untimed before each one, e.g. to
+# fill the cart before a checkout.
+
+Scenario = namedtuple('Scenario', 'name role build setup', defaults=(None,))
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+def _product_id(rng, catalog):
+    return rng.randint(1, catalog['products'])
+
+def _flash_sale_cart(rng, catalog):
+    # Exactly one unit of the sale product in the cart, whatever the last checkout left behind
+    return [('POST', f'/update_cart/{FLASH_SALE_PRODUCT}', {'quantity': '0'}),
+            ('POST', f'/add_to_cart/{FLASH_SALE_PRODUCT}', {'quantity': '1'})]
+
+def _checkout(rng, catalog):
+    return ('POST', '/checkout', {'checkout_token': f'{rng.getrandbits(128):032x}', 'first_name': 'Bench',
+                                  'last_name': 'Shopper', 'address': 'Nairobi', 'payment_method': 'mpesa',
+                                  'shipping_method': 'pickup'})
+
+SCENARIOS = (
+    Scenario('home', 'anonymous', lambda rng, catalog: ('GET', '/', None)),
+    Scenario('login', 'anonymous',
+             lambda rng, catalog: ('POST', '/login', {'email': user_email(rng.randrange(max(catalog['users'], 1))),
+                                                      'password': PASSWORD})),
+    Scenario('inventory', 'user', lambda rng, catalog: ('GET', '/inventory', None)),
+    Scenario('inventory_by_price', 'user',
+             lambda rng, catalog: ('GET', '/inventory?' + urlencode({'sort': rng.choice(['price', 'price_desc']),
+                                                                     'price': rng.choice(['100', '1000'])}), None)),
+    Scenario('search_hit', 'user',
+             lambda rng, catalog: ('GET', '/inventory?' + urlencode({'search': rng.choice(SEARCH_HITS)}), None)),
+    Scenario('search_miss', 'user',
+             lambda rng, catalog: ('GET', '/inventory?' + urlencode({'search': rng.choice(SEARCH_MISSES)}), None)),
+    Scenario('product', 'anonymous',
+             lambda rng, catalog: ('GET', f'/product/{_product_id(rng, catalog)}', None)),
+    Scenario('cart_add', 'user',
+             lambda rng, catalog: ('POST', f'/add_to_cart/{_product_id(rng, catalog)}', {'quantity': '1'})),
+    Scenario('cart', 'user', lambda rng, catalog: ('GET', '/cart', None)),
+    # Every shopper races for the same limited stock; once it sells out, checkouts are refused
+    Scenario('flash_sale', 'user', _checkout, _flash_sale_cart),
+    Scenario('admin_price_preview', 'admin',
+             lambda rng, catalog: ('POST', '/admin/bulk-update-prices',
+                                   {'price_update_amount': '5', 'action': 'preview'})),
+    Scenario('admin_price_update', 'admin',
+             lambda rng, catalog: ('POST', '/admin/bulk-update-prices',
+                                   {'price_update_amount': rng.choice(['1', '-1']), 'price_update_mode': 'absolute',
+                                    'category_id': str(rng.randint(1, catalog['categories']))})),
+)
+
+def start_session(session, role, number=0):
+    """Picks up a CSRF token and logs the session in as the scenario's role."""
+    status, body = session.request('GET', '/login')
+    match = CSRF_TOKEN.search(body.decode('utf-8', 'replace'))
+    session.csrf_token = match.group(1) if match else None
+    if role != 'anonymous':
+        email = ADMIN_EMAIL if role == 'admin' else user_email(number)
+        status, _ = session.request('POST', '/login', {'email': email, 'password': PASSWORD})
+        if status != 302:
+            raise RuntimeError(f'Login as {email} failed with status {status}.')
+    return session
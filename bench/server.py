@@ -0,0 +1,84 @@
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+# HTTP driver: the app runs under gunicorn, waitress or uvicorn in a subprocess and
+# each benchmark thread talks to it over its own cookie session.
+
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class HTTPSession:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = SimpleCookie()
+        self.csrf_token = None
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={morsel.value}' for name, morsel in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(dict(data, csrf_token=self.csrf_token))
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            payload = response.read()
+        finally:
+            conn.close()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self.cookies.load(header)
+        return response.status, payload
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def server_command(server, port, workers):
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '--preload', '--workers', str(workers),
+                '--bind', f'127.0.0.1:{port}', 'JENGAMART.app:app']
+    if server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+                '--no-access-log', 'JENGAMART.asgi:application']
+    if server == 'waitress':
+        return [sys.executable, '-m', 'waitress', f'--listen=127.0.0.1:{port}', f'--threads={workers}',
+                'JENGAMART.app:app']
+    raise ValueError(f'Unknown server: {server}')
+
+@contextmanager
+def serve(server, workdir, workers=4, startup_timeout=30.0):
+    """Runs the app under a server with workdir as its working directory. Yields the port."""
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_PARENT, os.environ.get('PYTHONPATH')])),
+               JENGAMART_AUTH_THROTTLE='0') # Every session logs in from 127.0.0.1
+    with open(os.path.join(workdir, f'{server}.log'), 'wb') as log:
+        process = subprocess.Popen(server_command(server, port, workers), cwd=workdir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError(f'{server} did not start; see {log.name}.')
+                    time.sleep(0.2)
+            yield port
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+def session_factory(port):
+    return lambda: HTTPSession('127.0.0.1', port)
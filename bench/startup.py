@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from JENGAMART.bench.datagen import generate_catalog
+from JENGAMART.bench.server import PACKAGE_PARENT
+
+# Startup benchmark: import time, app build time and first-request latency.
+#
+#   python -m JENGAMART.bench.startup --size 10000 --runs 5
+#
+# Each run is a fresh interpreter that imports JENGAMART.app, builds the app
+# with create_app() and then forks a child the way gunicorn --preload forks
+# its workers. The child times its first requests and reports how much
+# memory it had to copy from the parent. Runs with WARM_ON_STARTUP off and on
+# are compared; the medians are printed.
+
+PATHS = ('/', '/about', '/product/1')
+
+PROBE = '''
+import json, os, sys, time
+started = time.perf_counter()
+import JENGAMART.app
+imported = time.perf_counter()
+app = JENGAMART.app.create_app({'DATABASE': sys.argv[1], 'WARM_ON_STARTUP': sys.argv[2] == '1', 'JOB_WORKERS': 0})
+built = time.perf_counter()
+
+def private_kb():
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            return sum(int(line.split()[1]) for line in f if line.startswith(('Private_Clean', 'Private_Dirty')))
+    except OSError:
+        return None
+
+read, write = os.pipe()
+pid = os.fork()
+if pid == 0:
+    client = app.test_client()
+    result = {'first': {}, 'second': {}}
+    for attempt in ('first', 'second'):
+        for path in sys.argv[3:]:
+            before = time.perf_counter()
+            client.get(path)
+            result[attempt][path] = (time.perf_counter() - before) * 1000
+    result['child_private_kb'] = private_kb()
+    os.write(write, json.dumps(result).encode())
+    os._exit(0)
+os.close(write)
+with os.fdopen(read) as f:
+    result = json.loads(f.read())
+os.waitpid(pid, 0)
+result.update(import_ms=(imported - started) * 1000, create_app_ms=(built - imported) * 1000)
+print(json.dumps(result))
+'''
+
+def probe(database, warm, paths, workdir):
+    """Runs one fresh interpreter and returns its timings."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_PARENT, os.environ.get('PYTHONPATH')])),
+               JENGAMART_AUTH_THROTTLE='0')
+    output = subprocess.run([sys.executable, '-c', PROBE, database, '1' if warm else '0', *paths], cwd=workdir,
+                            env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def summarize(runs, paths):
+    median = lambda values: statistics.median(values) if all(v is not None for v in values) else None
+    summary = {
+        'import_ms': median([run['import_ms'] for run in runs]),
+        'create_app_ms': median([run['create_app_ms'] for run in runs]),
+        'child_private_kb': median([run['child_private_kb'] for run in runs]),
+    }
+    for attempt in ('first', 'second'):
+        summary[attempt] = {path: median([run[attempt][path] for run in runs]) for path in paths}
+    return summary
+
+def print_summary(results, paths):
+    modes = list(results)
+    print(f'{"":<28}' + ''.join(f'{mode:>12}' for mode in modes))
+    rows = [('import JENGAMART.app ms', lambda s: s['import_ms']),
+            ('create_app() ms', lambda s: s['create_app_ms'])]
+    for attempt in ('first', 'second'):
+        rows += [(f'{attempt} GET {path} ms', lambda s, a=attempt, p=path: s[a][p]) for path in paths]
+    rows.append(('child private memory KB', lambda s: s['child_private_kb']))
+    for label, value in rows:
+        cells = [value(results[mode]) for mode in modes]
+        print(f'{label:<28}' + ''.join(f'{cell:>12.1f}' if cell is not None else f'{"-":>12}' for cell in cells))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m JENGAMART.bench.startup',
+                                     description='Benchmark startup and first-request latency.')
+    parser.add_argument('--size', type=int, default=10000, help='products in the generated catalog')
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per mode')
+    parser.add_argument('--workdir', help='where the database is generated (default: a temporary directory)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='jengamart-startup-'))
+    os.makedirs(workdir, exist_ok=True)
+    database = os.path.join(workdir, f'startup-{args.size}.db')
+    generate_catalog(database, args.size, args.categories, seed=args.seed)
+
+    results = {}
+    for mode, warm in (('cold', False), ('warm', True)):
+        results[mode] = summarize([probe(database, warm, PATHS, workdir) for _ in range(args.runs)], PATHS)
+    print(f'\n{args.size} products, median of {args.runs} runs')
+    print_summary(results, PATHS)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'\nSaved results to {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import argparse
+import http.client
+import json
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+from werkzeug.serving import make_server
+from JENGAMART.bench.datagen import generate_catalog, user_email, ADMIN_EMAIL, PASSWORD
+
+# Time-to-first-byte benchmark for the large HTML pages.
+#
+#   python -m JENGAMART.bench.ttfb --size 10000 --page-size 200
+#
+# The app is served by werkzeug from a forked process once per response pipeline:
+# rendered whole, streamed, and streamed with gzip. Each page is fetched
+# repeatedly over HTTP. The medians of time to first body byte, time to the
+# last byte, and bytes on the wire are reported.
+
+PAGES = (('user', '/inventory'), ('admin', '/admin/'))
+
+MODES = (
+    ('buffered', {'STREAM_TEMPLATES': False, 'COMPRESS': False}, None),
+    ('streamed', {'STREAM_TEMPLATES': True, 'COMPRESS': False}, None),
+    ('streamed+gzip', {'STREAM_TEMPLATES': True, 'COMPRESS': True}, 'gzip'),
+)
+
+@contextmanager
+def serve(app):
+    """Serves app on a free local port from a forked process, so it never competes with the client. Yields the port."""
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    server.socket.close()
+    try:
+        yield server.server_port
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+def login(port, email):
+    """Logs in and returns the session's Cookie header."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', '/login', urlencode({'email': email, 'password': PASSWORD}),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    if response.status != 302:
+        raise RuntimeError(f'Login as {email} failed with status {response.status}.')
+    cookies = SimpleCookie()
+    for header in response.headers.get_all('Set-Cookie') or ():
+        cookies.load(header)
+    return '; '.join(f'{name}={morsel.value}' for name, morsel in cookies.items())
+
+def fetch(port, path, cookie, encoding=None):
+    """Returns (ttfb_ms, total_ms, bytes) for one GET, counting bytes as sent (still compressed)."""
+    headers = {'Cookie': cookie, 'Accept-Encoding': encoding or 'identity'}
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        started = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        first = response.read(1)
+        ttfb = time.perf_counter() - started
+        size = len(first) + len(response.read())
+        total = time.perf_counter() - started
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(f'GET {path} returned {response.status}.')
+    return ttfb * 1000, total * 1000, size
+
+def measure(database, page_size, requests):
+    from JENGAMART.app import create_app
+
+    results = {}
+    for mode, config, encoding in MODES:
+        app = create_app(dict(config, DATABASE=database, JOB_WORKERS=0, AUTH_THROTTLE=False, WTF_CSRF_ENABLED=False,
+                              INVENTORY_PAGE_SIZE=page_size, ADMIN_PAGE_SIZE=page_size))
+        results[mode] = {}
+        with serve(app) as port:
+            cookies = {'user': login(port, user_email(0)), 'admin': login(port, ADMIN_EMAIL)}
+            for role, path in PAGES:
+                fetch(port, path, cookies[role], encoding) # Warm the caches
+                samples = [fetch(port, path, cookies[role], encoding) for _ in range(requests)]
+                results[mode][path] = {
+                    'ttfb_ms': statistics.median(sample[0] for sample in samples),
+                    'total_ms': statistics.median(sample[1] for sample in samples),
+                    'bytes': statistics.median(sample[2] for sample in samples),
+                }
+    return results
+
+def print_table(results):
+    print(f'{"page":<14}{"mode":<16}{"TTFB ms":>10}{"total ms":>10}{"bytes":>10}')
+    for path in dict.fromkeys(path for modes in results.values() for path in modes):
+        for mode, pages in results.items():
+            row = pages[path]
+            print(f'{path:<14}{mode:<16}{row["ttfb_ms"]:>10.2f}{row["total_ms"]:>10.2f}{row["bytes"]:>10.0f}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m JENGAMART.bench.ttfb',
+                                     description='Benchmark time to first byte and bytes sent for large pages.')
+    parser.add_argument('--size', type=int, default=10000, help='products in the generated catalog')
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--page-size', type=int, default=200, help='products per inventory and admin page')
+    parser.add_argument('--requests', type=int, default=30, help='timed requests per page and mode')
+    parser.add_argument('--workdir', help='where the database is generated (default: a temporary directory)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='jengamart-ttfb-'))
+    os.makedirs(workdir, exist_ok=True)
+    # Building the app migrates ./jengamart.db unless told otherwise, so stay inside the workdir
+    os.chdir(workdir)
+    database = os.path.join(workdir, f'ttfb-{args.size}.db')
+    generate_catalog(database, args.size, args.categories, seed=args.seed)
+
+    results = measure(database, args.page_size, args.requests)
+    print(f'\n{args.size} products, {args.page_size} per page, median of {args.requests} requests')
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'\nSaved results to {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
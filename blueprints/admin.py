@@ -1,11 +1,22 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, current_app
 from functools import wraps
-from JENGAMART.blueprints.auth import login_required
+from JENGAMART.blueprints.auth import login_required, current_user_is_admin, bump_role_version, role_check_counts
 import sqlite3
 import os
+import io
+import csv
+import click
 from uuid import uuid4
 from werkzeug.utils import secure_filename
-from ..db import get_db # Import get_db from the new db.py module
+from ..db import get_db, get_read_db, pool_stats # Import get_db from the new db.py module
+from ..cache import bump_catalog_version, catalog_cache_stats, fragment_cache_stats, get_categories
+from ..catalog_io import import_products, export_products, read_rows, format_for_filename, FORMATS
+from ..images import images_dir, schedule_processing, process_image, delete_image
+from ..pagination import products_page
+from ..streaming import stream_page
+from ..pricing import preview_price_change, validate_price_change
+from ..jobs import enqueue, get_job, recent_jobs
+from ..related import schedule_related, rebuild_related
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -13,6 +24,15 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_stock(value):
+    """Returns the stock level from a form field, or None (not tracked) when it is blank."""
+    if not value or not value.strip():
+        return None
+    stock = int(value)
+    if stock < 0:
+        raise ValueError('Stock cannot be negative.')
+    return stock
+
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 def admin_required(f):
@@ -21,11 +41,9 @@ def admin_required(f):
         if 'user_id' not in session:
             flash('You need to be logged in to view this page.', 'info')
             return redirect(url_for('auth.login'))
-        
-        conn = get_db()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
 
-        if not user or not user['is_admin']:
+        # Answered from the session's role claims, without a users query on most requests
+        if not current_user_is_admin():
             flash('You do not have permission to access this page.', 'danger')
             return redirect(url_for('home'))
         return f(*args, **kwargs)
@@ -34,9 +52,20 @@ def admin_required(f):
 @admin_bp.route('/')
 @admin_required
 def admin_dashboard():
-    conn = get_db()
-    products = conn.execute('SELECT p.id, p.name, p.price, c.name as category_name, p.image_file FROM products p JOIN categories c ON p.category_id = c.id ORDER BY p.name').fetchall()
-    return render_template('admin/dashboard.html', products=products)
+    products, next_cursor = products_page(get_read_db(), get_categories(), request.args.get('cursor'),
+                                          current_app.config.get('ADMIN_PAGE_SIZE', 50))
+    return stream_page('admin/dashboard.html', products=products,
+                       next_page_url=url_for('admin.admin_dashboard', cursor=next_cursor) if next_cursor else None,
+                       next_page_json_url=url_for('admin.products_next_page', cursor=next_cursor) if next_cursor else None)
+
+@admin_bp.route('/products/page')
+@admin_required
+def products_next_page():
+    """Returns the next page of the product table as JSON, for infinite scrolling."""
+    products, next_cursor = products_page(get_read_db(), get_categories(), request.args.get('cursor'),
+                                          current_app.config.get('ADMIN_PAGE_SIZE', 50))
+    return jsonify(html=render_template('admin/_product_rows.html', products=products),
+                   next_url=url_for('admin.products_next_page', cursor=next_cursor) if next_cursor else None)
 
 @admin_bp.route('/add_product', methods=['GET', 'POST'])
 @admin_required
@@ -48,6 +77,11 @@ def add_product():
         except ValueError:
             flash('Price must be a valid number.', 'danger')
             return redirect(url_for('admin.add_product'))
+        try:
+            stock = parse_stock(request.form.get('stock'))
+        except ValueError:
+            flash('Stock must be a whole number of at least 0, or blank.', 'danger')
+            return redirect(url_for('admin.add_product'))
         description = request.form['description']
         category_id = request.form['category_id']
         image = request.files.get('image')
@@ -62,16 +96,21 @@ def add_product():
             extension = image.filename.rsplit('.', 1)[1].lower()
             unique_filename = str(uuid4()) + '.' + extension
             image_filename = unique_filename
-            image.save(os.path.join(admin_bp.root_path, '..', 'static', 'images', image_filename))
+            image.save(os.path.join(images_dir(), image_filename))
         elif image and image.filename != '':
             flash('Invalid file type for image. Allowed types are png, jpg, jpeg, gif.', 'danger')
             return redirect(url_for('admin.add_product'))
 
         conn = get_db()
         try:
-            conn.execute('INSERT INTO products (name, price, description, category_id, image_file) VALUES (?, ?, ?, ?, ?)',
-                         (name, price, description, category_id, image_filename))
+            cursor = conn.execute('INSERT INTO products (name, price, description, category_id, image_file, stock, '
+                                  'updated_at) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)',
+                                  (name, price, description, category_id, image_filename, stock))
+            bump_catalog_version(conn)
             conn.commit()
+            # Resized variants and related products are computed in the background
+            schedule_processing(image_filename)
+            schedule_related(conn, [cursor.lastrowid])
             flash('Product added successfully!', 'success')
             return redirect(url_for('admin.admin_dashboard'))
         except sqlite3.IntegrityError:
@@ -83,8 +122,7 @@ def add_product():
             flash(f'Database error: {e}', 'danger')
             return redirect(url_for('admin.add_product'))
     
-    conn = get_db()
-    categories = conn.execute('SELECT * FROM categories ORDER BY name').fetchall()
+    categories = get_categories()
     return render_template('admin/add_product.html', categories=categories)
 
 @admin_bp.route('/edit_product/<int:product_id>', methods=['GET', 'POST'])
@@ -103,6 +141,11 @@ def edit_product(product_id):
         except ValueError:
             flash('Price must be a valid number.', 'danger')
             return redirect(url_for('admin.edit_product', product_id=product_id))
+        try:
+            stock = parse_stock(request.form.get('stock'))
+        except ValueError:
+            flash('Stock must be a whole number of at least 0, or blank.', 'danger')
+            return redirect(url_for('admin.edit_product', product_id=product_id))
         description = request.form['description']
         category_id = request.form['category_id']
         image = request.files.get('image')
@@ -120,18 +163,20 @@ def edit_product(product_id):
             unique_filename = str(uuid4()) + '.' + extension
             image_filename = unique_filename
             # Save new image
-            image.save(os.path.join(admin_bp.root_path, '..', 'static', 'images', image_filename))
-            # Delete old image if it's not the placeholder
-            if product['image_file'] and product['image_file'] != 'placeholder.jpg':
-                try:
-                    os.remove(os.path.join(admin_bp.root_path, '..', 'static', 'images', product['image_file']))
-                except OSError as e:
-                    print(f"Error deleting old image: {e}") # Log error but don't stop execution
+            image.save(os.path.join(images_dir(), image_filename))
+            # Delete old image and its variants if it's not the placeholder
+            delete_image(product['image_file'], product['image_variants'])
 
         try:
-            conn.execute('UPDATE products SET name = ?, price = ?, description = ?, category_id = ?, image_file = ? WHERE id = ?',
-                         (name, price, description, category_id, image_filename, product_id))
+            conn.execute('UPDATE products SET name = ?, price = ?, description = ?, category_id = ?, image_file = ?, '
+                         'image_variants = CASE WHEN image_file = ? THEN image_variants END, stock = ?, '
+                         'updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (name, price, description, category_id, image_filename, image_filename, stock, product_id))
+            bump_catalog_version(conn)
             conn.commit()
+            if image_filename != product['image_file']:
+                schedule_processing(image_filename)
+            schedule_related(conn, [product_id])
             flash('Product updated successfully!', 'success')
             return redirect(url_for('admin.admin_dashboard'))
         except sqlite3.Error as e:
@@ -139,7 +184,7 @@ def edit_product(product_id):
             flash(f'Database error: {e}', 'danger')
             return redirect(url_for('admin.edit_product', product_id=product_id))
     
-    categories = conn.execute('SELECT * FROM categories ORDER BY name').fetchall()
+    categories = get_categories()
     return render_template('admin/edit_product.html', product=product, categories=categories)
 
 @admin_bp.route('/delete_product/<int:product_id>', methods=['POST'])
@@ -152,14 +197,14 @@ def delete_product(product_id):
         return redirect(url_for('admin.admin_dashboard'))
 
     try:
+        conn.execute('DELETE FROM cart_items WHERE product_id = ?', (product_id,))
         conn.execute('DELETE FROM products WHERE id = ?', (product_id,))
+        bump_catalog_version(conn)
         conn.commit()
-        # Delete image file if it's not the placeholder
-        if product['image_file'] and product['image_file'] != 'placeholder.jpg':
-            try:
-                os.remove(os.path.join(admin_bp.root_path, '..', 'static', 'images', product['image_file']))
-            except OSError as e:
-                print(f"Error deleting image: {e}")
+        # Delete image file and its variants if it's not the placeholder
+        delete_image(product['image_file'], product['image_variants'])
+        # Products that listed this one get new neighbours
+        schedule_related(conn, [product_id])
         flash('Product deleted successfully!', 'success')
     except sqlite3.Error as e:
         conn.rollback()
@@ -167,10 +212,28 @@ def delete_product(product_id):
     
     return redirect(url_for('admin.admin_dashboard'))
 
+@admin_bp.route('/stats')
+@admin_required
+def stats():
+    """Runtime stats for monitoring, per worker process."""
+    return jsonify(db_pools=pool_stats(), catalog_cache=catalog_cache_stats(), fragment_cache=fragment_cache_stats(),
+                   role_checks=role_check_counts())
+
 @admin_bp.route('/bulk-updates')
 @admin_required
 def bulk_updates():
-    return render_template('admin/bulk_updates.html')
+    # Each render gets a fresh key, so a double-submitted form queues only one job
+    return render_template('admin/bulk_updates.html', categories=get_categories(), jobs=recent_jobs(get_read_db()),
+                           idempotency_key=uuid4().hex)
+
+@admin_bp.route('/jobs/<int:job_id>')
+@admin_required
+def job_status(job_id):
+    """Returns a background job's status and progress as JSON, for polling."""
+    job = get_job(get_read_db(), job_id)
+    if job is None:
+        return jsonify(error='Job not found.'), 404
+    return jsonify(job)
 
 @admin_bp.route('/bulk-update-featured', methods=['POST'])
 @admin_required
@@ -182,9 +245,10 @@ def bulk_update_featured():
 
     conn = get_db()
     try:
-        conn.execute('UPDATE products SET featured = ?', (int(featured_status),))
-        conn.commit()
-        flash('Featured status for all products has been updated.', 'success')
+        # Setting a flag is idempotent, so failed attempts can safely be retried
+        job_id = enqueue(conn, 'featured', {'featured': int(featured_status)},
+                         idempotency_key=request.form.get('idempotency_key'))
+        flash(f'Featured status update queued as job #{job_id}.', 'success')
     except sqlite3.Error as e:
         conn.rollback()
         flash(f'Database error: {e}', 'danger')
@@ -194,30 +258,127 @@ def bulk_update_featured():
 @admin_bp.route('/bulk-update-prices', methods=['POST'])
 @admin_required
 def bulk_update_prices():
+    mode = request.form.get('price_update_mode', 'percent')
     try:
-        percentage = float(request.form.get('price_update_percentage'))
-    except (ValueError, TypeError):
-        flash('Invalid percentage value.', 'danger')
+        amount = float(request.form.get('price_update_amount'))
+        category_id = int(request.form['category_id']) if request.form.get('category_id') else None
+        featured = int(request.form['featured']) if request.form.get('featured') in ('0', '1') else None
+        product_ids = request.form.get('product_ids', '').replace(',', ' ').split()
+        ids = [int(product_id) for product_id in product_ids] if product_ids else None
+        validate_price_change(mode, amount)
+    except (ValueError, TypeError) as e:
+        flash(f'Invalid price update: {e}', 'danger')
         return redirect(url_for('admin.bulk_updates'))
 
+    unit = '%' if mode == 'percent' else ' KSh'
     conn = get_db()
     try:
-        # Fetch all products
-        products = conn.execute('SELECT id, price FROM products').fetchall()
-        
-        # Calculate and update new prices
-        for product in products:
-            new_price = product['price'] * (1 + percentage / 100)
-            conn.execute('UPDATE products SET price = ? WHERE id = ?', (new_price, product['id']))
-        
-        conn.commit()
-        flash(f'Prices for all products have been updated by {percentage}%.', 'success')
+        if request.form.get('action') == 'preview':
+            preview = preview_price_change(conn, mode, amount, category_id, featured, ids)
+            if preview['count']:
+                flash(f"Preview: {preview['count']} products would change by {amount}{unit}, "
+                      f"with price changes from {preview['min_delta']:.2f} to {preview['max_delta']:.2f} KSh. "
+                      f"No prices were updated.", 'info')
+            else:
+                flash('Preview: no products match these filters.', 'info')
+        else:
+            # Chunks commit as they go, so a retry would apply the change twice: run it once only
+            job_id = enqueue(conn, 'reprice', {'mode': mode, 'amount': amount, 'category_id': category_id,
+                                               'featured': featured, 'ids': ids},
+                             idempotency_key=request.form.get('idempotency_key'), max_attempts=1)
+            flash(f'Price change of {amount}{unit} queued as job #{job_id}.', 'success')
     except sqlite3.Error as e:
         conn.rollback()
         flash(f'Database error: {e}', 'danger')
     
     return redirect(url_for('admin.bulk_updates'))
 
+@admin_bp.route('/import', methods=['GET', 'POST'])
+@admin_required
+def import_catalog():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or upload.filename == '':
+            flash('Choose a CSV or JSONL file to import.', 'danger')
+            return redirect(url_for('admin.import_catalog'))
+
+        fmt = request.form.get('format') or format_for_filename(upload.filename)
+        # Werkzeug spools large uploads to disk, so this reads the file one line at a time
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        conn = get_db()
+        try:
+            result = import_products(conn, read_rows(stream, fmt))
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            conn.rollback()
+            flash(f'Could not read the file: {e}', 'danger')
+            return redirect(url_for('admin.import_catalog'))
+        except sqlite3.Error as e:
+            conn.rollback()
+            flash(f'Database error: {e}', 'danger')
+            return redirect(url_for('admin.import_catalog'))
+
+        if result['inserted'] or result['updated']:
+            schedule_related(conn)
+        flash(f"Import finished: {result['inserted']} added, {result['updated']} updated, "
+              f"{result['skipped']} skipped.", 'success')
+        for error in result['errors']:
+            flash(error, 'warning')
+        return redirect(url_for('admin.import_catalog'))
+
+    return render_template('admin/import.html', formats=FORMATS)
+
+@admin_bp.route('/export')
+@admin_required
+def export_catalog():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        flash('Invalid export format.', 'danger')
+        return redirect(url_for('admin.import_catalog'))
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_products(get_read_db(), fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=jengamart-products.{fmt}'})
+
+@admin_bp.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+def import_catalog_command(path, fmt):
+    """Import products from a CSV or JSONL file."""
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        result = import_products(get_db(), read_rows(stream, fmt or format_for_filename(path)))
+    if result['inserted'] or result['updated']:
+        schedule_related(get_db())
+    click.echo(f"{result['inserted']} added, {result['updated']} updated, {result['skipped']} skipped.")
+    for error in result['errors']:
+        click.echo(error, err=True)
+
+@admin_bp.cli.command('export-catalog')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+def export_catalog_command(path, fmt):
+    """Export all products to a CSV or JSONL file."""
+    with open(path, 'w', encoding='utf-8', newline='') as stream:
+        for line in export_products(get_db(), fmt or format_for_filename(path)):
+            stream.write(line)
+    click.echo(f'Exported products to {path}.')
+
+@admin_bp.cli.command('backfill-images')
+def backfill_images_command():
+    """Generate resized variants for product images that have none."""
+    conn = get_db()
+    filenames = [row['image_file'] for row in conn.execute(
+        'SELECT DISTINCT image_file FROM products WHERE image_variants IS NULL AND image_file IS NOT NULL')]
+    processed = sum(1 for filename in filenames if process_image(filename))
+    click.echo(f'Created variants for {processed} of {len(filenames)} images.')
+
+@admin_bp.cli.command('rebuild-related')
+def rebuild_related_command():
+    """Recompute related products for the whole catalog, e.g. to pick up new cart co-occurrence."""
+    conn = get_db()
+    scored = rebuild_related(conn)
+    bump_catalog_version(conn)
+    conn.commit()
+    click.echo(f'Scored related products for {scored} products.')
+
 @admin_bp.route('/make-admin', methods=['POST'])
 @login_required # This should remain login_required, not admin_required as the admin_required will handle the admin check.
 def make_admin():
@@ -229,9 +390,7 @@ def make_admin():
         return redirect(url_for('admin.admin_dashboard'))
     conn = get_db()
     # First, ensure the current user is an admin before making changes.
-    current_user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    
-    if not current_user or not current_user['is_admin']:
+    if not current_user_is_admin():
         flash('You do not have permission to perform this action.', 'danger')
         return redirect(url_for('home'))
 
@@ -242,6 +401,8 @@ def make_admin():
     else:
         try:
             conn.execute('UPDATE users SET is_admin = 1 WHERE id = ?', (user_id,))
+            # Other sessions pick up the change on their next revalidation
+            bump_role_version(conn)
             conn.commit()
             flash(f"{user_to_promote['username']} has been made an admin.", 'success')
         except sqlite3.Error as e:
@@ -1,11 +1,71 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, make_response
 from functools import wraps
 import sqlite3
-from ..db import get_db # Import get_db from the new db.py module
+import threading
+import time
+from ..db import get_db, get_read_db, get_meta, bump_meta # Import get_db from the new db.py module
+from ..cart import merge_cart
+from ..passwords import hash_password, verify_password, needs_rehash, HashingBusy
+from ..throttle import check as check_throttle
 
 auth_bp = Blueprint('auth', __name__)
 
+# Role claims are cached in the signed session cookie. They are trusted for
+# ROLE_REVALIDATE_SECONDS, then checked against role_version in app_meta.
+# Only when that version has moved, after a promotion or demotion, is the
+# user's row read again.
+ROLE_VERSION = 'role_version'
+role_checks = {'cached': 0, 'revalidated': 0, 'reloaded': 0}
+_role_checks_lock = threading.Lock() # Every request thread counts here
+
+def _count_role_check(result):
+    with _role_checks_lock:
+        role_checks[result] += 1
+
+def role_check_counts():
+    """Returns a consistent copy of role_checks."""
+    with _role_checks_lock:
+        return dict(role_checks)
+
+def remember_role(user, role_version):
+    """Stores the user's role in the session, as of role_version."""
+    session['role'] = {'admin': bool(user['is_admin']), 'version': role_version, 'checked': time.time()}
+
+def bump_role_version(conn):
+    """Makes every session revalidate its role claims. Call before committing a role change."""
+    bump_meta(conn, ROLE_VERSION)
+
+def current_user_is_admin():
+    """Returns whether the logged-in user is an admin, touching the database at most once per interval."""
+    if 'user_id' not in session:
+        return False
+    claims = session.get('role')
+    now = time.time()
+    if claims and now - claims['checked'] < current_app.config.get('ROLE_REVALIDATE_SECONDS', 30):
+        _count_role_check('cached')
+        return claims['admin']
+
+    conn = get_read_db()
+    role_version = get_meta(conn, ROLE_VERSION)
+    if claims and claims['version'] == role_version:
+        _count_role_check('revalidated')
+        session['role'] = dict(claims, checked=now)
+        return claims['admin']
+
+    _count_role_check('reloaded')
+    user = conn.execute('SELECT is_admin FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+    if user is None:
+        session.pop('role', None)
+        return False
+    remember_role(user, role_version)
+    return bool(user['is_admin'])
+
+def _refuse(template, status, retry_after):
+    """Re-renders a form with a throttling or overload status and a Retry-After hint."""
+    response = make_response(render_template(template), status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -28,17 +88,26 @@ def register():
             return redirect(url_for('auth.register'))
 
         conn = get_db()
-        user_by_username = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        user_by_email = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        wait = check_throttle(conn, ('register_ip', request.remote_addr))
+        if wait:
+            flash(f'Too many sign-ups from your network. Try again in {wait} seconds.', 'danger')
+            return _refuse('register.html', 429, wait)
 
-        if user_by_username:
+        # One lookup through both unique indexes
+        taken = conn.execute('SELECT username = ? AS username_taken, email = ? AS email_taken FROM users '
+                             'WHERE username = ? OR email = ?', (username, email, username, email)).fetchall()
+        if any(row['username_taken'] for row in taken):
             flash('Username already exists.', 'danger')
             return redirect(url_for('auth.register'))
-        if user_by_email:
+        if taken:
             flash('Email address already registered.', 'danger')
             return redirect(url_for('auth.register'))
 
-        password_hash = generate_password_hash(password)
+        try:
+            password_hash = hash_password(password)
+        except HashingBusy:
+            flash('We are busy right now. Please try again in a moment.', 'warning')
+            return _refuse('register.html', 503, 1)
 
         try:
             conn.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
@@ -64,11 +133,37 @@ def login():
         password = request.form['password']
 
         conn = get_db()
+        # Throttled attempts are refused before anything is hashed
+        wait = check_throttle(conn, ('login_ip', request.remote_addr), ('login_account', email.strip().lower()))
+        if wait:
+            flash(f'Too many login attempts. Try again in {wait} seconds.', 'danger')
+            return _refuse('login.html', 429, wait)
+
         user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        try:
+            valid = user is not None and verify_password(user['password_hash'], password)
+        except HashingBusy:
+            flash('We are handling a lot of logins right now. Please try again in a moment.', 'warning')
+            return _refuse('login.html', 503, 1)
 
-        if user and check_password_hash(user['password_hash'], password):
+        if valid:
+            if needs_rehash(user['password_hash']):
+                # Upgrade to the configured parameters while the plain password is at hand
+                try:
+                    conn.execute('UPDATE users SET password_hash = ? WHERE id = ?',
+                                 (hash_password(password), user['id']))
+                    conn.commit()
+                except HashingBusy:
+                    pass # Upgraded on a later login instead
             session['user_id'] = user['id']
             session['username'] = user['username']
+            # The row is already loaded, so capture the role now
+            remember_role(user, get_meta(conn, ROLE_VERSION))
+            # Carry over a cart left in the cookie by the old session-based cart
+            legacy_cart = session.pop('cart', None)
+            if legacy_cart:
+                merge_cart(conn, user['id'], legacy_cart)
+                conn.commit()
             
             if user['is_admin']:
                 flash('Admin login successful!', 'success')
@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import g, current_app, has_app_context
+from JENGAMART.db import get_read_db, get_meta, bump_meta, set_meta
+from JENGAMART.facets import facet_counts
+
+# Read-through cache for catalog queries.
+#
+# Entries are keyed by the catalog version stored in app_meta. Every admin
+# write bumps that version inside its own transaction, so each worker notices
+# the change on its next request and drops what it has cached. No shared
+# cache service is needed across gunicorn workers.
+
+CATALOG_VERSION = 'catalog_version'
+CATALOG_MODIFIED_AT = 'catalog_modified_at' # Unix time of the last catalog write
+
+class LRUCache:
+    """A thread-safe, size-bounded LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Returns (found, value) so cached None values count as hits."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+_catalog = None
+_catalog_version = None
+_catalog_lock = threading.Lock()
+_fragments = None
+
+def _get_catalog_cache():
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = LRUCache(
+                    max_size=current_app.config.get('CATALOG_CACHE_SIZE', 2048),
+                    ttl=current_app.config.get('CATALOG_CACHE_TTL', 300.0),
+                )
+    return _catalog
+
+def _get_fragment_cache():
+    global _fragments
+    if _fragments is None:
+        with _catalog_lock:
+            if _fragments is None:
+                _fragments = LRUCache(
+                    max_size=current_app.config.get('FRAGMENT_CACHE_SIZE', 4096),
+                    ttl=current_app.config.get('CATALOG_CACHE_TTL', 300.0),
+                )
+    return _fragments
+
+def get_catalog_version(conn=None):
+    """Returns the catalog version, read at most once per request."""
+    if 'catalog_version' not in g:
+        g.catalog_version = get_meta(conn or get_read_db(), CATALOG_VERSION)
+    return g.catalog_version
+
+def get_catalog_modified_at(conn=None):
+    """Returns the Unix time of the last catalog write, or 0 if there has been none."""
+    return get_meta(conn or get_read_db(), CATALOG_MODIFIED_AT)
+
+def bump_catalog_version(conn):
+    """Marks the catalog as changed. Call inside the write's transaction, before commit."""
+    global _catalog_version
+    bump_meta(conn, CATALOG_VERSION)
+    set_meta(conn, CATALOG_MODIFIED_AT, int(time.time()))
+    if has_app_context():
+        g.pop('catalog_version', None)
+    if _catalog is not None:
+        _catalog.clear()
+        _catalog_version = None
+    if _fragments is not None:
+        _fragments.clear()
+
+def cached(key, loader):
+    """Returns the cached value for key, calling loader(conn) to fill it on a miss."""
+    global _catalog_version
+    cache = _get_catalog_cache()
+    conn = get_read_db()
+    version = get_catalog_version(conn)
+    # A request still on an older read snapshot must not fill the cache for newer ones, so the
+    # version is part of the key and only a newer version clears out the old entries
+    if _catalog_version is None or version > _catalog_version:
+        with _catalog_lock:
+            if _catalog_version is None or version > _catalog_version:
+                cache.clear()
+                _catalog_version = version
+
+    key = (version,) + key
+    found, value = cache.get(key)
+    if not found:
+        value = loader(conn)
+        cache.set(key, value)
+    return value
+
+def cached_fragment(key, render):
+    """Returns rendered markup for key, calling render() to fill it on a miss.
+
+    The catalog version is part of the key, so fragments rendered from an
+    older catalog are never served and simply age out of the LRU.
+    """
+    cache = _get_fragment_cache()
+    key = (get_catalog_version(),) + key
+    found, value = cache.get(key)
+    if not found:
+        value = render()
+        cache.set(key, value)
+    return value
+
+def catalog_cache_stats():
+    return dict(_get_catalog_cache().stats(), version=_catalog_version)
+
+def fragment_cache_stats():
+    return _get_fragment_cache().stats()
+
+def get_featured_products():
+    return cached(('featured',), lambda conn: tuple(
+        conn.execute('SELECT * FROM products WHERE featured = 1').fetchall()))
+
+def get_categories():
+    return cached(('categories',), lambda conn: tuple(
+        conn.execute('SELECT * FROM categories ORDER BY name').fetchall()))
+
+def get_product(product_id):
+    return cached(('product', product_id), lambda conn:
+        conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone())
+
+def _load_related(conn, product, limit):
+    rows = conn.execute('SELECT p.* FROM product_related r JOIN products p ON p.id = r.related_id '
+                        'WHERE r.product_id = ? ORDER BY r.rank LIMIT ?', (product['id'], limit)).fetchall()
+    if not rows:
+        # Not scored yet, e.g. a product added since the last recompute
+        rows = conn.execute('SELECT * FROM products WHERE category_id = ? AND id != ? LIMIT ?',
+                            (product['category_id'], product['id'], limit)).fetchall()
+    return tuple(rows)
+
+def get_related_products(product, limit=4):
+    """Returns the product's precomputed neighbours, best first."""
+    return cached(('related', product['id'], limit), lambda conn: _load_related(conn, product, limit))
+
+def get_facet_counts(category_id=None, bucket=None):
+    return cached(('facets', int(category_id) if category_id else None, bucket),
+                  lambda conn: facet_counts(conn, category_id, bucket))
@@ -0,0 +1,68 @@
+# Server-side shopping carts.
+#
+# Cart lines live in cart_items, keyed by user id, so the session cookie no
+# longer carries the cart. Prices are never stored in the cart: they are
+# joined from products when the cart is read, in a single query.
+
+MAX_QUANTITY = 999
+
+def add_item(conn, user_id, product_id, quantity=1):
+    """Adds quantity of a product to the cart. Returns False if the product does not exist. Does not commit."""
+    quantity = min(quantity, MAX_QUANTITY) # Also keeps huge form values within SQLite's integer range
+    cursor = conn.execute(
+        'INSERT INTO cart_items (user_id, product_id, quantity) SELECT ?, id, ? FROM products WHERE id = ? '
+        'ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = MIN(quantity + excluded.quantity, ?)',
+        (user_id, quantity, product_id, MAX_QUANTITY)
+    )
+    return cursor.rowcount > 0
+
+def set_quantity(conn, user_id, product_id, quantity):
+    """Sets a line's quantity, removing the line when it drops to zero. Does not commit."""
+    if quantity <= 0:
+        remove_item(conn, user_id, product_id)
+        return
+    conn.execute('UPDATE cart_items SET quantity = ? WHERE user_id = ? AND product_id = ?',
+                 (min(quantity, MAX_QUANTITY), user_id, product_id))
+
+def remove_item(conn, user_id, product_id):
+    """Removes a product from the cart. Returns False if it was not there. Does not commit."""
+    cursor = conn.execute('DELETE FROM cart_items WHERE user_id = ? AND product_id = ?', (user_id, product_id))
+    return cursor.rowcount > 0
+
+def clear_cart(conn, user_id):
+    conn.execute('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
+
+def cart_count(conn, user_id):
+    """Returns the number of items in the cart, counting quantities."""
+    return conn.execute('SELECT COALESCE(SUM(quantity), 0) AS count FROM cart_items WHERE user_id = ?',
+                        (user_id,)).fetchone()['count']
+
+def get_cart(conn, user_id):
+    """Returns (items, total) with current prices, computed in one query."""
+    rows = conn.execute('''
+        SELECT p.id, p.name, p.price, p.image_file, p.image_variants, p.stock, ci.quantity,
+               p.price * ci.quantity AS line_total,
+               SUM(p.price * ci.quantity) OVER () AS cart_total
+        FROM cart_items ci
+        JOIN products p ON p.id = ci.product_id
+        WHERE ci.user_id = ?
+        ORDER BY ci.added_at, p.id
+    ''', (user_id,)).fetchall()
+    return rows, rows[0]['cart_total'] if rows else 0
+
+def merge_cart(conn, user_id, items):
+    """Merges {product_id: quantity} into the user's cart, e.g. a cart left in an old session cookie. Does not commit."""
+    lines = []
+    for product_id, quantity in (items or {}).items():
+        try:
+            quantity, product_id = int(quantity), int(product_id)
+        except (TypeError, ValueError):
+            continue # Ignore malformed entries rather than failing the login
+        if quantity > 0:
+            lines.append((user_id, min(quantity, MAX_QUANTITY), product_id, MAX_QUANTITY))
+    if lines:
+        conn.executemany(
+            'INSERT INTO cart_items (user_id, product_id, quantity) SELECT ?, id, ? FROM products WHERE id = ? '
+            'ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = MIN(quantity + excluded.quantity, ?)',
+            lines
+        )
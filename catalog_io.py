@@ -0,0 +1,160 @@
+import csv
+import io
+import json
+import re
+from JENGAMART.cache import bump_catalog_version
+
+# Streaming catalog import and export.
+#
+# Imports read CSV or JSONL one row at a time and write in chunks with
+# executemany, committing after each chunk. Products are upserted on their
+# unique name: an existing product is updated, a new name is inserted.
+# Exports iterate a cursor and yield one encoded line at a time, so neither
+# direction ever holds the whole file in memory.
+
+CHUNK_SIZE = 1000
+FIELDS = ('name', 'category', 'price', 'description', 'image_file', 'featured')
+FORMATS = ('csv', 'jsonl')
+
+def parse_price(value):
+    """Extracts the numeric part of a price (e.g., "1,150 KSh" -> 1150.0)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r'\d[\d,]*(\.\d+)?', value or '')
+    if not match:
+        raise ValueError(f'Invalid price: {value!r}')
+    return float(match.group(0).replace(',', ''))
+
+def format_for_filename(filename):
+    """Guesses the import format from a file name."""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return 'jsonl' if extension in ('jsonl', 'ndjson', 'json') else 'csv'
+
+def read_rows(stream, fmt):
+    """Yields one record per row of a text stream of CSV (with a header row) or JSONL.
+
+    Records are decoded by import_products, so a malformed row is skipped and
+    reported like any other invalid row: CSV rows are dicts (or the csv.Error
+    a row raised), JSONL rows are the raw line (None for a blank line, which
+    keeps row numbers equal to line numbers).
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                yield next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e: # The reader carries on from the next line
+                yield e
+    elif fmt == 'jsonl':
+        for line in stream:
+            yield line if line.strip() else None
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+
+def _decode(row):
+    if isinstance(row, csv.Error):
+        raise ValueError(str(row))
+    if isinstance(row, str):
+        row = json.loads(row) # JSONDecodeError is a ValueError
+    if not isinstance(row, dict):
+        raise ValueError('expected an object with product fields')
+    return row
+
+def import_products(conn, rows, chunk_size=CHUNK_SIZE):
+    """Upserts products by name from an iterable of dicts. Returns counts and the first errors."""
+    categories = {row['name']: row['id'] for row in conn.execute('SELECT id, name FROM categories')}
+    result = {'inserted': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+
+    chunk = {}
+    for line_number, row in enumerate(rows, start=1):
+        if row is None:
+            continue # A blank JSONL line
+        try:
+            product = _normalize(_decode(row))
+        except (ValueError, TypeError, KeyError) as e:
+            result['skipped'] += 1
+            if len(result['errors']) < 10:
+                result['errors'].append(f'Row {line_number}: {e}')
+            continue
+        if product['category'] not in categories:
+            categories[product['category']] = _create_category(conn, product['category'])
+        product['category_id'] = categories[product['category']]
+        chunk[product['name']] = product # Later rows for the same name win
+        if len(chunk) >= chunk_size:
+            _write_chunk(conn, chunk, result)
+            chunk = {}
+    if chunk:
+        _write_chunk(conn, chunk, result)
+    return result
+
+def _text(row, field):
+    # JSONL values may be of any JSON type; only scalars make sense as text
+    value = row.get(field)
+    if isinstance(value, (dict, list)):
+        raise ValueError(f'{field} must be text')
+    return str(value).strip() if value is not None else ''
+
+def _normalize(row):
+    name = _text(row, 'name')
+    category = _text(row, 'category')
+    if not name:
+        raise ValueError('name is required')
+    if not category:
+        raise ValueError('category is required')
+    featured = row.get('featured') or 0
+    if isinstance(featured, str):
+        featured = featured.strip().lower() in ('1', 'true', 'yes')
+    return {
+        'name': name,
+        'category': category,
+        'price': parse_price(row.get('price')),
+        'description': _text(row, 'description') or None,
+        'image_file': _text(row, 'image_file') or None,
+        'featured': int(bool(featured)),
+    }
+
+def _create_category(conn, name):
+    conn.execute('INSERT OR IGNORE INTO categories (name) VALUES (?)', (name,))
+    return conn.execute('SELECT id FROM categories WHERE name = ?', (name,)).fetchone()['id']
+
+def _write_chunk(conn, chunk, result):
+    names = list(chunk)
+    existing = conn.execute(f"SELECT COUNT(*) AS n FROM products WHERE name IN ({','.join('?' for _ in names)})",
+                            names).fetchone()['n']
+    conn.executemany(
+        'INSERT INTO products (name, category_id, price, description, image_file, featured, updated_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP) '
+        'ON CONFLICT(name) DO UPDATE SET category_id = excluded.category_id, price = excluded.price, '
+        'description = COALESCE(?, description), image_file = COALESCE(?, image_file), featured = excluded.featured, '
+        'updated_at = CURRENT_TIMESTAMP',
+        [(product['name'], product['category_id'], product['price'], product['description'],
+          product['image_file'] or 'placeholder.jpg', product['featured'],
+          product['description'], product['image_file']) for product in chunk.values()]
+    )
+    bump_catalog_version(conn)
+    conn.commit()
+    result['updated'] += existing
+    result['inserted'] += len(names) - existing
+
+def export_products(conn, fmt):
+    """Yields the catalog as CSV or JSONL text, one line at a time."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+    cursor = conn.execute('SELECT p.name, c.name AS category, p.price, p.description, p.image_file, p.featured '
+                          'FROM products p JOIN categories c ON p.category_id = c.id ORDER BY p.id')
+    if fmt == 'jsonl':
+        for row in cursor:
+            yield json.dumps(dict(row), ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for row in cursor:
+        writer.writerow(tuple(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,88 @@
+from JENGAMART.cart import clear_cart
+
+# Checkout: turning a cart into an order.
+#
+# place_order() runs in one BEGIN IMMEDIATE transaction, so no other writer
+# in any worker can change stock between the availability check and the
+# reservation. Stock for every tracked line is reserved with one
+# conditional UPDATE ... FROM cart_items, and the order is accepted only if
+# that UPDATE reserved every tracked line. Products with NULL stock are not
+# tracked and never run out. Each checkout form carries a token that is
+# stored on the order, so a double-submitted form returns the order it
+# already placed.
+
+PAYMENT_METHODS = {'mpesa': 'M-Pesa', 'credit': 'Credit card', 'debit': 'Debit card'}
+SHIPPING_METHODS = {'pickup': 'Local Pickup', 'standard': 'Standard Delivery', 'express': 'Express Delivery',
+                    'bulk': 'Bulk Delivery'}
+
+class CheckoutError(Exception):
+    """The cart cannot be ordered as it stands."""
+
+class OutOfStock(CheckoutError):
+    def __init__(self, lines):
+        self.lines = lines # cart lines asking for more than is in stock
+        names = ', '.join(f"{line['name']} ({line['stock']} left)" for line in lines)
+        super().__init__(f'Not enough stock for: {names}.')
+
+def place_order(conn, user_id, token, details):
+    """Orders the user's cart and empties it. Returns (order_id, created).
+
+    created is False when the token was already used, in which case the
+    existing order's id is returned and nothing changes. Raises
+    CheckoutError for an empty cart and OutOfStock when a line cannot be
+    reserved; the transaction is rolled back either way.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existing = conn.execute('SELECT id FROM orders WHERE checkout_token = ? AND user_id = ?',
+                                (token, user_id)).fetchone()
+        if existing:
+            conn.rollback()
+            return existing['id'], False
+
+        lines = conn.execute(
+            'SELECT p.id, p.name, p.price, p.stock, ci.quantity FROM cart_items ci '
+            'JOIN products p ON p.id = ci.product_id WHERE ci.user_id = ?', (user_id,)).fetchall()
+        if not lines:
+            raise CheckoutError('Your cart is empty.')
+
+        tracked = [line for line in lines if line['stock'] is not None]
+        if tracked:
+            reserved = conn.execute(
+                'UPDATE products SET stock = products.stock - ci.quantity FROM cart_items ci '
+                'WHERE ci.user_id = ? AND ci.product_id = products.id '
+                'AND products.stock IS NOT NULL AND products.stock >= ci.quantity', (user_id,)).rowcount
+            if reserved != len(tracked):
+                raise OutOfStock([line for line in tracked if line['stock'] < line['quantity']])
+
+        total = sum(line['price'] * line['quantity'] for line in lines)
+        order_id = conn.execute(
+            'INSERT INTO orders (user_id, checkout_token, total, first_name, last_name, email, address, '
+            'payment_method, shipping_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id',
+            (user_id, token, total, details['first_name'], details['last_name'], details.get('email'),
+             details['address'], details['payment_method'], details['shipping_method'])).fetchone()['id']
+        conn.executemany(
+            'INSERT INTO order_lines (order_id, product_id, name, unit_price, quantity) VALUES (?, ?, ?, ?, ?)',
+            [(order_id, line['id'], line['name'], line['price'], line['quantity']) for line in lines])
+        clear_cart(conn, user_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return order_id, True
+
+def get_order(conn, order_id, user_id):
+    """Returns (order, lines) for one of the user's orders, or (None, []) if there is no such order."""
+    order = conn.execute('SELECT * FROM orders WHERE id = ? AND user_id = ?', (order_id, user_id)).fetchone()
+    if order is None:
+        return None, []
+    lines = conn.execute('SELECT *, unit_price * quantity AS line_total FROM order_lines WHERE order_id = ? '
+                         'ORDER BY name', (order_id,)).fetchall()
+    return order, lines
+
+def recent_orders(conn, user_id, limit=10):
+    """Returns the user's latest orders with their item counts, newest first."""
+    return conn.execute(
+        'SELECT o.id, o.total, o.created_at, SUM(l.quantity) AS items FROM orders o '
+        'JOIN order_lines l ON l.order_id = o.id WHERE o.user_id = ? '
+        'GROUP BY o.id ORDER BY o.id DESC LIMIT ?', (user_id, limit)).fetchall()
@@ -0,0 +1,110 @@
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError: # Brotli is optional; gzip is always available
+    brotli = None
+
+# Compression for dynamic responses.
+#
+# Text responses are sent with brotli (if installed) or gzip when the client
+# accepts it. Buffered responses are compressed only if they are at least
+# COMPRESS_MIN_SIZE bytes. Streamed responses have no known size and are
+# always compressed. The compressor is flushed whenever COMPRESS_FLUSH_SIZE
+# bytes have gone in since the last flush, so a streamed page still reaches
+# the browser chunk by chunk while row-by-row streams (CSV and NDJSON
+# exports) are compressed in large blocks. Responses that are already
+# encoded (precompressed static files) and passthrough responses (files sent
+# with send_file) are left alone. COMPRESS_LEVEL sets the gzip level and
+# COMPRESS_BROTLI_QUALITY the brotli quality. Both default low, because the
+# work is repeated for every response. COMPRESS = False turns it all off.
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'application/xml', 'image/svg+xml',
+}
+
+class GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # 31: gzip header and trailer
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+class BrotliEncoder:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+def _encoder():
+    """Returns (encoding, encoder) for the best encoding the client accepts, or (None, None)."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br', BrotliEncoder(current_app.config.get('COMPRESS_BROTLI_QUALITY', 4))
+    if accepted['gzip']:
+        return 'gzip', GzipEncoder(current_app.config.get('COMPRESS_LEVEL', 6))
+    return None, None
+
+def _compressed_stream(body, encoder, flush_size):
+    # Flushing ends a compression block, so it waits for flush_size bytes of input: a
+    # stream_page() chunk flushes at once, a CSV export does not flush on every row
+    pending = 0
+    try:
+        for chunk in body:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            output = encoder.compress(data)
+            pending += len(data)
+            if pending >= flush_size:
+                output += encoder.flush()
+                pending = 0
+            if output:
+                yield output
+        yield encoder.finish()
+    finally:
+        # The server closes this generator; pass that on to the original body,
+        # which for stream_with_context ends the request context
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+
+def compress_response(response):
+    """after_request hook compressing eligible responses."""
+    if (not current_app.config.get('COMPRESS', True) or response.direct_passthrough
+            or response.status_code not in (200, 201, 202, 203)
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES
+            or response.cache_control.no_transform):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not response.is_streamed and len(response.get_data()) < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+    encoding, encoder = _encoder()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compressed_stream(response.response, encoder,
+                                               current_app.config.get('COMPRESS_FLUSH_SIZE', 8192))
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(encoder.compress(response.get_data()) + encoder.finish())
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_app(app):
+    """Installs response compression. Call before other after_request hooks so it runs last."""
+    app.after_request(compress_response)
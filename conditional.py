@@ -0,0 +1,112 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+from flask import current_app, make_response, request, session
+from JENGAMART.assets import COMPRESSIBLE
+from JENGAMART.cache import get_catalog_version, get_catalog_modified_at, get_product, get_related_products
+
+# Conditional GET for public pages.
+#
+# Views decorated with @conditional(validators) answer If-None-Match and
+# If-Modified-Since with a 304 before the view runs, so nothing is queried or
+# rendered for a page the client already has. Validators come from the
+# catalog version, product rows and the deployed release, never
+# from the rendered body. Only anonymous requests without pending flash
+# messages are eligible; personalised responses are marked private so a CDN
+# or proxy never shares them.
+
+# Besides the code, only text assets count: images reach pages through product rows, which have their own validators
+FINGERPRINTED = {'.py'} | COMPRESSIBLE
+FINGERPRINT_SKIP = {'__pycache__', 'bench', 'variants'}
+
+@lru_cache(maxsize=4)
+def source_fingerprint(root):
+    """Hashes the code, templates and text assets under root. Workers started separately agree on it."""
+    digest = hashlib.sha1()
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if name not in FINGERPRINT_SKIP)
+        for name in sorted(files):
+            if os.path.splitext(name)[1] in FINGERPRINTED:
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode() + b'\0')
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+def release():
+    """Identifies the deployed code, so template and asset changes also change ETags."""
+    return (current_app.config.get('RELEASE') or os.environ.get('RENDER_GIT_COMMIT')
+            or source_fingerprint(current_app.root_path))
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(map(str, (release(),) + parts)).encode()).hexdigest()[:20]
+
+def parse_timestamp(value):
+    """Parses an SQLite CURRENT_TIMESTAMP value (UTC) into an aware datetime."""
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc) if value else None
+
+def is_public_request():
+    return request.method in ('GET', 'HEAD') and 'user_id' not in session and '_flashes' not in session
+
+def _client_is_current(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return request.if_modified_since >= last_modified
+    return False
+
+def conditional(validators):
+    """Decorates a view with conditional GET support.
+
+    validators receives the view's arguments and returns (etag, last_modified),
+    or None to serve the view unconditionally (e.g. for a missing product).
+    """
+    def decorator(view):
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            found = validators(*args, **kwargs) if is_public_request() else None
+            if found is None:
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.private = True
+                return response
+
+            etag, last_modified = found
+            if _client_is_current(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or session.modified:
+                    # Errors and anything that touched the session are never shared
+                    response.cache_control.private = True
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config.get('PUBLIC_MAX_AGE', 0)
+            response.cache_control.s_maxage = current_app.config.get('PUBLIC_SHARED_MAX_AGE', 60)
+            response.vary.add('Cookie') # Signed-in users get a different page from the same URL
+            return response
+        return decorated_function
+    return decorator
+
+def catalog_validators(*args, **kwargs):
+    """For pages built from catalog-wide data: changes with every catalog write."""
+    modified_at = get_catalog_modified_at()
+    return (make_etag(request.endpoint, get_catalog_version()),
+            datetime.fromtimestamp(modified_at, timezone.utc) if modified_at else None)
+
+def static_page_validators(*args, **kwargs):
+    """For pages with no database content: changes only with the release."""
+    return make_etag(request.endpoint), None
+
+def product_validators(product_id):
+    """For a product page: changes when the product or one of its related products does."""
+    product = get_product(product_id)
+    if product is None:
+        return None
+    shown = [product] + list(get_related_products(product))
+    # Hashing the rows themselves catches two edits within updated_at's one-second resolution
+    etag = make_etag('product', *(tuple(row) for row in shown))
+    return etag, max(filter(None, (parse_timestamp(row['updated_at']) for row in shown)), default=None)
@@ -1,5 +1,6 @@
 import sqlite3
-import re
+from JENGAMART.migrations import migrate
+from JENGAMART.catalog_io import import_products
 
 def get_db_connection():
     """Establishes a connection to the database."""
@@ -8,42 +9,10 @@ def get_db_connection():
     return conn
 
 def init_db():
-    """Initializes the database and creates the products and categories tables."""
+    """Initializes the database by applying any pending schema migrations."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Create categories table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    # Create products table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            category_id INTEGER NOT NULL,
-            price REAL NOT NULL,
-            description TEXT,
-            image_file TEXT,
-            featured INTEGER DEFAULT 0,
-            FOREIGN KEY (category_id) REFERENCES categories (id)
-        )
-    ''')
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            email TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            is_admin BOOLEAN DEFAULT 0
-        )
-    ''')
-    conn.commit()
+    for version, name in migrate(conn):
+        print(f"Applied migration {version}: {name}")
     conn.close()
     print("Initialized the database.")
 
@@ -77,36 +46,8 @@ def populate_db():
     ]
 
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    for product in products_data:
-        # Get or insert category
-        cursor.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (product['category'],))
-        cursor.execute("SELECT id FROM categories WHERE name = ?", (product['category'],))
-        category_id = cursor.fetchone()['id']
-
-        # Extract numeric part from price string (e.g., "885 KSh" -> 885.0)
-        price_str = product['price']
-        numeric_price = 0.0
-        
-        match = re.match(r'[\d,\.]+', price_str)
-        if match:
-            # Remove commas, then convert to float
-            numeric_price = float(match.group(0).replace(',', ''))
-        
-        # Insert product
-        cursor.execute(
-            "INSERT INTO products (name, category_id, price, image_file, featured) VALUES (?, ?, ?, ?, ?)",
-            (
-                product['name'],
-                category_id,
-                numeric_price, # Use the converted numeric price
-                "placeholder.jpg",
-                product.get('featured', 0)
-            )
-        )
-
-    conn.commit()
+    # Categories are resolved once and products are upserted by name in batches
+    import_products(conn, (dict(product, image_file="placeholder.jpg") for product in products_data))
     conn.close()
     print("Populated the database with initial data.")
 
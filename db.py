@@ -1,18 +1,347 @@
+import os
 import sqlite3
+import threading
+import time
+from pathlib import Path
+from queue import LifoQueue, Empty
+import click
 from flask import g, current_app
+from flask.cli import with_appcontext
+from JENGAMART.migrations import migrate, check_query_plans
+
+# Reads and writes use separate pools.
+#
+# get_read_db() hands out read-only connections (mode=ro, query_only) that
+# open a transaction on checkout, so every query in a request sees one WAL
+# snapshot and never waits on a writer. get_db() is the read-write
+# connection for requests and jobs that change data. Its transactions start
+# with BEGIN IMMEDIATE under a per-process write lock, so writers in one
+# worker queue up in order and SQLite's busy timeout arbitrates between
+# workers. write_transaction() retries a whole transaction that still finds
+# the database locked.
+
+# Pragmas applied once to every new pooled connection. journal_mode=WAL is
+# persistent in the database file; the rest are per connection.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+)
+READ_PRAGMAS = (
+    ('query_only', 'ON'),
+    ('temp_store', 'MEMORY'),
+)
+
+# Statements that make Python's sqlite3 module open a transaction
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'BEGIN')
+
+class SerializedWrites:
+    """Connection mixin that holds the pool's write lock from a transaction's first write until it ends."""
+
+    write_lock = None
+    lock_timeout = 5.0
+    _holds_write_lock = False
+
+    def _begin_write(self, sql):
+        if self._holds_write_lock or self.in_transaction:
+            return
+        if sql.lstrip()[:7].upper().startswith(_WRITE_STATEMENTS):
+            if not self.write_lock.acquire(timeout=self.lock_timeout):
+                raise sqlite3.OperationalError('database is locked (timed out waiting for the write lock)')
+            self._holds_write_lock = True
+
+    def _end_write(self):
+        if self._holds_write_lock and not self.in_transaction:
+            self._holds_write_lock = False
+            self.write_lock.release()
+
+    def execute(self, sql, parameters=()):
+        self._begin_write(sql)
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._end_write()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin_write(sql)
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._end_write()
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            self._end_write()
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._end_write()
+
+class ConnectionPool:
+    """A per-process pool of SQLite connections to one database file.
+
+    A readonly pool opens read-only connections that each hold a snapshot
+    while checked out. Otherwise connections write with BEGIN IMMEDIATE,
+    serialized by the pool's write lock.
+    """
+
+    def __init__(self, database, max_size=5, timeout=10.0, max_age=3600.0,
+                 mmap_size=256 * 1024 * 1024, cache_size=-64 * 1024, factory=sqlite3.Connection,
+                 readonly=False, busy_timeout=5.0):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.readonly = readonly
+        self.busy_timeout = busy_timeout
+        if readonly:
+            self.factory = factory
+        else:
+            self.write_lock = threading.Lock()
+            self.factory = type('Serialized' + factory.__name__, (SerializedWrites, factory),
+                                {'write_lock': self.write_lock, 'lock_timeout': busy_timeout})
+        self.pid = os.getpid()
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._born = {} # id(connection) -> creation time
+        self.checkouts = 0
+        self.waits = 0
+        self.created = 0
+        self.recycled = 0
+
+    def _connect(self):
+        if self.readonly:
+            database, uri, pragmas = Path(self.database).resolve().as_uri() + '?mode=ro', True, READ_PRAGMAS
+        else:
+            database, uri, pragmas = self.database, False, PRAGMAS
+        conn = sqlite3.connect(
+            database,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False, # connections move between request threads
+            factory=self.factory,
+            uri=uri,
+            # Take the write lock when the transaction starts, not when a read upgrades to a write
+            isolation_level='DEFERRED' if self.readonly else 'IMMEDIATE',
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        self._born[id(conn)] = time.monotonic()
+        self.created += 1
+        return conn
+
+    def _discard(self, conn):
+        self._born.pop(id(conn), None)
+        conn.close()
+
+    def acquire(self):
+        """Checks out a connection, opening one if the pool has room."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                with self._lock:
+                    if len(self._born) < self.max_size:
+                        self.checkouts += 1
+                        return self._connect()
+                    self.waits += 1
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except Empty:
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection.')
+
+            if time.monotonic() - self._born.get(id(conn), 0) > self.max_age:
+                # Recycle old connections so a long-lived worker never holds stale state
+                with self._lock:
+                    self._discard(conn)
+                    self.recycled += 1
+                continue
+            with self._lock:
+                self.checkouts += 1
+            return conn
+
+    def acquire_snapshot(self):
+        """Checks out a connection with a read transaction open, pinning one consistent view."""
+        conn = self.acquire()
+        conn.execute('BEGIN')
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """Closes every idle connection. Checked-out connections are left alone."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                return
+            with self._lock:
+                self._discard(conn)
+
+    def stats(self):
+        now = time.monotonic()
+        ages = [now - born for born in self._born.values()]
+        return {
+            'database': self.database,
+            'mode': 'read' if self.readonly else 'write',
+            'pid': self.pid,
+            'max_size': self.max_size,
+            'open': len(ages),
+            'idle': self._idle.qsize(),
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'created': self.created,
+            'recycled': self.recycled,
+            'oldest_connection_age': round(max(ages), 3) if ages else 0.0,
+            'mean_connection_age': round(sum(ages) / len(ages), 3) if ages else 0.0,
+        }
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _reset_pools():
+    # Connections inherited across fork must never be used by the child.
+    # They are dropped without closing so the parent's handles stay intact.
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools)
+
+def get_pool(app=None, readonly=False):
+    """Returns this process's read or write pool for the app's database, creating it on first use."""
+    app = app or current_app
+    key = (app.config['DATABASE'], readonly)
+    pool = _pools.get(key)
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                pool = ConnectionPool(
+                    app.config['DATABASE'],
+                    max_size=app.config.get('DB_READ_POOL_SIZE' if readonly else 'DB_POOL_SIZE', 8 if readonly else 5),
+                    timeout=app.config.get('DB_POOL_TIMEOUT', 10.0),
+                    max_age=app.config.get('DB_POOL_MAX_AGE', 3600.0),
+                    mmap_size=app.config.get('DB_MMAP_SIZE', 256 * 1024 * 1024),
+                    cache_size=app.config.get('DB_CACHE_SIZE', -64 * 1024),
+                    factory=app.config.get('DB_CONNECTION_FACTORY', sqlite3.Connection),
+                    readonly=readonly,
+                    busy_timeout=app.config.get('DB_BUSY_TIMEOUT', 5.0),
+                )
+                _pools[key] = pool
+    return pool
+
+def close_pools():
+    """Closes this process's idle pooled connections, e.g. before forking workers."""
+    with _pools_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+
+def pool_stats():
+    """Returns stats for every pool in this process."""
+    return [pool.stats() for pool in list(_pools.values()) if pool.pid == os.getpid()]
 
 def get_db():
-    """Establishes a connection to the database if not already established."""
+    """Checks out a read-write connection for the current request if not already done."""
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
     return g.db
 
+def get_read_db():
+    """Checks out a read-only snapshot connection for the current request if not already done."""
+    if 'read_db' not in g:
+        g.read_db = get_pool(readonly=True).acquire_snapshot()
+    return g.read_db
+
 def close_db(e=None):
-    """Closes the database connection at the end of the request."""
+    """Returns the request's connections to their pools at the end of the request."""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+    read_db = g.pop('read_db', None)
+    if read_db is not None:
+        get_pool(readonly=True).release(read_db)
+
+def is_busy(error):
+    """True if an OperationalError means another writer held the database for too long."""
+    message = str(error)
+    return message.startswith('database is locked') or message.startswith('database is busy')
+
+def write_transaction(conn, work, attempts=None):
+    """Runs work(conn) and commits, retrying the whole transaction while the database stays locked.
+
+    work must not commit itself and must be safe to run again after a rollback.
+    """
+    attempts = attempts or current_app.config.get('DB_WRITE_ATTEMPTS', 3)
+    delay = current_app.config.get('DB_WRITE_RETRY_DELAY', 0.05)
+    for attempt in range(1, attempts + 1):
+        try:
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if attempt == attempts or not is_busy(e):
+                raise
+            current_app.logger.warning('Database locked, retrying write (attempt %s of %s)', attempt, attempts)
+            time.sleep(delay * 2 ** (attempt - 1))
+
+def get_meta(conn, key, default=0):
+    """Reads an integer counter from the app_meta table."""
+    row = conn.execute('SELECT value FROM app_meta WHERE key = ?', (key,)).fetchone()
+    return row['value'] if row else default
+
+def bump_meta(conn, key):
+    """Increments an app_meta counter. Does not commit."""
+    conn.execute('INSERT INTO app_meta (key, value) VALUES (?, 1) '
+                 'ON CONFLICT(key) DO UPDATE SET value = value + 1', (key,))
+
+def set_meta(conn, key, value):
+    """Stores an integer in the app_meta table. Does not commit."""
+    conn.execute('INSERT INTO app_meta (key, value) VALUES (?, ?) '
+                 'ON CONFLICT(key) DO UPDATE SET value = excluded.value', (key, value))
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """Apply pending database migrations."""
+    applied = migrate(get_db())
+    for version, name in applied:
+        click.echo(f'Applied migration {version}: {name}')
+    if not applied:
+        click.echo('Database is up to date.')
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a hot query falls back to scanning the products, cart or orders tables."""
+    regressions = check_query_plans(get_db())
+    for label, plan in regressions.items():
+        click.echo(f'{label}: ' + ' | '.join(plan), err=True)
+    if regressions:
+        raise SystemExit(1)
+    click.echo('All hot queries use an index.')
+
+def init_app(app):
+    """Registers the teardown handler and CLI commands, and migrates the database."""
+    app.teardown_appcontext(close_db)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(check_query_plans_command)
+    if app.config.get('MIGRATE_ON_STARTUP', True):
+        with app.app_context():
+            migrate(get_db())
@@ -0,0 +1,148 @@
+from JENGAMART.search import build_match_query
+
+# Materialized facets for the inventory sidebar.
+#
+# category_facets keeps, per category, the product count, featured count and
+# price range. price_buckets keeps product counts per (category, price
+# bucket). Triggers on products update both incrementally, so the sidebar
+# reads a handful of summary rows instead of aggregating the catalog. A min
+# or max price is only recomputed when the row holding it changes, with a
+# seek on idx_products_category_price.
+
+# Lower bounds of the price buckets in KSh; the last bucket is open-ended.
+# The bounds are baked into the triggers, so changing them needs a migration.
+PRICE_BUCKETS = (0, 100, 500, 1000, 5000, 10000, 50000)
+
+def bucket_sql(column):
+    """An SQL expression mapping a price to the lower bound of its bucket."""
+    cases = ' '.join(f'WHEN {column} < {upper} THEN {lower}' for lower, upper in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:]))
+    return f'(CASE {cases} ELSE {PRICE_BUCKETS[-1]} END)'
+
+def _add_sql(row):
+    return f'''
+        INSERT INTO category_facets (category_id, product_count, featured_count, min_price, max_price)
+        VALUES ({row}.category_id, 1, COALESCE({row}.featured, 0) != 0, {row}.price, {row}.price)
+        ON CONFLICT (category_id) DO UPDATE SET
+            product_count = product_count + 1,
+            featured_count = featured_count + excluded.featured_count,
+            min_price = MIN(COALESCE(min_price, excluded.min_price), excluded.min_price),
+            max_price = MAX(COALESCE(max_price, excluded.max_price), excluded.max_price);
+        INSERT INTO price_buckets (category_id, bucket, product_count) VALUES ({row}.category_id, {bucket_sql(f'{row}.price')}, 1)
+        ON CONFLICT (category_id, bucket) DO UPDATE SET product_count = product_count + 1;
+    '''
+
+def _remove_sql(row):
+    # Runs after the row has changed, so MIN/MAX already see the new state
+    return f'''
+        UPDATE category_facets SET
+            product_count = product_count - 1,
+            featured_count = featured_count - (COALESCE({row}.featured, 0) != 0),
+            min_price = CASE WHEN {row}.price <= min_price
+                THEN (SELECT MIN(price) FROM products WHERE category_id = {row}.category_id) ELSE min_price END,
+            max_price = CASE WHEN {row}.price >= max_price
+                THEN (SELECT MAX(price) FROM products WHERE category_id = {row}.category_id) ELSE max_price END
+        WHERE category_id = {row}.category_id;
+        UPDATE price_buckets SET product_count = product_count - 1
+        WHERE category_id = {row}.category_id AND bucket = {bucket_sql(f'{row}.price')};
+    '''
+
+FACETS_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS category_facets (
+        category_id INTEGER PRIMARY KEY,
+        product_count INTEGER NOT NULL DEFAULT 0,
+        featured_count INTEGER NOT NULL DEFAULT 0,
+        min_price REAL,
+        max_price REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS price_buckets (
+        category_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        product_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (category_id, bucket)
+    ) WITHOUT ROWID;
+
+    -- Recomputes a category's min/max price with a seek instead of a scan
+    CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category_id, price);
+
+    CREATE TRIGGER IF NOT EXISTS products_facets_ai AFTER INSERT ON products BEGIN
+        {_add_sql('new')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS products_facets_ad AFTER DELETE ON products BEGIN
+        {_remove_sql('old')}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS products_facets_au AFTER UPDATE OF category_id, price, featured ON products
+    WHEN old.category_id IS NOT new.category_id OR old.price IS NOT new.price OR old.featured IS NOT new.featured BEGIN
+        {_remove_sql('old')}
+        {_add_sql('new')}
+    END;
+'''
+
+def rebuild_facets(conn):
+    """Recomputes every facet row from the products table. Does not commit."""
+    conn.execute('DELETE FROM category_facets')
+    conn.execute('INSERT INTO category_facets (category_id, product_count, featured_count, min_price, max_price) '
+                 'SELECT category_id, COUNT(*), SUM(COALESCE(featured, 0) != 0), MIN(price), MAX(price) '
+                 'FROM products GROUP BY category_id')
+    conn.execute('DELETE FROM price_buckets')
+    conn.execute(f'INSERT INTO price_buckets (category_id, bucket, product_count) '
+                 f'SELECT category_id, {bucket_sql("price")} AS bucket, COUNT(*) FROM products GROUP BY category_id, bucket')
+
+def parse_bucket(value):
+    """Returns a valid bucket lower bound from a query string value, or None."""
+    try:
+        bucket = int(value)
+    except (TypeError, ValueError):
+        return None
+    return bucket if bucket in PRICE_BUCKETS else None
+
+def bucket_range(bucket):
+    """Returns (lower, upper) for a bucket; upper is None for the last one."""
+    if bucket is None:
+        return None
+    index = PRICE_BUCKETS.index(bucket)
+    return bucket, PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None
+
+def price_filter_sql(price_range, column='p.price'):
+    """Returns (sql, params) restricting column to a bucket range, for appending to a WHERE clause."""
+    if not price_range:
+        return '', []
+    lower, upper = price_range
+    if upper is None:
+        return f' AND {column} >= ?', [lower]
+    return f' AND {column} >= ? AND {column} < ?', [lower, upper]
+
+def facet_counts(conn, category_id=None, bucket=None):
+    """Returns {'categories': {id: count}, 'buckets': {bucket: count}} for the whole catalog.
+
+    Category counts honour the selected price bucket and bucket counts honour
+    the selected category, so each list shows what selecting an entry yields.
+    """
+    if bucket is None:
+        rows = conn.execute('SELECT category_id, product_count FROM category_facets')
+    else:
+        rows = conn.execute('SELECT category_id, product_count FROM price_buckets WHERE bucket = ?', (bucket,))
+    categories = {row[0]: row[1] for row in rows}
+    if category_id:
+        rows = conn.execute('SELECT bucket, product_count FROM price_buckets WHERE category_id = ?', (category_id,))
+    else:
+        rows = conn.execute('SELECT bucket, SUM(product_count) FROM price_buckets GROUP BY bucket')
+    return {'categories': categories, 'buckets': {row[0]: row[1] for row in rows}}
+
+def search_facet_counts(conn, text, category_id=None, bucket=None):
+    """Like facet_counts(), but over the products matching a search, aggregated from the match set."""
+    match = build_match_query(text)
+    result = {'categories': {}, 'buckets': {}}
+    if not match:
+        return result
+    rows = conn.execute(f'SELECT p.category_id, {bucket_sql("p.price")} AS bucket, COUNT(*) '
+                        f'FROM products_fts f JOIN products p ON p.id = f.rowid '
+                        f'WHERE products_fts MATCH ? GROUP BY p.category_id, bucket', (match,))
+    for row_category, row_bucket, count in rows:
+        if bucket is None or row_bucket == bucket:
+            result['categories'][row_category] = result['categories'].get(row_category, 0) + count
+        if not category_id or row_category == int(category_id):
+            result['buckets'][row_bucket] = result['buckets'].get(row_bucket, 0) + count
+    return result
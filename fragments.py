@@ -0,0 +1,38 @@
+from flask import current_app, session
+from markupsafe import Markup
+from JENGAMART.cache import cached_fragment
+from JENGAMART.facets import PRICE_BUCKETS, bucket_range
+
+# Cached rendered fragments.
+#
+# Product cards and the category sidebar are macros in _fragments.html. Their
+# output depends only on catalog data, so it is cached per product (or per
+# selected category) and catalog version and shared by every user. Cards
+# carry no CSRF token of their own: their buttons submit the page's single
+# cart form (see cart_form() in _macros.html) through form= and formaction=.
+# Signed-out visitors get a login link instead, so public pages never need a
+# session or a token.
+
+FRAGMENTS_TEMPLATE = '_fragments.html'
+
+def _macro(name):
+    # Template.module is built once per loaded template and reused
+    return getattr(current_app.jinja_env.get_template(FRAGMENTS_TEMPLATE).module, name)
+
+def product_card(product, style='grid'):
+    """Renders a product card in one of the styles in _fragments.html ('grid', 'featured' or 'related')."""
+    signed_in = 'user_id' in session
+    return Markup(cached_fragment(('card', style, product['id'], signed_in),
+                                  lambda: str(_macro(f'{style}_card')(product, signed_in))))
+
+def category_sidebar(categories, facets, selected_category_id=None, bucket=None, search_query='', sort=None):
+    """Renders the inventory category and price filters with their counts.
+
+    Only the sidebar without a search is cached, since search text is unbounded.
+    """
+    buckets = [bucket_range(lower) for lower in PRICE_BUCKETS]
+    render = lambda: str(_macro('category_sidebar')(categories, facets, buckets, selected_category_id, bucket,
+                                                    search_query, sort))
+    if search_query:
+        return Markup(render())
+    return Markup(cached_fragment(('sidebar', selected_category_id, bucket, sort), render))
@@ -0,0 +1,127 @@
+import json
+import os
+from functools import lru_cache
+from flask import current_app, url_for
+from JENGAMART.db import get_db
+from JENGAMART.cache import bump_catalog_version
+from JENGAMART.jobs import register, enqueue
+
+# Resized image variants for product uploads.
+#
+# Each upload gets fixed-size variants for the slots the templates render it
+# in, optionally with a WebP copy next to each one. Their paths are recorded
+# as JSON in products.image_variants. Resizing runs as a background job so
+# the admin request returns as soon as the original is saved.
+
+PLACEHOLDER = 'placeholder.jpg'
+VARIANT_DIR = 'variants'
+
+# name -> (width, height, crop). Cropped variants fill the box exactly; the
+# others are scaled down to fit inside it. Sizes are 2x the CSS slot sizes.
+VARIANTS = {
+    'thumb': (100, 100, True),
+    'card': (480, 400, True),
+    'detail': (1200, 1200, False),
+}
+
+@lru_cache(maxsize=None)
+def _pillow():
+    # Imported on first use: only the admin and job workers resize images
+    try:
+        from PIL import Image, ImageOps, features
+    except ImportError: # Pillow is optional; without it templates fall back to the original upload
+        return None
+    return Image, ImageOps, features
+
+def images_dir():
+    return os.path.join(current_app.static_folder, 'images')
+
+def variant_paths(variants):
+    """Returns every file path recorded in an image_variants value."""
+    return list(json.loads(variants).values()) if variants else []
+
+def generate_variants(filename):
+    """Writes the resized variants of an image. Returns {variant: path under images/}, or None."""
+    pillow = _pillow()
+    if pillow is None:
+        return None
+    Image, ImageOps, features = pillow
+    source = os.path.join(images_dir(), filename)
+    try:
+        with Image.open(source) as original:
+            original = ImageOps.exif_transpose(original)
+            has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+            image = original.convert('RGBA' if has_alpha else 'RGB')
+    except (OSError, ValueError) as e:
+        current_app.logger.warning('Cannot create variants for %s: %s', filename, e)
+        return None
+
+    os.makedirs(os.path.join(images_dir(), VARIANT_DIR), exist_ok=True)
+    stem = os.path.splitext(filename)[0]
+    extension, save_format = ('png', 'PNG') if has_alpha else ('jpg', 'JPEG')
+    webp = current_app.config.get('IMAGE_WEBP', True) and features.check('webp')
+    quality = current_app.config.get('IMAGE_QUALITY', 82)
+
+    variants = {}
+    for name, (width, height, crop) in VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)
+        path = f'{VARIANT_DIR}/{stem}-{name}.{extension}'
+        resized.save(os.path.join(images_dir(), path), save_format, quality=quality, optimize=True)
+        variants[name] = path
+        if webp:
+            webp_path = f'{VARIANT_DIR}/{stem}-{name}.webp'
+            resized.save(os.path.join(images_dir(), webp_path), 'WEBP', quality=quality, method=4)
+            variants[f'{name}_webp'] = webp_path
+    return variants
+
+def process_image(filename):
+    """Generates variants for an image and records them on every product using it."""
+    variants = generate_variants(filename)
+    if not variants:
+        return None
+    conn = get_db()
+    # Matching on image_file skips products whose image was replaced in the meantime
+    conn.execute('UPDATE products SET image_variants = ?, updated_at = CURRENT_TIMESTAMP WHERE image_file = ?',
+                 (json.dumps(variants), filename))
+    bump_catalog_version(conn)
+    conn.commit()
+    return variants
+
+@register('process_image')
+def _process_image_job(conn, payload, progress):
+    variants = process_image(payload['filename'])
+    return {'variants': len(variants or ())}
+
+def schedule_processing(filename):
+    """Queues variant generation for an uploaded image and returns the job id, or None if there is nothing to do."""
+    if _pillow() is None or filename == PLACEHOLDER:
+        return None
+    # Upload names are unique, so the file name doubles as the idempotency key
+    return enqueue(get_db(), 'process_image', {'filename': filename}, idempotency_key=filename)
+
+def delete_image(filename, variants=None):
+    """Deletes an uploaded image and its variants. The shared placeholder is never deleted."""
+    if not filename or filename == PLACEHOLDER:
+        return
+    for path in [filename] + variant_paths(variants):
+        try:
+            os.remove(os.path.join(images_dir(), path))
+        except OSError as e:
+            current_app.logger.warning('Error deleting image %s: %s', path, e) # Log it but carry on
+
+def product_image(product, variant='card'):
+    """Returns {'src': url, 'webp': url or None} for the best available image of a product."""
+    filename = product['image_file'] or PLACEHOLDER
+    keys = product.keys() if hasattr(product, 'keys') else ()
+    variants = json.loads(product['image_variants']) if 'image_variants' in keys and product['image_variants'] else {}
+    if variant in variants:
+        return {
+            'src': url_for('static', filename='images/' + variants[variant]),
+            'webp': url_for('static', filename='images/' + variants[f'{variant}_webp'])
+                    if f'{variant}_webp' in variants else None,
+        }
+    return {'src': url_for('static', filename='images/' + filename), 'webp': None}
@@ -0,0 +1,241 @@
+import hmac
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request, current_app, has_app_context, template_rendered, before_render_template, Response, abort
+from JENGAMART.db import pool_stats
+from JENGAMART.cache import catalog_cache_stats, fragment_cache_stats
+from JENGAMART.blueprints.auth import current_user_is_admin, role_check_counts
+
+# Opt-in request and SQL instrumentation.
+#
+# Enabled with INSTRUMENTATION = True (or JENGAMART_INSTRUMENTATION=1). It
+# records per-route latency, SQL statement counts and durations, and
+# template render times. Slow queries are logged with their EXPLAIN QUERY
+# PLAN. Everything is exposed at /metrics in the Prometheus text format, to
+# admins and to scrapers sending METRICS_TOKEN (or JENGAMART_METRICS_TOKEN)
+# as a bearer token. Metrics are per worker process, so scrape each worker
+# or aggregate downstream.
+#
+# Adding ?_profile=1 to a request runs a sampling profiler on it (admins
+# only, or any user in debug mode). The response is replaced by the sampled
+# stacks in folded format, ready for flamegraph tools.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+class Histogram:
+    """A Prometheus-style cumulative histogram keyed by label values."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {} # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self._series.items())
+        for labels, series in items:
+            base = _labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{base}}} {series[-2]}')
+            lines.append(f'{self.name}_sum{{{base}}} {series[-1]:.6f}')
+        return lines
+
+def _labels(names, values):
+    return ','.join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+
+request_latency = Histogram('jengamart_request_duration_seconds', 'Request latency by endpoint.',
+                            ('endpoint', 'method'))
+request_queries = Histogram('jengamart_request_sql_statements', 'SQL statements executed per request.',
+                            ('endpoint',), COUNT_BUCKETS)
+sql_latency = Histogram('jengamart_sql_duration_seconds', 'SQL statement execution time by endpoint.',
+                        ('endpoint',))
+template_latency = Histogram('jengamart_template_render_seconds', 'Template render time.', ('template',))
+responses = Counter() # (endpoint, status) -> count
+slow_queries = Counter() # endpoint -> count
+_counters_lock = threading.Lock() # Guards responses and slow_queries, updated from every request thread
+
+def _count(counter, key):
+    with _counters_lock:
+        counter[key] += 1
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection that times execute() and executemany() and reports slow statements."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, None, time.perf_counter() - start)
+
+    def _record(self, sql, parameters, elapsed):
+        if not has_app_context():
+            return
+        endpoint = _endpoint()
+        sql_latency.observe((endpoint,), elapsed)
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        threshold = current_app.config.get('SLOW_QUERY_SECONDS', 0.05)
+        if elapsed >= threshold:
+            _count(slow_queries, endpoint)
+            current_app.logger.warning('Slow query (%.1f ms) in %s: %s\nPlan: %s', elapsed * 1000, endpoint,
+                                       ' '.join(sql.split()), self._plan(sql, parameters))
+
+    def _plan(self, sql, parameters):
+        if parameters is None or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return 'n/a'
+        try:
+            rows = super().execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            return f'unavailable ({e})'
+        return ' | '.join(row[3] for row in rows)
+
+def _endpoint():
+    try:
+        return request.endpoint or 'unmatched'
+    except RuntimeError: # Outside a request, e.g. a CLI command or background job
+        return 'background'
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval and counts folded stacks."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    if request.args.get('_profile') and (current_app.debug or current_user_is_admin()):
+        g.profiler = SamplingProfiler(threading.get_ident(), current_app.config.get('PROFILE_INTERVAL', 0.005))
+        g.profiler.start()
+
+def _after_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = _endpoint()
+    request_latency.observe((endpoint, request.method), time.perf_counter() - started)
+    request_queries.observe((endpoint,), g.get('sql_statements', 0))
+    _count(responses, (endpoint, response.status_code))
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        return Response(profiler.folded(), mimetype='text/plain')
+    return response
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        template_latency.observe((template.name or 'string',), time.perf_counter() - starts.pop())
+
+def render_metrics():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    with _counters_lock:
+        response_counts, slow_query_counts = sorted(responses.items()), sorted(slow_queries.items())
+    for histogram in (request_latency, request_queries, sql_latency, template_latency):
+        lines.extend(histogram.render())
+
+    lines += ['# HELP jengamart_responses_total Responses by endpoint and status.',
+              '# TYPE jengamart_responses_total counter']
+    lines += [f'jengamart_responses_total{{{_labels(("endpoint", "status"), key)}}} {count}'
+              for key, count in response_counts]
+    lines += ['# HELP jengamart_slow_queries_total Statements slower than SLOW_QUERY_SECONDS.',
+              '# TYPE jengamart_slow_queries_total counter']
+    lines += [f'jengamart_slow_queries_total{{endpoint="{endpoint}"}} {count}'
+              for endpoint, count in slow_query_counts]
+
+    for pool in pool_stats():
+        for key in ('checkouts', 'waits', 'created', 'recycled'):
+            lines.append(f'jengamart_db_pool_{key}_total{{mode="{pool["mode"]}"}} {pool[key]}')
+        for key in ('open', 'idle', 'oldest_connection_age'):
+            lines.append(f'jengamart_db_pool_{key}{{mode="{pool["mode"]}"}} {pool[key]}')
+    for name, cache in (('catalog', catalog_cache_stats()), ('fragment', fragment_cache_stats())):
+        for key in ('hits', 'misses', 'evictions', 'expirations'):
+            lines.append(f'jengamart_{name}_cache_{key}_total {cache[key]}')
+        lines.append(f'jengamart_{name}_cache_size {cache["size"]}')
+    for key, count in role_check_counts().items():
+        lines.append(f'jengamart_role_checks_total{{result="{key}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+def _may_read_metrics():
+    token = current_app.config.get('METRICS_TOKEN', os.environ.get('JENGAMART_METRICS_TOKEN'))
+    authorization = request.authorization
+    if token and authorization and authorization.type == 'bearer':
+        return hmac.compare_digest((authorization.token or '').encode(), token.encode())
+    return current_user_is_admin()
+
+def metrics():
+    # Endpoint names, slow query counts and pool sizes are not for the public
+    if not _may_read_metrics():
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    """Installs instrumentation if INSTRUMENTATION is enabled."""
+    enabled = app.config.get('INSTRUMENTATION', os.environ.get('JENGAMART_INSTRUMENTATION') == '1')
+    if not enabled:
+        return
+    app.config['DB_CONNECTION_FACTORY'] = InstrumentedConnection
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,190 @@
+import json
+import os
+import socket
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from JENGAMART.db import get_db, write_transaction
+
+# Background jobs backed by the jobs table.
+#
+# enqueue() records a job and returns its id; worker threads claim queued jobs
+# with a single UPDATE ... RETURNING, so several gunicorn workers (or a
+# dedicated `flask jobs worker` process) can share the queue without a
+# broker. Handlers report progress as they go. A failed job is retried with
+# exponential backoff until max_attempts, and a job whose worker died is
+# requeued once its lock times out, or failed if that was its last attempt.
+# Idempotency keys make a resubmitted form return the job it already
+# created.
+
+STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+_handlers = {}
+_workers = []
+_wake = threading.Event()
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+def _reset_workers():
+    # Threads do not survive fork; each child starts its own on first request
+    global _workers, _workers_pid, _workers_lock, _wake
+    _workers = []
+    _workers_pid = None
+    _workers_lock = threading.Lock()
+    _wake = threading.Event()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_workers)
+
+def register(kind):
+    """Registers handler(conn, payload, progress) for a job kind. Its return value is stored as the result."""
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+def enqueue(conn, kind, payload, idempotency_key=None, max_attempts=3):
+    """Queues a job and commits. Returns its id, or the id of the job already queued under the same key."""
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    key = f'{kind}:{idempotency_key}' if idempotency_key else None
+
+    def insert(conn):
+        conn.execute('INSERT INTO jobs (kind, payload, idempotency_key, max_attempts, run_after) VALUES (?, ?, ?, ?, ?) '
+                     'ON CONFLICT (idempotency_key) DO NOTHING',
+                     (kind, json.dumps(payload), key, max_attempts, time.time()))
+        if key:
+            return conn.execute('SELECT id FROM jobs WHERE idempotency_key = ?', (key,)).fetchone()['id']
+        return conn.execute('SELECT last_insert_rowid() AS id').fetchone()['id']
+
+    job_id = write_transaction(conn, insert)
+    _wake.set()
+    return job_id
+
+def job_status(row):
+    """Returns a job row as a JSON-friendly dict."""
+    job = {key: row[key] for key in ('id', 'kind', 'status', 'progress', 'total', 'attempts', 'max_attempts',
+                                     'error', 'created_at', 'finished_at')}
+    job['result'] = json.loads(row['result']) if row['result'] else None
+    return job
+
+def get_job(conn, job_id):
+    row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return job_status(row) if row else None
+
+def recent_jobs(conn, limit=10):
+    return [job_status(row) for row in conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))]
+
+def claim(conn, worker_id, lock_timeout=600.0):
+    """Marks the next runnable job as running and returns it, or None if there is none."""
+    def claim_next(conn):
+        now = time.time()
+        # Jobs whose worker stopped heartbeating, e.g. after a crash or a gunicorn timeout, are requeued
+        # unless that was their last attempt: a job may have committed part of its work (bulk reprices do)
+        conn.execute("UPDATE jobs SET status = 'failed', locked_by = NULL, finished_at = CURRENT_TIMESTAMP, "
+                     "error = 'Worker stopped responding on the last attempt' "
+                     "WHERE status = 'running' AND locked_at < ? AND attempts >= max_attempts", (now - lock_timeout,))
+        conn.execute("UPDATE jobs SET status = 'queued', locked_by = NULL "
+                     "WHERE status = 'running' AND locked_at < ?", (now - lock_timeout,))
+        return conn.execute(
+            "UPDATE jobs SET status = 'running', locked_by = ?, locked_at = ?, attempts = attempts + 1 "
+            "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? AND attempts < max_attempts "
+            "ORDER BY run_after, id LIMIT 1) RETURNING *", (worker_id, now, now)).fetchone()
+
+    # Every idle worker polls here, so this is the most contended write
+    return write_transaction(conn, claim_next)
+
+def run_job(conn, job):
+    """Runs a claimed job and records its outcome."""
+    def progress(done, total=None):
+        # Doubles as the heartbeat that keeps the job's lock fresh
+        conn.execute('UPDATE jobs SET progress = ?, total = COALESCE(?, total), locked_at = ? WHERE id = ?',
+                     (done, total, time.time(), job['id']))
+        conn.commit()
+
+    try:
+        result = _handlers[job['kind']](conn, json.loads(job['payload']), progress)
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.exception('Job %s (%s) failed on attempt %s', job['id'], job['kind'], job['attempts'])
+        if job['attempts'] < job['max_attempts']:
+            delay = current_app.config.get('JOB_RETRY_DELAY', 5.0) * 2 ** (job['attempts'] - 1)
+            conn.execute("UPDATE jobs SET status = 'queued', run_after = ?, error = ?, locked_by = NULL WHERE id = ?",
+                         (time.time() + delay, str(e), job['id']))
+        else:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, locked_by = NULL, "
+                         "finished_at = CURRENT_TIMESTAMP WHERE id = ?", (str(e), job['id']))
+        conn.commit()
+        return False
+
+    conn.execute("UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, locked_by = NULL, "
+                 "finished_at = CURRENT_TIMESTAMP WHERE id = ?", (json.dumps(result), job['id']))
+    conn.commit()
+    return True
+
+def work(app, stop=None, once=False):
+    """Claims and runs jobs until stop is set (or the queue is empty, with once=True)."""
+    worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    poll_interval = app.config.get('JOB_POLL_INTERVAL', 1.0)
+    lock_timeout = app.config.get('JOB_LOCK_TIMEOUT', 600.0)
+    while not (stop and stop.is_set()):
+        try:
+            with app.app_context():
+                conn = get_db()
+                job = claim(conn, worker_id, lock_timeout)
+                if job is not None:
+                    run_job(conn, job)
+        except Exception:
+            app.logger.exception('Job worker error')
+            job = None
+        if job is None:
+            if once:
+                return
+            _wake.wait(poll_interval)
+            _wake.clear()
+
+def start_workers(app):
+    """Starts this process's worker threads, once per process."""
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        for number in range(app.config.get('JOB_WORKERS', 1)):
+            thread = threading.Thread(target=work, args=(app,), name=f'jobs-{number}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+        _workers_pid = os.getpid()
+
+jobs_cli = AppGroup('jobs', help='Inspect and run background jobs.')
+
+@jobs_cli.command('worker')
+@click.option('--threads', default=1, show_default=True, help='Worker threads in this process.')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty.')
+def worker_command(threads, once):
+    """Run a dedicated job worker process."""
+    app = current_app._get_current_object()
+    threads = [threading.Thread(target=work, args=(app, None, once), daemon=not once) for _ in range(threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1.0) # Wake up regularly so Ctrl-C is handled
+
+@jobs_cli.command('list')
+@click.option('--limit', default=20, show_default=True)
+def list_command(limit):
+    """Show the most recent jobs."""
+    for job in recent_jobs(get_db(), limit):
+        total = f"/{job['total']}" if job['total'] is not None else ''
+        click.echo(f"#{job['id']} {job['kind']:<14} {job['status']:<10} {job['progress']}{total} "
+                   f"attempts={job['attempts']} {job['error'] or ''}")
+
+def init_app(app):
+    """Registers the jobs CLI and, unless JOB_WORKERS is 0, starts worker threads on the first request."""
+    app.cli.add_command(jobs_cli)
+    if app.config.get('JOB_WORKERS', 1):
+        app.before_request(lambda: start_workers(app))
@@ -0,0 +1,312 @@
+import sqlite3
+from JENGAMART.search import SEARCH_SCHEMA, rebuild_search_index
+from JENGAMART.facets import FACETS_SCHEMA, rebuild_facets
+
+# Versioned schema migrations.
+#
+# Each migration runs once, inside its own BEGIN IMMEDIATE transaction, and is
+# recorded in schema_migrations. Taking the write lock before checking what
+# is applied means several gunicorn workers can start at once safely: the
+# first one migrates and the others find nothing left to do.
+
+BASELINE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        category_id INTEGER NOT NULL,
+        price REAL NOT NULL,
+        description TEXT,
+        image_file TEXT,
+        featured INTEGER DEFAULT 0,
+        FOREIGN KEY (category_id) REFERENCES categories (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        is_admin BOOLEAN DEFAULT 0
+    );
+
+    -- Small key/value counters, such as the catalog version used for cache invalidation
+    CREATE TABLE IF NOT EXISTS app_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+'''
+
+def _baseline(conn):
+    search_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'").fetchone()
+    run_script(conn, BASELINE_SCHEMA + SEARCH_SCHEMA)
+    if not search_exists:
+        rebuild_search_index(conn, commit=False)
+
+def _dedupe_product_names(conn):
+    """Makes product names unique before migration 2 indexes them. Nothing references products yet,
+    so exact copies (from seeding twice) are deleted; other clashes are renamed "<name> (#<id>)"."""
+    conn.execute('''
+        DELETE FROM products WHERE id NOT IN (
+            SELECT MIN(id) FROM products
+            GROUP BY name, category_id, price, description, image_file, featured
+        )
+    ''')
+    duplicates = conn.execute('''
+        SELECT id, name FROM products
+        WHERE name IN (SELECT name FROM products GROUP BY name HAVING COUNT(*) > 1)
+          AND id NOT IN (SELECT MIN(id) FROM products GROUP BY name)
+    ''').fetchall()
+    for product_id, name in duplicates:
+        renamed = f'{name} (#{product_id})'
+        if conn.execute('SELECT 1 FROM products WHERE name = ?', (renamed,)).fetchone():
+            raise sqlite3.IntegrityError(f'Cannot rename duplicate product {name!r} (id {product_id}): '
+                                         f'{renamed!r} is taken')
+        conn.execute('UPDATE products SET name = ? WHERE id = ?', (renamed, product_id))
+
+def _product_indexes(conn):
+    _dedupe_product_names(conn)
+    run_script(conn, '''
+        -- add_product and the catalog import rely on names being unique
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_products_name ON products (name);
+        -- Covers the inventory grid and related products, filtered by category and ordered by name
+        CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id, name, price, image_file);
+        CREATE INDEX IF NOT EXISTS idx_products_featured ON products (featured);
+    ''')
+
+def _facets(conn):
+    run_script(conn, FACETS_SCHEMA)
+    rebuild_facets(conn)
+
+def _related_terms(conn):
+    run_script(conn, '''
+        -- Name token document frequencies, so an incremental related-products update reads no other products
+        CREATE TABLE related_terms (
+            token TEXT PRIMARY KEY,
+            products INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE related_postings (
+            token TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            PRIMARY KEY (token, product_id)
+        ) WITHOUT ROWID;
+        -- Finds a changed product's stored tokens
+        CREATE INDEX idx_related_postings_product ON related_postings (product_id);
+    ''')
+    # Imported here: related.py reaches this module through the database layer
+    from JENGAMART.related import rebuild_terms
+    rebuild_terms(conn)
+
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline),
+    (2, 'product indexes and unique product names', _product_indexes),
+    (3, 'server-side carts', '''
+        CREATE TABLE cart_items (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            added_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, product_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        ) WITHOUT ROWID;
+    '''),
+    (4, 'product image variants', '''
+        -- JSON map of resized variant name -> path under static/images
+        ALTER TABLE products ADD COLUMN image_variants TEXT;
+        -- Keep the inventory grid index covering now that cards read the variants
+        DROP INDEX IF EXISTS idx_products_category;
+        CREATE INDEX idx_products_category ON products (category_id, name, price, image_file, image_variants);
+    '''),
+    (5, 'product modification times', '''
+        -- UTC time of the last change to a product row, for Last-Modified and ETags.
+        -- Every write to products sets it explicitly, since ALTER TABLE cannot add a CURRENT_TIMESTAMP default.
+        ALTER TABLE products ADD COLUMN updated_at TEXT;
+        UPDATE products SET updated_at = CURRENT_TIMESTAMP;
+    '''),
+    (6, 'category and price facets', _facets),
+    (7, 'background jobs', '''
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL, -- JSON arguments for the handler
+            status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+            idempotency_key TEXT UNIQUE,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            result TEXT, -- JSON
+            error TEXT,
+            run_after REAL NOT NULL, -- Unix time; pushed back between retries
+            locked_by TEXT,
+            locked_at REAL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        );
+        -- Workers claim the oldest runnable queued job
+        CREATE INDEX idx_jobs_queue ON jobs (status, run_after);
+    '''),
+    (8, 'related products', '''
+        -- Top neighbours per product, best first, maintained by related.py
+        CREATE TABLE product_related (
+            product_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            related_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (product_id, rank)
+        ) WITHOUT ROWID;
+        -- Finds the products listing a changed product, for incremental updates
+        CREATE INDEX idx_product_related_related ON product_related (related_id);
+        -- Cart co-occurrence for a single product
+        CREATE INDEX idx_cart_items_product ON cart_items (product_id, user_id);
+        -- Product pages fall back to same-category products until the first rebuild has run
+        INSERT INTO jobs (kind, payload, run_after) VALUES ('related', '{"product_ids": null}', 0);
+    '''),
+    (9, 'orders and stock', '''
+        -- Units on hand; NULL means stock is not tracked for the product
+        ALTER TABLE products ADD COLUMN stock INTEGER CHECK (stock >= 0);
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            checkout_token TEXT NOT NULL UNIQUE, -- From the checkout form, so a resubmit finds its order
+            total REAL NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            email TEXT,
+            address TEXT NOT NULL,
+            payment_method TEXT NOT NULL,
+            shipping_method TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        );
+        CREATE INDEX idx_orders_user ON orders (user_id, id);
+        -- Name and price are copied so orders keep what was bought, whatever happens to the product later
+        CREATE TABLE order_lines (
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            unit_price REAL NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            PRIMARY KEY (order_id, product_id),
+            FOREIGN KEY (order_id) REFERENCES orders (id)
+        ) WITHOUT ROWID;
+    '''),
+    (10, 'auth throttle buckets', '''
+        -- One token bucket per throttled subject, e.g. login_ip:203.0.113.7, shared by all workers
+        CREATE TABLE auth_throttle (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL -- Unix time of the last refill
+        ) WITHOUT ROWID;
+    '''),
+    (11, 'related products name terms', _related_terms),
+]
+
+def statements(script):
+    """Splits an SQL script into complete statements, keeping trigger bodies intact."""
+    pending = ''
+    for part in script.split(';'):
+        pending += part + ';'
+        if sqlite3.complete_statement(pending):
+            if pending.strip(' \n\t;'):
+                yield pending.strip()
+            pending = ''
+
+def run_script(conn, script):
+    """Runs a script statement by statement, inside the caller's transaction."""
+    for statement in statements(script):
+        conn.execute(statement)
+
+def applied_versions(conn):
+    return {row[0] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+def migrate(conn):
+    """Applies pending migrations in order. Returns the (version, name) pairs applied."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = []
+    for version, name, migration in MIGRATIONS:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version in applied_versions(conn):
+                conn.rollback()
+                continue
+            if callable(migration):
+                migration(conn)
+            else:
+                run_script(conn, migration)
+            conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise type(e)(f'Migration {version} ({name}) failed: {e}') from e
+        applied.append((version, name))
+    return applied
+
+# Hot queries whose plans must stay on an index. Each maps a label to the SQL
+# and sample parameters that EXPLAIN QUERY PLAN is run with.
+HOT_QUERIES = {
+    'featured products': ('SELECT * FROM products WHERE featured = 1', ()),
+    'products by category': (
+        'SELECT p.id, p.name, p.price, p.image_file, c.name as category_name, c.id as category_id '
+        'FROM products p JOIN categories c ON p.category_id = c.id WHERE p.category_id = ?', (1,)),
+    'related products': (
+        'SELECT p.* FROM product_related r JOIN products p ON p.id = r.related_id '
+        'WHERE r.product_id = ? ORDER BY r.rank LIMIT 4', (1,)),
+    'related products fallback': ('SELECT * FROM products WHERE category_id = ? AND id != ? LIMIT 4', (1, 1)),
+    'product name check': ('SELECT id FROM products WHERE name = ? AND id != ?', ('x', 1)),
+    'category price range': ('SELECT MIN(price), MAX(price) FROM products WHERE category_id = ?', (1,)),
+    'inventory listing': (
+        'SELECT p.id, p.name, p.price, p.image_file, c.name as category_name, c.id as category_id '
+        'FROM products p JOIN categories c ON p.category_id = c.id', ()),
+    'admin listing': (
+        'SELECT p.id, p.name, p.price, c.name as category_name, p.image_file '
+        'FROM products p JOIN categories c ON p.category_id = c.id ORDER BY p.name', ()),
+    'cart lines': (
+        'SELECT p.id, p.name, p.price, p.stock, ci.quantity FROM cart_items ci '
+        'JOIN products p ON p.id = ci.product_id WHERE ci.user_id = ?', (1,)),
+    'cart count': ('SELECT COALESCE(SUM(quantity), 0) FROM cart_items WHERE user_id = ?', (1,)),
+    'cart co-occurrence': (
+        'SELECT a.product_id, b.product_id, COUNT(*) FROM cart_items a '
+        'JOIN cart_items b ON b.user_id = a.user_id AND b.product_id != a.product_id '
+        'WHERE a.product_id = ? GROUP BY a.product_id, b.product_id', (1,)),
+    'order by checkout token': ('SELECT id FROM orders WHERE checkout_token = ? AND user_id = ?', ('x', 1)),
+    'recent orders': (
+        'SELECT o.id, o.total, o.created_at, SUM(l.quantity) AS items FROM orders o '
+        'JOIN order_lines l ON l.order_id = o.id WHERE o.user_id = ? '
+        'GROUP BY o.id ORDER BY o.id DESC LIMIT ?', (1, 10)),
+    'order lines': ('SELECT * FROM order_lines WHERE order_id = ? ORDER BY name', (1,)),
+}
+
+# Tables (and the aliases the hot queries use for them) that must never be scanned row by row
+HOT_TABLES = {'products', 'p', 'cart_items', 'ci', 'a', 'b', 'orders', 'o', 'order_lines', 'l'}
+
+def explain(conn, sql, params=()):
+    """Returns the EXPLAIN QUERY PLAN detail lines for a query."""
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+def check_query_plans(conn, queries=HOT_QUERIES):
+    """Returns {label: plan} for hot queries that fall back to a full scan of a hot table."""
+    regressions = {}
+    for label, (sql, params) in queries.items():
+        plan = explain(conn, sql, params)
+        # A scan is fine only when it walks an index instead of the table itself
+        if any(line.split()[:1] == ['SCAN'] and line.split()[1] in HOT_TABLES and 'INDEX' not in line
+               for line in plan):
+            regressions[label] = plan
+    return regressions
@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left
+from JENGAMART.facets import price_filter_sql
+
+# Keyset (cursor) pagination over products ordered by (category, name, id).
+#
+# A page is filled by walking categories in name order and, within each one,
+# seeking the covering (category_id, name) index past the cursor. Every query
+# is an index range read of at most one page, so the cost of a page does not
+# depend on how deep into the catalog it is.
+
+PAGE_SIZE = 24
+
+def encode_cursor(values):
+    """Encodes a sort key as an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def _bindable(value, kind):
+    # bool is an int to Python but never part of a sort key; ints must fit an SQLite INTEGER
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return kind in (int, float) and -2 ** 63 <= value < 2 ** 63
+    return isinstance(value, kind)
+
+def decode_cursor(cursor, kinds):
+    """Decodes a cursor from encode_cursor(), or returns None if it is missing or malformed.
+
+    kinds gives the expected type of each value (float accepts any number), so
+    a tampered cursor reads as the first page rather than reaching the query.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    if not (isinstance(values, list) and len(values) == len(kinds)
+            and all(_bindable(value, kind) for value, kind in zip(values, kinds))):
+        return None
+    return values
+
+def products_page(conn, categories, cursor=None, limit=PAGE_SIZE, category_id=None, price_range=None):
+    """Returns (products, next_cursor) for one page of the catalog.
+
+    categories is the category list ordered by name. Products carry
+    category_name and category_id like the inventory listing query.
+    price_range is a (lower, upper) price bucket range to filter on.
+    """
+    after = decode_cursor(cursor, (str, str, int))
+    if category_id:
+        categories = [category for category in categories if category['id'] == int(category_id)]
+
+    start = 0
+    if after:
+        start = bisect_left([category['name'] for category in categories], after[0])
+
+    price_sql, price_params = price_filter_sql(price_range)
+    products = []
+    for category in categories[start:]:
+        query = ('SELECT p.id, p.name, p.price, p.image_file, p.image_variants, ? AS category_name, p.category_id '
+                 'FROM products p WHERE p.category_id = ?')
+        query += price_sql
+        params = [category['name'], category['id']] + price_params
+        if after and after[0] == category['name']:
+            query += ' AND (p.name, p.id) > (?, ?)'
+            params.extend(after[1:])
+        # Names are unique, so ordering by name alone already follows the index
+        query += ' ORDER BY p.name LIMIT ?'
+        # Fetch one extra row to know whether another page follows
+        params.append(limit + 1 - len(products))
+        products.extend(conn.execute(query, params).fetchall())
+        if len(products) > limit:
+            break
+
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        return products, encode_cursor([last['category_name'], last['name'], last['id']])
+    return products, None
+
+def group_by_category(products):
+    """Groups one page of products by category name, keeping their order."""
+    grouped = {}
+    for product in products:
+        grouped.setdefault(product['category_name'], []).append(product)
+    return grouped
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import fcntl
+except ImportError: # Not on Windows; slots are then counted per process only
+    fcntl = None
+
+# Bounded password hashing, shared by every worker.
+#
+# Hashes are deliberately slow, so at most PASSWORD_HASH_WORKERS of them run
+# at once across all worker processes. Each slot is an flock()ed file next to
+# the database; the kernel releases a slot if its worker dies, so none leak.
+# A request that cannot get a slot within PASSWORD_HASH_WAIT seconds gets
+# HashingBusy instead of queueing, so a burst of logins sheds load rather
+# than tying up every worker. Without fcntl the limit is per process, which
+# only bounds threaded or ASGI workers. PASSWORD_HASH_METHOD sets the
+# algorithm and cost; hashes made with other parameters are upgraded the
+# next time their owner logs in.
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+SLOT_POLL_INTERVAL = 0.02 # Seconds between attempts to take a slot
+
+class HashingBusy(Exception):
+    """Every hashing slot stayed busy for PASSWORD_HASH_WAIT seconds."""
+
+_local_slots = {}
+_local_slots_lock = threading.Lock()
+
+def _slot_paths():
+    prefix = current_app.config.get('PASSWORD_HASH_LOCK_PREFIX',
+                                    os.path.abspath(current_app.config['DATABASE']) + '.hash-slot')
+    return [f'{prefix}-{number}' for number in range(current_app.config.get('PASSWORD_HASH_WORKERS', 2))]
+
+def _try_file_slot(paths):
+    # Every attempt opens its own descriptor, so the lock also excludes other threads of this process
+    for path in paths:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+    return None
+
+@contextmanager
+def _file_slot(wait):
+    paths = _slot_paths()
+    deadline = time.monotonic() + wait
+    fd = _try_file_slot(paths)
+    while fd is None:
+        if time.monotonic() >= deadline:
+            raise HashingBusy()
+        time.sleep(SLOT_POLL_INTERVAL)
+        fd = _try_file_slot(paths)
+    try:
+        yield
+    finally:
+        os.close(fd) # Releases the lock
+
+@contextmanager
+def _local_slot(wait):
+    workers = current_app.config.get('PASSWORD_HASH_WORKERS', 2)
+    with _local_slots_lock:
+        slots = _local_slots.setdefault(workers, threading.BoundedSemaphore(workers))
+    if not slots.acquire(timeout=wait):
+        raise HashingBusy()
+    try:
+        yield
+    finally:
+        slots.release()
+
+def _run(function, *args):
+    # hashlib releases the GIL while it works, so other threads keep serving meanwhile
+    wait = current_app.config.get('PASSWORD_HASH_WAIT', 2.0)
+    with (_file_slot(wait) if fcntl is not None else _local_slot(wait)):
+        return function(*args)
+
+def hash_method():
+    return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    # werkzeug fills in default parameters, so compare against a real hash's prefix
+    return generate_password_hash('', method).split('$', 1)[0]
+
+def hash_password(password):
+    """Hashes a password with the configured method. Raises HashingBusy under overload."""
+    return _run(generate_password_hash, password, hash_method())
+
+def verify_password(password_hash, password):
+    """Checks a password against its hash. Raises HashingBusy under overload."""
+    return _run(check_password_hash, password_hash, password)
+
+def needs_rehash(password_hash):
+    """True if the hash was made with other parameters than PASSWORD_HASH_METHOD."""
+    return password_hash.split('$', 1)[0] != _hash_prefix(hash_method())
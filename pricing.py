@@ -0,0 +1,136 @@
+from JENGAMART.cache import bump_catalog_version
+from JENGAMART.jobs import register
+from JENGAMART.related import schedule_related
+
+# Set-based bulk repricing and featured updates.
+#
+# Products are changed with UPDATE statements over id ranges instead of one
+# statement per product. Each chunk commits on its own, so the write lock is
+# held for one chunk at a time and readers in other workers are not starved.
+
+CHUNK_SIZE = 1000
+MODES = ('percent', 'absolute')
+
+def _new_price_sql(mode):
+    if mode == 'percent':
+        return 'price * (1 + ? / 100.0)'
+    if mode == 'absolute':
+        return 'MAX(price + ?, 0)'
+    raise ValueError(f'Unknown price change mode: {mode}')
+
+def _filter_sql(category_id=None, featured=None):
+    clauses, params = [], []
+    if category_id is not None:
+        clauses.append('category_id = ?')
+        params.append(category_id)
+    if featured is not None:
+        clauses.append('featured = ?')
+        params.append(int(featured))
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+def validate_price_change(mode, amount):
+    """Raises ValueError if the change could produce a negative price."""
+    _new_price_sql(mode)
+    if mode == 'percent' and amount < -100:
+        raise ValueError('A percentage decrease cannot exceed 100%.')
+
+def preview_price_change(conn, mode, amount, category_id=None, featured=None, ids=None):
+    """Returns the row count and min/max price deltas a change would produce, without writing."""
+    validate_price_change(mode, amount)
+    where, params = _filter_sql(category_id, featured)
+    totals = {'count': 0, 'min_delta': None, 'max_delta': None}
+    for id_clause, id_params in _id_batches(ids):
+        row = conn.execute(
+            f'SELECT COUNT(*) AS count, MIN(delta) AS min_delta, MAX(delta) AS max_delta FROM ('
+            f'SELECT {_new_price_sql(mode)} - price AS delta FROM products WHERE 1=1{id_clause}{where})',
+            [amount] + id_params + params
+        ).fetchone()
+        if not row['count']:
+            continue
+        totals['count'] += row['count']
+        for key, pick in (('min_delta', min), ('max_delta', max)):
+            totals[key] = row[key] if totals[key] is None else pick(totals[key], row[key])
+    return totals
+
+def apply_price_change(conn, mode, amount, category_id=None, featured=None, ids=None,
+                       chunk_size=CHUNK_SIZE, progress=None):
+    """Applies a percentage or absolute price change in committed chunks. Returns rows updated."""
+    validate_price_change(mode, amount)
+    where, params = _filter_sql(category_id, featured)
+    return _update_in_chunks(conn, f'price = {_new_price_sql(mode)}', [amount], where, params, ids,
+                             chunk_size, progress)
+
+def apply_featured_change(conn, featured, chunk_size=CHUNK_SIZE, progress=None):
+    """Sets the featured flag on every product in committed chunks. Returns rows changed."""
+    # Only rows that actually change get a new modification time
+    return _update_in_chunks(conn, 'featured = ?', [int(featured)], ' AND featured IS NOT ?', [int(featured)],
+                             None, chunk_size, progress)
+
+def _update_in_chunks(conn, set_sql, set_params, where, params, ids=None, chunk_size=CHUNK_SIZE, progress=None):
+    """Runs UPDATE products SET set_sql over id ranges, committing each chunk.
+
+    progress, if given, is called with the running count after every chunk.
+    """
+    updated = 0
+    if ids is not None:
+        for id_clause, id_params in _id_batches(ids, chunk_size):
+            cursor = conn.execute(f'UPDATE products SET {set_sql}, updated_at = CURRENT_TIMESTAMP '
+                                  f'WHERE 1=1{id_clause}{where}',
+                                  set_params + id_params + params)
+            updated += _commit_chunk(conn, cursor)
+            if progress:
+                progress(updated)
+        return updated
+
+    last_id = 0
+    while True:
+        # Find the upper bound of the next chunk by walking the primary key
+        bounds = conn.execute(
+            f'SELECT MAX(id) AS upper, COUNT(*) AS n FROM ('
+            f'SELECT id FROM products WHERE id > ?{where} ORDER BY id LIMIT ?)',
+            [last_id] + params + [chunk_size]
+        ).fetchone()
+        if not bounds['n']:
+            break
+        cursor = conn.execute(f'UPDATE products SET {set_sql}, updated_at = CURRENT_TIMESTAMP '
+                              f'WHERE id > ? AND id <= ?{where}',
+                              set_params + [last_id, bounds['upper']] + params)
+        updated += _commit_chunk(conn, cursor)
+        last_id = bounds['upper']
+        if progress:
+            progress(updated)
+    return updated
+
+def _commit_chunk(conn, cursor):
+    bump_catalog_version(conn)
+    conn.commit()
+    return cursor.rowcount
+
+def _id_batches(ids, size=CHUNK_SIZE):
+    """Yields (sql, params) id filters, in batches that stay under SQLite's variable limit."""
+    if ids is None:
+        yield '', []
+        return
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), size):
+        batch = ids[start:start + size]
+        yield f" AND id IN ({','.join('?' for _ in batch)})", batch
+
+@register('reprice')
+def _reprice_job(conn, payload, progress):
+    change = (payload['mode'], payload['amount'], payload.get('category_id'), payload.get('featured'),
+              payload.get('ids'))
+    progress(0, preview_price_change(conn, *change)['count'])
+    updated = apply_price_change(conn, *change, progress=progress)
+    # Price proximity feeds the related-products score. Category-wide changes move prices
+    # together and barely shift it, so only hand-picked products are rescored right away.
+    if updated and payload.get('ids'):
+        schedule_related(conn, payload['ids'])
+    return {'updated': updated}
+
+@register('featured')
+def _featured_job(conn, payload, progress):
+    featured = int(payload['featured'])
+    total = conn.execute('SELECT COUNT(*) AS n FROM products WHERE featured IS NOT ?', (featured,)).fetchone()['n']
+    progress(0, total)
+    return {'updated': apply_featured_change(conn, featured, progress=progress)}
@@ -0,0 +1,278 @@
+import json
+import math
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from JENGAMART.cache import bump_catalog_version
+from JENGAMART.jobs import register, enqueue
+
+# Precomputed related-products recommendations.
+#
+# Each product's top neighbours are stored in product_related, ranked by a
+# score mixing category, name similarity, price proximity and how often the
+# two products share a cart. The product page reads them with one primary
+# key range read. A full rebuild loads the whole catalog and scores
+# candidates for every product. When a few products change, only they, the
+# products that list them, and their new candidates are rescored, and only
+# those rows are read: name token document frequencies and postings are kept
+# in related_terms and related_postings, updated per changed product, and
+# price neighbours come from an index seek. Candidates come from rare shared
+# name tokens, the nearest prices in the same category and cart
+# co-occurrence, so no product is compared with the whole catalog.
+
+RELATED_LIMIT = 8 # Neighbours stored per product; the page shows fewer
+
+# Score weights; each signal is scaled to 0..1 first
+CATEGORY_WEIGHT = 0.35
+NAME_WEIGHT = 0.35
+PRICE_WEIGHT = 0.15
+CART_WEIGHT = 0.15
+
+PRICE_SPAN = 10.0 # Prices this many times apart score 0 for price proximity
+PRICE_NEIGHBOURS = 2 * RELATED_LIMIT # Same-category candidates taken on each side by price
+MAX_TOKEN_PRODUCTS = 256 # Tokens shared by more products than this do not nominate candidates
+CART_SATURATION = 5 # Shared carts at which co-occurrence scores 1
+PROGRESS_EVERY = 500 # Products scored between progress reports during a rebuild
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+IN_BATCH = 500 # Ids bound per IN (...) query
+
+def name_tokens(name):
+    return frozenset(token for token in TOKEN.findall(name.lower()) if len(token) > 1)
+
+def numeric_price(value):
+    # Prices seeded as text (e.g. '885 KSh') take no part in price proximity
+    return float(value) if isinstance(value, (int, float)) else None
+
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), IN_BATCH):
+        batch = ids[start:start + IN_BATCH]
+        yield batch, ', '.join('?' * len(batch))
+
+class Catalog:
+    """An in-memory index of the fields the score uses, loaded once per rebuild."""
+
+    def __init__(self, conn):
+        self.products = {}
+        for product_id, name, category_id, price in conn.execute('SELECT id, name, category_id, price FROM products'):
+            self.products[product_id] = (name_tokens(name), category_id, numeric_price(price))
+        self.document_frequency = document_frequency = Counter(
+            token for tokens, _, _ in self.products.values() for token in tokens)
+        total = max(len(self.products), 1)
+        self.idf = {token: math.log(1 + total / count) for token, count in document_frequency.items()}
+        self.weights = {product_id: sum(self.idf[token] for token in tokens)
+                        for product_id, (tokens, _, _) in self.products.items()}
+        self.postings = defaultdict(list)
+        self.by_category = defaultdict(list)
+        for product_id, (tokens, category_id, price) in self.products.items():
+            for token in tokens:
+                if document_frequency[token] <= MAX_TOKEN_PRODUCTS:
+                    self.postings[token].append(product_id)
+            self.by_category[category_id].append((price or 0.0, product_id))
+        for prices in self.by_category.values():
+            prices.sort()
+
+    def price_neighbours(self, product_id):
+        _, category_id, price = self.products[product_id]
+        prices = self.by_category[category_id]
+        index = bisect_left(prices, (price or 0.0, product_id))
+        window = prices[max(0, index - PRICE_NEIGHBOURS):index + PRICE_NEIGHBOURS + 1]
+        return [neighbour for _, neighbour in window]
+
+    def token_products(self, token):
+        """Returns the products named with token, or nothing for tokens too common to nominate candidates."""
+        return self.postings.get(token, ())
+
+    def candidates(self, product_id, shared_carts):
+        found = set(self.price_neighbours(product_id))
+        for token in self.products[product_id][0]:
+            found.update(self.token_products(token))
+        found.update(shared_carts)
+        found.discard(product_id)
+        return found
+
+    def score(self, product_id, other_id, shared_carts=0):
+        tokens, category_id, price = self.products[product_id]
+        other_tokens, other_category_id, other_price = self.products[other_id]
+        shared = sum(self.idf[token] for token in tokens & other_tokens)
+        union = self.weights[product_id] + self.weights[other_id] - shared
+        name = shared / union if union else 0.0
+        proximity = 0.0
+        if price is not None and other_price is not None and price > 0 and other_price > 0:
+            proximity = max(0.0, 1.0 - abs(math.log(price / other_price)) / math.log(PRICE_SPAN))
+        return (CATEGORY_WEIGHT * (category_id == other_category_id) + NAME_WEIGHT * name
+                + PRICE_WEIGHT * proximity + CART_WEIGHT * min(shared_carts / CART_SATURATION, 1.0))
+
+    def top_related(self, product_id, shared_carts, limit=RELATED_LIMIT):
+        """Returns [(score, related_id)] best first. shared_carts maps product id -> carts shared with it."""
+        scored = [(self.score(product_id, other_id, shared_carts.get(other_id, 0)), other_id)
+                  for other_id in self.candidates(product_id, shared_carts)]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored[:limit]
+
+class CatalogSlice(Catalog):
+    """The same index over just the products an incremental update touches, read on demand."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.products = {}
+        self.idf = {}
+        self.weights = {}
+        self.document_frequency = {}
+        self._candidates = {}
+        # Kept by the facet triggers, so this is one row per category rather than a count of products
+        self.total = max(conn.execute('SELECT COALESCE(SUM(product_count), 0) FROM category_facets').fetchone()[0], 1)
+
+    def load(self, product_ids):
+        """Reads the given products and the frequencies of their name tokens, unless already loaded."""
+        missing = [product_id for product_id in product_ids if product_id not in self.products]
+        for batch, placeholders in _batches(missing):
+            for product_id, name, category_id, price in self.conn.execute(
+                    f'SELECT id, name, category_id, price FROM products WHERE id IN ({placeholders})', batch):
+                self.products[product_id] = (name_tokens(name), category_id, numeric_price(price))
+        tokens = {token for product_id in missing if product_id in self.products
+                  for token in self.products[product_id][0]} - self.idf.keys()
+        for batch, placeholders in _batches(tokens):
+            self.document_frequency.update(self.conn.execute(
+                f'SELECT token, products FROM related_terms WHERE token IN ({placeholders})', batch))
+        for token in tokens:
+            self.idf[token] = math.log(1 + self.total / max(self.document_frequency.get(token, 1), 1))
+        for product_id in missing:
+            if product_id in self.products:
+                self.weights[product_id] = sum(self.idf[token] for token in self.products[product_id][0])
+
+    def price_neighbours(self, product_id):
+        # Two seeks on idx_products_category_price, ordered like the in-memory (price, id) list
+        _, category_id, _ = self.products[product_id]
+        after = self.conn.execute(
+            'SELECT id FROM products WHERE category_id = ? AND (price, id) >= (SELECT price, id FROM products '
+            'WHERE id = ?) ORDER BY price, id LIMIT ?', (category_id, product_id, PRICE_NEIGHBOURS + 1))
+        before = self.conn.execute(
+            'SELECT id FROM products WHERE category_id = ? AND (price, id) < (SELECT price, id FROM products '
+            'WHERE id = ?) ORDER BY price DESC, id DESC LIMIT ?', (category_id, product_id, PRICE_NEIGHBOURS))
+        return [row[0] for row in before] + [row[0] for row in after]
+
+    def token_products(self, token):
+        if self.document_frequency.get(token, 0) > MAX_TOKEN_PRODUCTS:
+            return ()
+        return [row[0] for row in self.conn.execute('SELECT product_id FROM related_postings WHERE token = ?',
+                                                    (token,))]
+
+    def candidates(self, product_id, shared_carts):
+        if product_id not in self._candidates:
+            self._candidates[product_id] = super().candidates(product_id, shared_carts)
+        return self._candidates[product_id]
+
+    def top_related(self, product_id, shared_carts, limit=RELATED_LIMIT):
+        self.load(self.candidates(product_id, shared_carts))
+        return super().top_related(product_id, shared_carts, limit)
+
+def rebuild_terms(conn, catalog=None):
+    """Rewrites the name token postings and document frequencies from a full catalog. Does not commit."""
+    catalog = catalog or Catalog(conn)
+    conn.execute('DELETE FROM related_postings')
+    conn.execute('DELETE FROM related_terms')
+    conn.executemany('INSERT INTO related_postings (token, product_id) VALUES (?, ?)',
+                     [(token, product_id) for product_id, (tokens, _, _) in catalog.products.items()
+                      for token in tokens])
+    conn.executemany('INSERT INTO related_terms (token, products) VALUES (?, ?)',
+                     catalog.document_frequency.items())
+
+def update_terms(conn, product_ids):
+    """Brings the postings and document frequencies of changed or deleted products up to date. Does not commit."""
+    names = {}
+    for batch, placeholders in _batches(product_ids):
+        names.update(conn.execute(f'SELECT id, name FROM products WHERE id IN ({placeholders})', batch))
+    for product_id in product_ids:
+        stored = {row[0] for row in conn.execute('SELECT token FROM related_postings WHERE product_id = ?',
+                                                 (product_id,))}
+        current = name_tokens(names[product_id]) if product_id in names else frozenset()
+        for token in stored - current:
+            conn.execute('DELETE FROM related_postings WHERE token = ? AND product_id = ?', (token, product_id))
+            conn.execute('UPDATE related_terms SET products = products - 1 WHERE token = ?', (token,))
+            conn.execute('DELETE FROM related_terms WHERE token = ? AND products <= 0', (token,))
+        for token in current - stored:
+            conn.execute('INSERT INTO related_postings (token, product_id) VALUES (?, ?)', (token, product_id))
+            conn.execute('INSERT INTO related_terms (token, products) VALUES (?, 1) '
+                         'ON CONFLICT (token) DO UPDATE SET products = products + 1', (token,))
+
+def cart_cooccurrence(conn, product_id=None):
+    """Returns {product_id: {other_id: shared carts}}, for one product or the whole catalog."""
+    query = ('SELECT a.product_id, b.product_id, COUNT(*) FROM cart_items a '
+             'JOIN cart_items b ON b.user_id = a.user_id AND b.product_id != a.product_id')
+    params = ()
+    if product_id is not None:
+        query += ' WHERE a.product_id = ?'
+        params = (product_id,)
+    pairs = defaultdict(dict)
+    for first, second, count in conn.execute(query + ' GROUP BY a.product_id, b.product_id', params):
+        pairs[first][second] = count
+    return pairs
+
+def _store(conn, product_id, related):
+    conn.execute('DELETE FROM product_related WHERE product_id = ?', (product_id,))
+    conn.executemany('INSERT INTO product_related (product_id, rank, related_id, score) VALUES (?, ?, ?, ?)',
+                     [(product_id, rank, related_id, round(score, 6))
+                      for rank, (score, related_id) in enumerate(related)])
+
+def rebuild_related(conn, progress=None):
+    """Recomputes neighbours for every product. Returns the number of products scored.
+
+    Each product's rows are replaced as it is scored, so a progress callback
+    that commits (as job progress does) keeps the write lock short and the
+    old neighbours are served until the new ones land.
+    """
+    catalog = Catalog(conn)
+    rebuild_terms(conn, catalog)
+    carts = cart_cooccurrence(conn)
+    for done, product_id in enumerate(catalog.products, 1):
+        _store(conn, product_id, catalog.top_related(product_id, carts.get(product_id, {})))
+        if progress and done % PROGRESS_EVERY == 0:
+            progress(done)
+    conn.execute('DELETE FROM product_related WHERE product_id NOT IN (SELECT id FROM products) '
+                 'OR related_id NOT IN (SELECT id FROM products)')
+    return len(catalog.products)
+
+def update_related(conn, product_ids):
+    """Rescores the given products and every product whose neighbours they may enter or leave. Does not commit."""
+    update_terms(conn, product_ids)
+    catalog = CatalogSlice(conn)
+    catalog.load(product_ids)
+    affected = set()
+    for product_id in product_ids:
+        affected.update(row[0] for row in conn.execute(
+            'SELECT product_id FROM product_related WHERE related_id = ?', (product_id,)))
+        if product_id in catalog.products:
+            affected.add(product_id)
+            affected.update(catalog.candidates(product_id, cart_cooccurrence(conn, product_id)[product_id]))
+        else:
+            conn.execute('DELETE FROM product_related WHERE product_id = ? OR related_id = ?',
+                         (product_id, product_id))
+    catalog.load(affected)
+    for product_id in affected:
+        if product_id in catalog.products:
+            _store(conn, product_id, catalog.top_related(product_id, cart_cooccurrence(conn, product_id)[product_id]))
+    return len(affected)
+
+@register('related')
+def _related_job(conn, payload, progress):
+    product_ids = payload.get('product_ids')
+    if product_ids is None:
+        progress(0, conn.execute('SELECT COUNT(*) AS n FROM products').fetchone()['n'])
+        scored = rebuild_related(conn, progress)
+    else:
+        scored = update_related(conn, product_ids)
+    bump_catalog_version(conn)
+    conn.commit()
+    return {'scored': scored}
+
+def schedule_related(conn, product_ids=None):
+    """Queues a recompute for some products (or all, with None) unless the same one is already waiting."""
+    payload = json.dumps({'product_ids': sorted(product_ids) if product_ids is not None else None})
+    queued = conn.execute("SELECT id FROM jobs WHERE kind = 'related' AND status = 'queued' AND payload = ?",
+                          (payload,)).fetchone()
+    if queued:
+        return queued['id']
+    return enqueue(conn, 'related', json.loads(payload))
@@ -0,0 +1,148 @@
+import re
+
+# Ranked product search on top of SQLite FTS5.
+#
+# products_fts holds name + description for prefix matching and bm25 ranking.
+# products_trigram holds product names tokenized into trigrams and backs the
+# "did you mean" suggestions, so a misspelled query is answered by an index
+# lookup instead of a difflib scan over the whole catalog.
+# Both are external-content tables over products, kept in sync by triggers.
+
+SUGGESTION_CANDIDATES = 20
+SUGGESTION_CUTOFF = 0.6
+
+# bm25 weights for (name, description): a hit in the name counts for more.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SEARCH_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description,
+        content='products', content_rowid='id',
+        prefix='2 3 4'
+    );
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_trigram USING fts5(
+        name,
+        content='products', content_rowid='id',
+        tokenize='trigram'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS products_search_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        INSERT INTO products_trigram (rowid, name) VALUES (new.id, new.name);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS products_search_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_trigram (products_trigram, rowid, name) VALUES ('delete', old.id, old.name);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS products_search_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_trigram (products_trigram, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        INSERT INTO products_trigram (rowid, name) VALUES (new.id, new.name);
+    END;
+'''
+
+def rebuild_search_index(conn, commit=True):
+    """Re-indexes every product from the products table."""
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO products_trigram (products_trigram) VALUES ('rebuild')")
+    if commit:
+        conn.commit()
+
+def tokenize(text):
+    """Splits text into lowercase word tokens, mirroring the unicode61 tokenizer."""
+    return re.findall(r'\w+', text.lower())
+
+def build_match_query(text):
+    """Turns free text into an FTS5 query where every word must match as a prefix."""
+    return ' '.join(f'"{token}"*' for token in tokenize(text))
+
+def search_products(conn, text, category_id=None, after=None, limit=None, price_range=None):
+    """Returns products matching every word of the query, best matches first.
+
+    Results are ordered by (rank, id); pass the last row's (rank, id) as
+    after to fetch the next page. price_range is a (lower, upper) bucket range.
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+
+    query = '''
+        SELECT p.id, p.name, p.price, p.image_file, p.image_variants, c.name as category_name, c.id as category_id, f.rank
+        FROM products_fts f
+        JOIN products p ON p.id = f.rowid
+        JOIN categories c ON p.category_id = c.id
+        WHERE products_fts MATCH ? AND f.rank MATCH ?
+    '''
+    params = [match, f'bm25({NAME_WEIGHT}, {DESCRIPTION_WEIGHT})']
+    if category_id:
+        query += ' AND p.category_id = ?'
+        params.append(category_id)
+    if price_range:
+        lower, upper = price_range
+        query += ' AND p.price >= ?' + (' AND p.price < ?' if upper is not None else '')
+        params.extend([lower] if upper is None else [lower, upper])
+    if after:
+        query += ' AND (f.rank > ? OR (f.rank = ? AND p.id > ?))'
+        params.extend([after[0], after[0], after[1]])
+    query += ' ORDER BY f.rank, p.id'
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def suggest(conn, text, category_id=None):
+    """Suggests a corrected query for a search that found nothing, or None.
+
+    Candidate names come from the trigram index; only that short list is
+    compared against the query, word by word.
+    """
+    words = tokenize(text)
+    grams = set()
+    for word in words:
+        grams |= _trigrams(word)
+    if not grams:
+        return None
+
+    match = ' OR '.join(f'"{gram}"' for gram in sorted(grams))
+    query = '''
+        SELECT p.name FROM products_trigram t
+        JOIN products p ON p.id = t.rowid
+        WHERE products_trigram MATCH ?
+    '''
+    params = [match]
+    if category_id:
+        query += ' AND p.category_id = ?'
+        params.append(category_id)
+    query += ' ORDER BY rank LIMIT ?'
+    params.append(SUGGESTION_CANDIDATES)
+
+    from difflib import SequenceMatcher # Only needed for misspelled searches; kept off the startup path
+
+    vocabulary = set()
+    for row in conn.execute(query, params):
+        vocabulary.update(tokenize(row['name']))
+    if not vocabulary:
+        return None
+
+    corrected = []
+    for word in words:
+        if word in vocabulary:
+            corrected.append(word)
+            continue
+        best, best_ratio = word, SUGGESTION_CUTOFF
+        for candidate in vocabulary:
+            ratio = SequenceMatcher(None, word, candidate).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = candidate, ratio
+        corrected.append(best)
+
+    suggestion = ' '.join(corrected)
+    return suggestion if suggestion != ' '.join(words) else None
@@ -0,0 +1,131 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from JENGAMART.cache import get_catalog_version
+from JENGAMART.db import get_read_db
+from JENGAMART.pagination import PAGE_SIZE, encode_cursor, decode_cursor
+
+# Columnar catalog snapshot for price-sorted listings.
+#
+# Each worker keeps the id and price of every product in compact arrays
+# sorted by (price, id), once for the whole catalog and once per category.
+# A price range is two binary searches, a page is a slice of the ids, and
+# only that page's ids go to SQL to load the rows the grid shows. The
+# snapshot is tagged with the catalog version it was read at. The first
+# request to see a newer version builds a replacement from its own read
+# snapshot and swaps it in whole; requests arriving meanwhile wait for it
+# rather than building their own. A request still reading an older version
+# builds a snapshot for itself and leaves the newer shared one in place.
+
+# sort query value -> descending
+SORTS = {'price': False, 'price_desc': True}
+
+def parse_sort(value):
+    """Returns a valid sort from a query string value, or None for the default name order."""
+    return value if value in SORTS else None
+
+class PriceIndex:
+    """Product ids and prices sorted by (price, id)."""
+
+    __slots__ = ('ids', 'prices')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.prices = array('d')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def span(self, price_range=None):
+        """Returns the [start, end) positions of prices in a (lower, upper) range; upper None is open."""
+        if not price_range:
+            return 0, len(self.ids)
+        lower, upper = price_range
+        start = bisect_left(self.prices, lower)
+        end = len(self.ids) if upper is None else bisect_left(self.prices, upper, start)
+        return start, end
+
+    def position(self, price, product_id):
+        """Returns how many entries sort before (price, product_id)."""
+        start = bisect_left(self.prices, price)
+        end = bisect_right(self.prices, price, start)
+        # Equal prices are ordered by id
+        return bisect_left(self.ids, product_id, start, end)
+
+    def page(self, price_range=None, descending=False, after=None, limit=PAGE_SIZE):
+        """Returns (ids, next_key) for the page following the (price, id) key after.
+
+        next_key is the page's last (price, id), or None on the last page.
+        """
+        start, end = self.span(price_range)
+        if descending:
+            if after:
+                end = max(start, min(end, self.position(*after)))
+            first, last = max(start, end - limit), end
+            more, edge = first > start, first
+        else:
+            if after:
+                # Skip the cursor entry itself
+                start = min(end, max(start, self.position(after[0], after[1] + 1)))
+            first, last = start, min(end, start + limit)
+            more, edge = last < end, last - 1
+        ids = self.ids[first:last]
+        if descending:
+            ids.reverse()
+        return ids, (self.prices[edge], self.ids[edge]) if more and ids else None
+
+class CatalogSnapshot:
+    """Price indexes for the whole catalog and each category, read at one catalog version."""
+
+    def __init__(self, conn, version):
+        self.version = version
+        self.catalog = PriceIndex()
+        self.by_category = {}
+        for product_id, category_id, price in conn.execute('SELECT id, category_id, price FROM products '
+                                                           'ORDER BY price, id'):
+            for index in (self.catalog, self.by_category.setdefault(category_id, PriceIndex())):
+                index.ids.append(product_id)
+                # Prices stored as text by the original seed script sort after every number, as in SQL
+                index.prices.append(price if isinstance(price, (int, float)) else float('inf'))
+
+    def index(self, category_id=None):
+        if category_id is None:
+            return self.catalog
+        return self.by_category.get(category_id) or PriceIndex()
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot():
+    """Returns the snapshot for the current catalog version, rebuilding it if the catalog changed."""
+    global _snapshot
+    conn = get_read_db()
+    version = get_catalog_version(conn)
+    snapshot = _snapshot
+    if snapshot is None or version > snapshot.version:
+        with _snapshot_lock:
+            snapshot = _snapshot
+            if snapshot is None or version > snapshot.version:
+                snapshot = _snapshot = CatalogSnapshot(conn, version)
+    if version < snapshot.version:
+        # This request's read snapshot predates the shared one; it must not see rows it cannot load
+        return CatalogSnapshot(conn, version)
+    return snapshot
+
+def hydrate(conn, ids):
+    """Loads the grid rows for product ids, in the given order."""
+    if not ids:
+        return []
+    rows = conn.execute(
+        'SELECT p.id, p.name, p.price, p.image_file, p.image_variants, c.name AS category_name, p.category_id '
+        f'FROM products p JOIN categories c ON c.id = p.category_id WHERE p.id IN ({", ".join("?" * len(ids))})',
+        list(ids)).fetchall()
+    by_id = {row['id']: row for row in rows}
+    return [by_id[product_id] for product_id in ids if product_id in by_id]
+
+def price_sorted_page(conn, sort, cursor=None, limit=PAGE_SIZE, category_id=None, price_range=None):
+    """Returns (products, next_cursor) for one page ordered by price. The cursor is [price, id]."""
+    after = decode_cursor(cursor, (float, int))
+    index = get_snapshot().index(int(category_id) if category_id else None)
+    ids, next_key = index.page(price_range, SORTS[sort], after, limit)
+    return hydrate(conn, ids), encode_cursor(list(next_key)) if next_key else None
@@ -0,0 +1,43 @@
+document.addEventListener('DOMContentLoaded', () => {
+    // A "Load more" link with data-infinite-scroll points at the container to fill
+    // and data-next-url at a JSON endpoint returning {html, next_url}. Without
+    // JavaScript the link still works as a plain link to the next page.
+    document.querySelectorAll('[data-infinite-scroll]').forEach((link) => {
+        const container = document.querySelector(link.dataset.infiniteScroll);
+        let loading = false;
+
+        const loadNextPage = () => {
+            const nextUrl = link.dataset.nextUrl;
+            if (loading || !nextUrl) {
+                return;
+            }
+            loading = true;
+            fetch(nextUrl, { headers: { 'Accept': 'application/json' } })
+                .then((response) => response.json())
+                .then((page) => {
+                    container.insertAdjacentHTML('beforeend', page.html);
+                    if (page.next_url) {
+                        link.dataset.nextUrl = page.next_url;
+                    } else {
+                        link.remove();
+                        observer.disconnect();
+                    }
+                })
+                .finally(() => {
+                    loading = false;
+                });
+        };
+
+        const observer = new IntersectionObserver((entries) => {
+            if (entries.some((entry) => entry.isIntersecting)) {
+                loadNextPage();
+            }
+        }, { rootMargin: '400px' });
+        observer.observe(link);
+
+        link.addEventListener('click', (event) => {
+            event.preventDefault();
+            loadNextPage();
+        });
+    });
+});
@@ -0,0 +1,30 @@
+document.addEventListener('DOMContentLoaded', () => {
+    // Rows with data-job-url belong to unfinished background jobs. Each one polls
+    // its status endpoint and updates its status, progress bar and details until
+    // the job succeeds or fails.
+    const POLL_INTERVAL = 1500;
+
+    document.querySelectorAll('[data-job-url]').forEach((row) => {
+        const field = (name) => row.querySelector(`[data-job-field="${name}"]`);
+
+        const poll = () => {
+            fetch(row.dataset.jobUrl, { headers: { 'Accept': 'application/json' } })
+                .then((response) => response.json())
+                .then((job) => {
+                    const percent = job.total ? Math.round(100 * job.progress / job.total)
+                        : (job.status === 'succeeded' ? 100 : 0);
+                    field('status').textContent = job.status;
+                    field('bar').style.width = `${percent}%`;
+                    field('bar').textContent = job.total === null ? job.progress : `${job.progress} / ${job.total}`;
+                    if (job.status === 'succeeded' || job.status === 'failed') {
+                        field('details').textContent = job.error
+                            || (job.result && job.result.updated !== undefined ? `${job.result.updated} updated` : '');
+                        return;
+                    }
+                    setTimeout(poll, POLL_INTERVAL);
+                })
+                .catch(() => setTimeout(poll, POLL_INTERVAL * 4));
+        };
+        poll();
+    });
+});
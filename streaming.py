@@ -0,0 +1,34 @@
+from flask import current_app, get_flashed_messages, render_template, stream_template
+from flask_wtf.csrf import generate_csrf
+
+# Streamed HTML for large pages.
+#
+# stream_page() sends a template while it renders, so the header and sidebar
+# reach the browser before the grid below them has been rendered. Output is
+# grouped into chunks of at least STREAM_CHUNK_SIZE characters, so a page is
+# a handful of writes rather than one per template statement. The response
+# headers, and with them the session cookie, are sent before the first
+# chunk, so anything the template would store in the session (consuming
+# flashed messages, creating the CSRF token) is done before streaming starts.
+# STREAM_TEMPLATES = False renders the whole page first instead.
+
+def _chunked(parts, size):
+    buffer, length = [], 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def stream_page(template_name, **context):
+    """Returns a response that renders template_name as it is sent."""
+    if not current_app.config.get('STREAM_TEMPLATES', True):
+        return render_template(template_name, **context)
+    get_flashed_messages() # Kept on the request for the template, removed from the session now
+    generate_csrf()
+    parts = stream_template(template_name, **context)
+    return current_app.response_class(_chunked(parts, current_app.config.get('STREAM_CHUNK_SIZE', 8192)),
+                                      mimetype='text/html')
@@ -0,0 +1,51 @@
+import importlib.util
+import sys
+from pathlib import Path
+import pytest
+
+# The repository root is the JENGAMART package itself. When it is not
+# installed under that name, load it from here so `JENGAMART.*` imports work.
+ROOT = Path(__file__).resolve().parent.parent
+if importlib.util.find_spec('JENGAMART') is None:
+    spec = importlib.util.spec_from_file_location('JENGAMART', ROOT / '__init__.py',
+                                                  submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['JENGAMART'] = module
+    spec.loader.exec_module(module)
+
+from JENGAMART.app import create_app
+from JENGAMART.db import close_pools, get_db
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh, migrated database, with no background workers or warm-up."""
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'jengamart.db'),
+        'JOB_WORKERS': 0,
+        'WARM_ON_STARTUP': False,
+        'BUILD_ASSETS_ON_STARTUP': False,
+        'AUTH_THROTTLE': False,
+        'WTF_CSRF_ENABLED': False,
+    })
+    yield app
+    close_pools()
+
+@pytest.fixture
+def conn(app):
+    """The app's read-write connection, inside an app context."""
+    with app.app_context():
+        yield get_db()
+
+@pytest.fixture
+def catalog(conn):
+    """Seeds a category, two products with stock, one untracked product and a user. Returns their ids."""
+    category_id = conn.execute("INSERT INTO categories (name) VALUES ('Tools') RETURNING id").fetchone()['id']
+    ids = {}
+    for name, price, stock in (('Hammer', 10.0, 5), ('Saw', 25.0, 1), ('Gift card', 50.0, None)):
+        ids[name] = conn.execute('INSERT INTO products (name, category_id, price, stock) VALUES (?, ?, ?, ?) '
+                                 'RETURNING id', (name, category_id, price, stock)).fetchone()['id']
+    ids['user'] = conn.execute("INSERT INTO users (username, email, password_hash) "
+                               "VALUES ('buyer', 'buyer@example.com', 'x') RETURNING id").fetchone()['id']
+    conn.commit()
+    return ids
@@ -0,0 +1,15 @@
+from flask import g, session
+from JENGAMART.blueprints.auth import current_user_is_admin, role_check_counts
+
+def test_role_check_reads_from_the_read_pool(app, catalog, conn):
+    conn.execute('UPDATE users SET is_admin = 1 WHERE id = ?', (catalog['user'],))
+    conn.commit()
+    before = role_check_counts()
+    with app.app_context(), app.test_request_context(): # A fresh g, without the fixture's connection
+        session['user_id'] = catalog['user']
+        assert current_user_is_admin()
+        assert 'db' not in g # No write connection was checked out
+        assert current_user_is_admin() # Now answered from the session
+    after = role_check_counts()
+    assert after['reloaded'] == before['reloaded'] + 1
+    assert after['cached'] == before['cached'] + 1
@@ -0,0 +1,50 @@
+import pytest
+from JENGAMART.cart import add_item, cart_count
+from JENGAMART.checkout import CheckoutError, OutOfStock, get_order, place_order
+
+DETAILS = {'first_name': 'Amina', 'last_name': 'Otieno', 'email': 'buyer@example.com', 'address': '1 Moi Avenue',
+           'payment_method': 'mpesa', 'shipping_method': 'pickup'}
+
+def stock(conn, product_id):
+    return conn.execute('SELECT stock FROM products WHERE id = ?', (product_id,)).fetchone()['stock']
+
+def test_resubmitted_checkout_returns_the_same_order(conn, catalog):
+    user = catalog['user']
+    add_item(conn, user, catalog['Hammer'], 2)
+    add_item(conn, user, catalog['Gift card'])
+    conn.commit()
+
+    order_id, created = place_order(conn, user, 'token-1', DETAILS)
+    assert created
+    assert stock(conn, catalog['Hammer']) == 3
+    assert stock(conn, catalog['Gift card']) is None
+    assert cart_count(conn, user) == 0
+
+    # The cart is filled again, but the resubmitted form must not order it
+    add_item(conn, user, catalog['Hammer'])
+    conn.commit()
+    assert place_order(conn, user, 'token-1', DETAILS) == (order_id, False)
+    assert stock(conn, catalog['Hammer']) == 3
+    assert cart_count(conn, user) == 1
+
+    order, lines = get_order(conn, order_id, user)
+    assert order['total'] == 70.0
+    assert {line['name']: line['quantity'] for line in lines} == {'Hammer': 2, 'Gift card': 1}
+
+def test_out_of_stock_changes_nothing(conn, catalog):
+    user = catalog['user']
+    add_item(conn, user, catalog['Hammer'], 2)
+    add_item(conn, user, catalog['Saw'], 2)
+    conn.commit()
+
+    with pytest.raises(OutOfStock) as error:
+        place_order(conn, user, 'token-2', DETAILS)
+    assert [line['name'] for line in error.value.lines] == ['Saw']
+    assert stock(conn, catalog['Hammer']) == 5
+    assert stock(conn, catalog['Saw']) == 1
+    assert cart_count(conn, user) == 4
+    assert conn.execute('SELECT COUNT(*) AS n FROM orders').fetchone()['n'] == 0
+
+def test_empty_cart_cannot_be_ordered(conn, catalog):
+    with pytest.raises(CheckoutError):
+        place_order(conn, catalog['user'], 'token-3', DETAILS)
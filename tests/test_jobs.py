@@ -0,0 +1,73 @@
+import time
+import pytest
+from JENGAMART import jobs
+
+@jobs.register('test-fail')
+def fail(conn, payload, progress):
+    raise RuntimeError(payload['message'])
+
+@jobs.register('test-ok')
+def succeed(conn, payload, progress):
+    progress(1, 1)
+    return {'doubled': payload['value'] * 2}
+
+@pytest.fixture
+def queue(app, conn):
+    # Only the jobs a test enqueues, not the related-products rebuild queued by the migrations
+    conn.execute('DELETE FROM jobs')
+    conn.commit()
+    app.config['JOB_RETRY_DELAY'] = 0
+    return conn
+
+def test_successful_job_stores_its_result(queue):
+    job_id = jobs.enqueue(queue, 'test-ok', {'value': 21})
+    job = jobs.claim(queue, 'worker')
+    assert job['id'] == job_id and job['attempts'] == 1
+    assert jobs.run_job(queue, job)
+    assert jobs.get_job(queue, job_id) | {'created_at': None, 'finished_at': None} == {
+        'id': job_id, 'kind': 'test-ok', 'status': 'succeeded', 'progress': 1, 'total': 1, 'attempts': 1,
+        'max_attempts': 3, 'error': None, 'created_at': None, 'finished_at': None, 'result': {'doubled': 42}}
+
+def test_idempotency_key_returns_the_queued_job(queue):
+    first = jobs.enqueue(queue, 'test-ok', {'value': 1}, idempotency_key='form-1')
+    assert jobs.enqueue(queue, 'test-ok', {'value': 2}, idempotency_key='form-1') == first
+
+def test_failing_job_is_retried_until_max_attempts(queue):
+    job_id = jobs.enqueue(queue, 'test-fail', {'message': 'boom'}, max_attempts=2)
+
+    job = jobs.claim(queue, 'worker')
+    assert not jobs.run_job(queue, job)
+    retried = jobs.get_job(queue, job_id)
+    assert (retried['status'], retried['attempts'], retried['error']) == ('queued', 1, 'boom')
+
+    job = jobs.claim(queue, 'worker')
+    assert job['attempts'] == 2
+    assert not jobs.run_job(queue, job)
+    assert jobs.get_job(queue, job_id)['status'] == 'failed'
+    assert jobs.claim(queue, 'worker') is None
+
+def test_retry_waits_for_its_backoff(app, queue):
+    app.config['JOB_RETRY_DELAY'] = 60
+    jobs.enqueue(queue, 'test-fail', {'message': 'boom'})
+    assert not jobs.run_job(queue, jobs.claim(queue, 'worker'))
+    assert jobs.claim(queue, 'worker') is None
+
+def test_stale_job_is_requeued_or_failed_on_its_last_attempt(queue):
+    retry = jobs.enqueue(queue, 'test-ok', {'value': 1}, max_attempts=3)
+    last = jobs.enqueue(queue, 'test-ok', {'value': 2}, max_attempts=1)
+    # Both were claimed by a worker that stopped heartbeating an hour ago
+    queue.execute("UPDATE jobs SET status = 'running', attempts = 1, locked_by = 'dead', locked_at = ?",
+                  (time.time() - 3600,))
+    queue.commit()
+
+    job = jobs.claim(queue, 'worker', lock_timeout=600)
+    assert (job['id'], job['attempts']) == (retry, 2)
+    stale = jobs.get_job(queue, last)
+    assert stale['status'] == 'failed' and stale['attempts'] == 1
+    assert jobs.claim(queue, 'worker', lock_timeout=600) is None
+
+def test_claim_skips_jobs_without_attempts_left(queue):
+    job_id = jobs.enqueue(queue, 'test-ok', {'value': 1}, max_attempts=1)
+    queue.execute('UPDATE jobs SET attempts = 1 WHERE id = ?', (job_id,))
+    queue.commit()
+    assert jobs.claim(queue, 'worker') is None
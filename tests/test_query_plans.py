@@ -0,0 +1,14 @@
+from JENGAMART.migrations import HOT_QUERIES, HOT_TABLES, check_query_plans, explain
+
+def test_hot_queries_use_indexes(conn):
+    assert check_query_plans(conn) == {}
+
+def test_no_hot_query_scans_a_hot_table(conn):
+    for label, (sql, params) in HOT_QUERIES.items():
+        for line in explain(conn, sql, params):
+            words = line.split()
+            assert not (words[0] == 'SCAN' and words[1] in HOT_TABLES and 'INDEX' not in line), (label, line)
+
+def test_check_query_plans_flags_a_table_scan(conn):
+    queries = {'orders by total': ('SELECT id FROM orders WHERE total > ?', (0,))}
+    assert list(check_query_plans(conn, queries)) == ['orders by total']
@@ -0,0 +1,22 @@
+from JENGAMART import snapshot
+from JENGAMART.cache import get_catalog_version
+from JENGAMART.db import get_read_db
+
+def test_older_reader_keeps_the_newer_shared_snapshot(app, catalog, monkeypatch):
+    with app.test_request_context():
+        version = get_catalog_version(get_read_db())
+        newer = snapshot.CatalogSnapshot(get_read_db(), version + 1)
+        monkeypatch.setattr(snapshot, '_snapshot', newer)
+
+        own = snapshot.get_snapshot()
+        assert own.version == version and own is not newer
+        assert snapshot._snapshot is newer
+
+def test_newer_version_replaces_the_shared_snapshot(app, catalog, monkeypatch):
+    with app.test_request_context():
+        version = get_catalog_version(get_read_db())
+        monkeypatch.setattr(snapshot, '_snapshot', snapshot.CatalogSnapshot(get_read_db(), version - 1))
+
+        current = snapshot.get_snapshot()
+        assert current.version == version and snapshot._snapshot is current
+        assert snapshot.get_snapshot() is current
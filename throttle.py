@@ -0,0 +1,60 @@
+import math
+import os
+import random
+import time
+from flask import current_app
+
+# Token-bucket throttling for login and registration, shared by every worker.
+#
+# Each bucket is one auth_throttle row, refilled by elapsed time and spent
+# by a single UPSERT ... RETURNING, so workers never race on a
+# read-modify-write. Attempts are refused while a bucket is empty, and
+# refused attempts keep it empty, so a client hammering the form stays shut
+# out until it backs off. Checks run before any password is hashed.
+# AUTH_THROTTLE = False (or JENGAMART_AUTH_THROTTLE=0) turns it off, e.g. for
+# load tests that log in many sessions from one address.
+
+# Bucket name -> (config key, default (capacity, seconds to refill completely))
+BUCKETS = {
+    'login_ip': ('LOGIN_IP_THROTTLE', (20, 60.0)),
+    'login_account': ('LOGIN_ACCOUNT_THROTTLE', (5, 300.0)),
+    'register_ip': ('REGISTER_IP_THROTTLE', (5, 600.0)),
+}
+
+PRUNE_PROBABILITY = 0.01 # Share of checks that also delete long-idle buckets
+
+def _limits(bucket):
+    key, default = BUCKETS[bucket]
+    capacity, period = current_app.config.get(key, default)
+    return capacity, capacity / period
+
+def take(conn, bucket, subject):
+    """Spends one token from a bucket. Returns 0 if allowed, else seconds until it may be retried. Does not commit."""
+    capacity, rate = _limits(bucket)
+    now = time.time()
+    tokens = conn.execute(
+        'INSERT INTO auth_throttle (key, tokens, updated_at) VALUES (?, ? - 1, ?) '
+        'ON CONFLICT (key) DO UPDATE SET '
+        'tokens = MAX(MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - 1, -1), '
+        'updated_at = excluded.updated_at RETURNING tokens',
+        (f'{bucket}:{subject}', capacity, now, capacity, rate)).fetchone()[0]
+    if random.random() < PRUNE_PROBABILITY:
+        prune(conn, now)
+    # An attempt needs a whole token to spend
+    return 0 if tokens >= 0 else math.ceil((1 - tokens) / rate)
+
+def prune(conn, now=None):
+    """Deletes buckets idle long enough to have refilled completely. Does not commit."""
+    longest = max(current_app.config.get(key, default)[1] for key, default in BUCKETS.values())
+    conn.execute('DELETE FROM auth_throttle WHERE updated_at < ?', ((now or time.time()) - longest,))
+
+def enabled():
+    return current_app.config.get('AUTH_THROTTLE', os.environ.get('JENGAMART_AUTH_THROTTLE') != '0')
+
+def check(conn, *buckets):
+    """Spends a token from each (bucket, subject) and commits. Returns 0 if all allowed, else the longest wait."""
+    if not enabled():
+        return 0
+    wait = max(take(conn, bucket, subject) for bucket, subject in buckets)
+    conn.commit()
+    return wait
@@ -0,0 +1,46 @@
+import gc
+import sqlite3
+from flask import render_template
+from JENGAMART.db import close_pools
+from JENGAMART.cache import get_featured_products, get_categories, get_facet_counts
+from JENGAMART.fragments import category_sidebar
+from JENGAMART.snapshot import get_snapshot
+
+# Startup warm-up for preforking servers.
+#
+# With gunicorn --preload the app is built once in the master and each worker
+# is forked from it. Whatever is loaded before the fork is then shared
+# copy-on-write instead of being rebuilt by every worker on its first
+# requests: compiled templates, the static asset manifest, catalog cache
+# entries, the price snapshot and the rendered public fragments. The database connections opened
+# here are closed again so none cross the fork, and gc.freeze() keeps the
+# collector from writing to (and so copying) the shared pages. Without
+# --preload each worker simply warms itself at import. WARM_ON_STARTUP = False
+# skips all of it.
+
+def compile_templates(app):
+    """Loads every template so each is parsed and compiled once. Returns the number loaded."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def warm_catalog(app):
+    """Fills the catalog cache and price snapshot and renders the home page and default sidebar fragments."""
+    with app.test_request_context('/'):
+        categories = get_categories()
+        category_sidebar(categories, get_facet_counts())
+        render_template('index.html', featured_products=get_featured_products())
+        get_snapshot()
+
+def warm_up(app):
+    """Compiles templates, hashes static files and loads the catalog before workers are forked."""
+    compile_templates(app)
+    app.extensions['asset_manifest'].build(compress=False)
+    try:
+        warm_catalog(app)
+    except sqlite3.Error as e:
+        # e.g. a database that `flask migrate` has not created yet
+        app.logger.warning('Skipped catalog warm-up: %s', e)
+    close_pools()
+    gc.freeze()